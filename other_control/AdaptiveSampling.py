@@ -0,0 +1,107 @@
+"""
+Adaptive Wavelength Sampling
+
+Overview:
+A uniform wavelength grid spends most of its points on flat parts of a spectrum while narrow cavity dips stay
+under-sampled. AdaptiveSampler starts from a coarse uniform grid and then keeps inserting new wavelengths in
+the middle of the interval where the measured curve bends or rises most, until a point budget or a tolerance
+is reached.
+
+1. Loss:
+   Wavelength and signal are both rescaled to [0, 1]. Every interval between two measured points gets the
+   larger of two losses:
+   - curvature: the expected error of linear interpolation across it, dx**2 * |y''| / 8, with the curvature y''
+     estimated from the neighbouring points; large around dips and edges, zero where the curve is straight.
+   - slope: dx * |dy| = dx**2 * |y'|, the area under the interval's rise; large on steep flanks even where they
+     are straight, so the wavelength position of a flank is resolved as well as its shape.
+   Both shrink at least fourfold when an interval is split, and both are zero on flat stretches however wide.
+   The interval with the largest loss is split next, so refinement stops once every interval is below the
+   tolerance (a fraction of the signal range), without spending the rest of the budget. Intervals next to a
+   failed measurement (NaN) have no usable loss and are not refined.
+
+2. Usage:
+   Iterate over the sampler to get the wavelengths to measure and call `tell` with each result before asking
+   for the next one:
+
+       sampler = AdaptiveSampler(1500, 1510, coarse_points=21, max_points=100, tolerance=0.02)
+       for wl in sampler:
+           sampler.tell(wl, measure(wl))
+"""
+
+import numpy as np
+
+
+class AdaptiveSampler:
+    def __init__(self, start, stop, coarse_points, max_points, tolerance=0.0, min_spacing=0.0):
+        """
+        :param start: First wavelength of the scan range.
+        :param stop: Last wavelength of the scan range.
+        :param coarse_points: Number of points of the initial uniform grid.
+        :param max_points: Total point budget, including the coarse grid.
+        :param tolerance: Stop refining once the largest interval loss drops below this value.
+        :param min_spacing: Never split intervals narrower than twice this wavelength spacing.
+        """
+        self.start = start
+        self.stop = stop
+        self.coarse = list(np.linspace(start, stop, coarse_points))
+        self.max_points = max_points
+        self.tolerance = tolerance
+        self.min_spacing = min_spacing
+        self.x = []
+        self.y = []
+
+    def tell(self, x, y):
+        """Record the measured value `y` at wavelength `x`."""
+        self.x.append(x)
+        self.y.append(y)
+
+    def losses(self):
+        """
+        :return: (sorted wavelengths, loss of every interval between consecutive sorted wavelengths)
+        """
+        order = np.argsort(self.x)
+        x = np.asarray(self.x)[order]
+        y = np.asarray(self.y)[order]
+
+        span = abs(self.stop - self.start) or 1.0
+        y_range = np.nanmax(y) - np.nanmin(y) if np.isfinite(y).any() else 0.0
+        dx = np.diff(x) / span
+        dy = np.diff(y) / (y_range or 1.0)
+
+        # Second derivative at the interior points, in rescaled units
+        curvature = np.zeros(len(x))
+        if len(x) > 2:
+            slope = dy / np.where(dx > 0, dx, np.inf)
+            curvature[1:-1] = np.abs(2 * np.diff(slope) / (dx[:-1] + dx[1:]))
+        # fmax ignores the curvature at an end next to a failed measurement; the interval's own rise is NaN
+        # only if one of its ends failed
+        interpolation_error = dx ** 2 * np.fmax(curvature[:-1], curvature[1:]) / 8
+        rise = dx * np.abs(dy)
+        loss = np.where(np.isnan(rise), np.nan, np.fmax(interpolation_error, rise))
+
+        return x, loss
+
+    def ask(self):
+        """
+        :return: The next wavelength to measure, or None once the budget or the tolerance is reached.
+        """
+        if len(self.x) >= self.max_points:
+            return None
+        if self.coarse:
+            return self.coarse.pop(0)
+        if len(self.x) < 2:
+            return None
+
+        x, loss = self.losses()
+        loss[np.isnan(loss) | (np.diff(x) < 2 * self.min_spacing)] = 0
+        k = int(np.argmax(loss))
+        if loss[k] <= self.tolerance:
+            return None
+        return 0.5 * (x[k] + x[k + 1])
+
+    def __iter__(self):
+        while True:
+            x = self.ask()
+            if x is None:
+                return
+            yield x
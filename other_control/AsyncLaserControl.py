@@ -0,0 +1,91 @@
+"""
+Asyncio Laser Control
+
+Overview:
+adjust_motor_scan, adjust_piezo and homelaser in LaserControl block their thread in `time.sleep` while the laser
+drifts or settles, so one process homes one laser at a time and reads nothing else meanwhile. This module has
+coroutine versions of the same routines for an asyncio event loop. They run the very same control loops as the
+blocking versions (the *_steps generators of LaserControl and SettleDetection), only with the asyncio driver of
+ControlSteps, so both versions behave alike by construction.
+
+1. Coroutines:
+   - get_avg_wavelength_async, adjust_motor_scan_async, adjust_piezo_async, homelaser_async: same arguments and
+     results as their blocking counterparts.
+   - wait_for_laser_async: the drift wait, with an optional SettleDetector evaluated between non-blocking reads.
+   Blocking instrument calls (wavemeter reads, laser get/set) run on worker threads (asyncio.to_thread), waits are
+   `asyncio.sleep`, so other coroutines, e.g. a monitor of another instrument, keep running in between.
+
+2. Several Lasers:
+   `home_lasers(jobs)` homes several lasers concurrently, each with its own laser session and wavemeter (or
+   wavemeter channel); `run_homing(jobs)` does the same from blocking code. Phases booked to a PhaseTimer are
+   wall-clock time and include time the event loop spent on other coroutines.
+"""
+
+import asyncio
+import time
+
+from ControlSteps import run_steps_async
+from LaserControl import adjust_motor_scan_steps, adjust_piezo_steps, get_avg_wavelength_steps, homelaser_steps
+from PhaseTimer import NULL_TIMER
+from SettleDetection import wait_for_laser_steps
+
+
+async def get_avg_wavelength_async(wm, measure_time, timer=NULL_TIMER, precision=None, clock=time):
+    """
+    Coroutine version of get_avg_wavelength.
+
+    :return: The outlier-rejected average wavelength (WavelengthAverage, with count and spread).
+    """
+    return await run_steps_async(get_avg_wavelength_steps(wm, measure_time, timer, precision, clock))
+
+
+async def wait_for_laser_async(wm, timeout, detector=None, timer=NULL_TIMER, clock=time):
+    """
+    Coroutine version of wait_for_laser.
+
+    :return: Wavelength in nm.
+    """
+    return await run_steps_async(wait_for_laser_steps(wm, timeout, detector, timer, clock))
+
+
+async def adjust_motor_scan_async(laser, wm, target, precision, drift_time, max_iterations,P_m=1.13,I_m=0.5,D_m=0, timer=NULL_TIMER, settle=None, clock=time):
+    """
+    Coroutine version of adjust_motor_scan.
+
+    :return: Number of iterations taken to achieve the target.
+    """
+    return await run_steps_async(adjust_motor_scan_steps(laser, wm, target, precision, drift_time, max_iterations, P_m, I_m, D_m, timer, settle, clock))
+
+
+async def adjust_piezo_async(laser, wm, target, precision, measure_time, drift_time, max_iterations,P_p=0.9,I_p=0.4,D_p=0, iter_limit =0, timer=NULL_TIMER, settle=None, slope=None, clock=time):
+    """
+    Coroutine version of adjust_piezo.
+
+    :return: Number of iterations taken to achieve the target.
+    """
+    return await run_steps_async(adjust_piezo_steps(laser, wm, target, precision, measure_time, drift_time, max_iterations, P_p, I_p, D_p, iter_limit, timer, settle, slope, clock))
+
+
+async def homelaser_async(laser, wm, target, measure_time=15, motor_scan_precision=0.001, precision=0.00002, drift_time=4,P_m=1.13,I_m=0.5,D_m=0,P_p=0.9,I_p=0.4,D_p=0, timer=NULL_TIMER, settle=None, clock=time):
+    """
+    Coroutine version of homelaser.
+
+    :return: Number of iterations taken for both motor and piezo adjustments.
+    """
+    return await run_steps_async(homelaser_steps(laser, wm, target, measure_time, motor_scan_precision, precision, drift_time, P_m, I_m, D_m, P_p, I_p, D_p, timer, settle, clock))
+
+
+async def home_lasers(jobs):
+    """
+    Home several lasers concurrently.
+
+    :param jobs: Iterable of dictionaries with the keyword arguments of homelaser_async for every laser
+                 (at least 'laser', 'wm' and 'target').
+    :return: List of (motor_iterations, piezo_iterations), in the order of `jobs`.
+    """
+    return await asyncio.gather(*(homelaser_async(**job) for job in jobs))
+
+
+def run_homing(jobs):
+    """Blocking entry point for home_lasers."""
+    return asyncio.run(home_lasers(jobs))
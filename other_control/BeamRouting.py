@@ -0,0 +1,101 @@
+"""
+Beam Routing Between Reference and Sample Arms
+
+Overview:
+A single-pass scan homes the laser once per wavelength and then measures the reference arm and the sample arm
+back to back on the same power meter. The routers below switch the light between the two arms; all of them
+share the BeamRouter interface, so the scan code does not care which hardware does the switching.
+
+1. BeamRouter:
+   `select(arm)` with arm 'reference' or 'sample'. Switching is skipped when the arm is already selected, and
+   `settle_time` seconds are waited after every real switch. It is an abstract base class: a router without
+   `_route` fails when it is created, not in the middle of a scan.
+
+2. Implementations:
+   - AttenuatorRouter: one JDS HA9 attenuator per arm; the output of the unused arm is disabled
+     (the attenuator's `state` feature, i.e. its internal beam block).
+   - SwitchRouter: any optical switch, driven by a callable that receives the arm name.
+   - LocalRouter: stand-in without hardware that only records the selected arm, for the simulated instruments
+     and tests. It moves no light, so the spyrelet does not offer it for real scans.
+"""
+
+import time
+from abc import ABC, abstractmethod
+
+
+class BeamRouter(ABC):
+    arms = ('reference', 'sample')
+
+    def __init__(self, settle_time=0.0):
+        self.settle_time = settle_time
+        self.arm = None
+
+    @abstractmethod
+    def _route(self, arm):
+        """Switch the hardware to `arm`."""
+
+    def select(self, arm):
+        """Route the light to `arm` ('reference' or 'sample')."""
+        if arm not in self.arms:
+            raise ValueError(f"Unknown arm '{arm}', expected one of {self.arms}.")
+        if arm == self.arm:
+            return
+        self._route(arm)
+        self.arm = arm
+        if self.settle_time:
+            time.sleep(self.settle_time)
+
+    def close(self):
+        pass
+
+
+class AttenuatorRouter(BeamRouter):
+    def __init__(self, reference_attenuator, sample_attenuator, settle_time=0.5):
+        """
+        :param reference_attenuator: Initialized JDSHA9 in the reference arm.
+        :param sample_attenuator: Initialized JDSHA9 in the sample arm.
+        :param settle_time: Time to wait after switching, in seconds.
+        """
+        super().__init__(settle_time)
+        self.attenuators = {'reference': reference_attenuator, 'sample': sample_attenuator}
+
+    def _route(self, arm):
+        # Block the unused arm first so both arms are never open at the same time
+        for name, attenuator in self.attenuators.items():
+            if name != arm:
+                attenuator.state = 'OFF'
+        self.attenuators[arm].state = 'ON'
+
+    def close(self):
+        for attenuator in self.attenuators.values():
+            attenuator.finalize()
+
+
+class SwitchRouter(BeamRouter):
+    def __init__(self, set_arm, settle_time=0.1):
+        """
+        :param set_arm: Callable that switches the optical switch to the arm passed as its only argument.
+        :param settle_time: Time to wait after switching, in seconds.
+        """
+        super().__init__(settle_time)
+        self.set_arm = set_arm
+
+    def _route(self, arm):
+        self.set_arm(arm)
+
+
+class LocalRouter(BeamRouter):
+    def __init__(self, settle_time=0.0, on_switch=None):
+        """
+        :param settle_time: Simulated switching time, in seconds.
+        :param on_switch: Optional callable notified with the arm name, e.g. a simulated power meter.
+        """
+        super().__init__(settle_time)
+        self.on_switch = on_switch
+        self.switch_count = 0
+
+    def _route(self, arm):
+        self.switch_count += 1
+        print(f'Local router: beam routed to {arm} arm.')
+        if self.on_switch is not None:
+            self.on_switch(arm)
@@ -0,0 +1,165 @@
+"""
+Concurrent Instrument Sampling
+
+Overview:
+Reading the wavemeter and the power meter one after the other makes every sample cost the sum of both
+instrument latencies. ConcurrentSampler polls each instrument on its own worker thread and timestamps every
+reading, so a block of samples costs roughly the latency of the slowest instrument.
+
+1. ConcurrentSampler Class:
+   Takes a dictionary of reader callables (one per instrument). `acquire(n)` lets every reader take `n`
+   readings concurrently and returns the values and their timestamps. The workers take their k-th readings
+   together: each reading starts at a barrier shared by all workers, so a fast instrument waits for the slow one
+   instead of running ahead, and reading k of every stream belongs to round k. `acquire_paired` therefore pairs
+   the streams round by round and keeps every reading; the time offsets of the pairs are recorded for
+   diagnostics. Every reader has a worker thread that
+   waits for batch requests; between `start()` and `stop()` (or inside a `with` block) the workers persist over
+   all batches, so sampling in many small batches does not start new threads. Outside of them `acquire` starts
+   and stops the workers for the one batch.
+
+2. pair_by_time:
+   Pairs every reading of a reference stream with the nearest-in-time reading of another stream and returns
+   the time offset of each pair, for streams that are not read in step (e.g. block readouts).
+"""
+
+import queue
+import threading
+import time
+import numpy as np
+
+
+def timed_read(reader):
+    """
+    Call `reader` and timestamp the reading with the midpoint of the call.
+
+    :return: (value, timestamp) with the timestamp from time.perf_counter.
+    """
+    t0 = time.perf_counter()
+    value = reader()
+    t1 = time.perf_counter()
+    return value, 0.5 * (t0 + t1)
+
+
+def pair_by_time(t_ref, t_other):
+    """
+    For every timestamp in `t_ref`, find the index of the nearest timestamp in `t_other` (sorted).
+
+    :return: (indices into t_other, time offsets t_other[index] - t_ref in seconds)
+    """
+    t_ref = np.asarray(t_ref)
+    t_other = np.asarray(t_other)
+    if len(t_other) == 1:
+        index = np.zeros(len(t_ref), dtype=int)
+    else:
+        right = np.clip(np.searchsorted(t_other, t_ref), 1, len(t_other) - 1)
+        left = right - 1
+        index = np.where(np.abs(t_other[left] - t_ref) <= np.abs(t_other[right] - t_ref), left, right)
+    return index, t_other[index] - t_ref
+
+
+class ConcurrentSampler:
+    def __init__(self, readers):
+        """
+        :param readers: Dictionary mapping a stream name to a callable returning one float reading.
+        """
+        self.readers = dict(readers)
+        self.requests = {}
+        self.results = queue.SimpleQueue()
+        self.barrier = threading.Barrier(len(self.readers))
+        self.threads = []
+
+    def _worker(self, name, requests):
+        reader = self.readers[name]
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            n, interval = request
+            values, stamps = np.zeros(n), np.zeros(n)
+            try:
+                for k in range(n):
+                    self.barrier.wait()
+                    values[k], stamps[k] = timed_read(reader)
+                    if interval:
+                        time.sleep(interval)
+            except threading.BrokenBarrierError as e:
+                # Another worker failed and broke the barrier; its error is reported instead
+                self.results.put((name, e))
+            except Exception as e:
+                self.barrier.abort()
+                self.results.put((name, e))
+            else:
+                self.results.put((name, (values, stamps)))
+
+    def start(self):
+        """Start one worker thread per reader; they serve every acquire until stop()."""
+        if self.threads:
+            return
+        self.requests = {name: queue.SimpleQueue() for name in self.readers}
+        self.threads = [threading.Thread(target=self._worker, args=(name, requests), daemon=True)
+                        for name, requests in self.requests.items()]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for requests in self.requests.values():
+            requests.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def acquire(self, n, interval=0):
+        """
+        Take `n` readings from every reader, all readers running concurrently.
+
+        :param n: Number of readings per reader.
+        :param interval: Optional pause between two readings of the same reader, in seconds.
+        :return: Dictionary name -> (values, timestamps), both float arrays of length n.
+        """
+        temporary = not self.threads
+        if temporary:
+            self.start()
+        try:
+            self.barrier.reset()
+            for requests in self.requests.values():
+                requests.put((n, interval))
+            results = {}
+            errors = []
+            for _ in self.requests:
+                name, result = self.results.get()
+                if isinstance(result, Exception):
+                    errors.append(result)
+                else:
+                    results[name] = result
+        finally:
+            if temporary:
+                self.stop()
+        if errors:
+            errors.sort(key=lambda error: isinstance(error, threading.BrokenBarrierError))
+            raise errors[0]
+        return {name: results[name] for name in self.readers}
+
+    def acquire_paired(self, n, reference, interval=0):
+        """
+        Acquire `n` readings per reader and pair every stream to the `reference` stream round by round.
+
+        :param reference: Name of the stream the other streams are aligned to.
+        :return: Dictionary with the `n` readings of every stream, the reference timestamps under 'time', and
+                 '<name>_offset' with the time offset of every pair in seconds.
+        """
+        results = self.acquire(n, interval)
+        values_ref, t_ref = results[reference]
+        paired = {reference: values_ref, 'time': t_ref}
+        for name, (values, stamps) in results.items():
+            if name == reference:
+                continue
+            paired[name] = values
+            paired[name + '_offset'] = stamps - t_ref
+        return paired
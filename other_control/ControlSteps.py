@@ -0,0 +1,77 @@
+"""
+Control Loops Shared by Blocking and Asyncio Code
+
+Overview:
+The homing routines (LaserControl) and the settle wait (SettleDetection) are needed both as blocking functions and
+as coroutines (AsyncLaserControl). Instead of keeping two copies of every loop, each loop is written once as a
+generator that yields the instrument calls and waits it needs rather than performing them. A driver performs every
+request and sends the result back into the generator, so the same loop body runs blocking or on an event loop.
+
+1. Requests:
+   - Call(function, *args): a blocking call, e.g. a wavemeter reading or a laser get/set; its return value is sent
+     back. An exception it raises is thrown into the generator at the same point.
+   - Sleep(seconds, clock): a wait; `clock` is the time module or a drop-in for it (e.g. SimClock.time_module).
+   Sub-loops are combined with `yield from`, and the generator's return value is the result of the driver.
+
+2. Drivers:
+   - run_steps: performs the calls directly and waits with `clock.sleep`.
+   - run_steps_async: runs the calls on a worker thread (asyncio.to_thread) and waits with `asyncio.sleep`, so
+     other coroutines keep running in between. A clock other than the time module is slept on a worker thread.
+"""
+
+import asyncio
+import time
+
+
+class Call:
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+
+class Sleep:
+    def __init__(self, seconds, clock=time):
+        self.seconds = seconds
+        self.clock = clock
+
+
+def run_steps(steps):
+    """
+    Run the control loop `steps` blocking.
+
+    :return: The return value of the generator.
+    """
+    send, value = steps.send, None
+    while True:
+        try:
+            request = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if isinstance(request, Sleep):
+                value = request.clock.sleep(request.seconds)
+            else:
+                value = request.function(*request.args)
+            send = steps.send
+        except Exception as e:
+            send, value = steps.throw, e
+
+
+async def run_steps_async(steps):
+    """Coroutine version of run_steps."""
+    send, value = steps.send, None
+    while True:
+        try:
+            request = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if isinstance(request, Sleep) and request.clock is time:
+                value = await asyncio.sleep(request.seconds)
+            elif isinstance(request, Sleep):
+                value = await asyncio.to_thread(request.clock.sleep, request.seconds)
+            else:
+                value = await asyncio.to_thread(request.function, *request.args)
+            send = steps.send
+        except Exception as e:
+            send, value = steps.throw, e
@@ -0,0 +1,55 @@
+"""
+PID Correction Steps of the Homing Loops
+
+Overview:
+One correction of the motor set point or of the piezo voltage, as done in every iteration of adjust_motor_scan and
+adjust_piezo (LaserControl and its asyncio version). They only need NumPy, so PIDTuner runs the very same steps
+against its simulated laser without the lab environment.
+
+1. Functions:
+   - motor_step: new motor set point from the PID output, clamped to the motor range [1490, 1580]nm.
+   - piezo_step: new piezo voltage from the PID output, converted to volts with the fixed -0.001338nm/V or with a
+     PiezoSlopeEstimator, clamped to [30, 110]V.
+   Both work on scalars and, with a vectorized PID such as PIDTuner.VectorPID, on arrays of controllers.
+"""
+
+import numpy as np
+
+
+def motor_step(pid, setting, current):
+    """
+    One PID step of the motor scan.
+
+    :param setting: Current motor wavelength set point in nm.
+    :param current: Measured wavelength in nm.
+    :return: (set point to apply, clamped to the motor range; unclamped set point)
+    """
+    new_motor = setting + pid.compute(current)
+    clamped_motor = np.clip(new_motor, 1490, 1580)
+    if np.any(clamped_motor != new_motor):
+        print(f"Warning: motor was clamped to remain within [1490, 1580] range.")
+    return clamped_motor, new_motor
+
+
+def piezo_step(pid, piezo, avg, slope=None):
+    """
+    One PID step of the piezo adjustment. In the neighborhood of 70V, 1V increase in piezo voltage changes
+    the wavelength by -0.001338nm; with a PiezoSlopeEstimator the local slope at `piezo` is used instead.
+
+    :param piezo: Current piezo voltage in V.
+    :param avg: Measured average wavelength in nm.
+    :param slope: Optional PiezoSlopeEstimator.
+    :return: Piezo voltage to apply, clamped to [30, 110]V.
+    """
+    # The adaptive PID computes the adjustment
+    adjustment = pid.compute(avg)
+    if slope is None:
+        new_piezo = piezo - np.round(adjustment / 0.001338, 3)
+    else:
+        new_piezo = piezo + np.round(slope.volts_for(adjustment, piezo), 3)
+
+    clamped_piezo_voltage = np.clip(new_piezo, 30, 110)
+
+    if np.any(clamped_piezo_voltage != new_piezo):
+        print(f"Warning: Piezo voltage was clamped to remain within [0, 140]V range.")
+    return clamped_piezo_voltage
@@ -0,0 +1,137 @@
+"""
+Streaming Time-Tag Histogram
+
+Overview:
+Bins SNSPD stop times in bulk instead of one event at a time. Stop times can be handed over as NumPy
+arrays, lists, or memory-mapped .npy files, and are accumulated chunk by chunk so a run with tens of
+millions of tags never needs a second full-size copy in memory.
+
+1. StreamingHistogram Class:
+   Accumulates counts for one or more channels. Every tag is converted to a bin number with the same
+   rule and operation order as the old per-event loop, int(tdiff * timebase * bincount / period), and
+   out-of-range tags are treated as that loop treated them: tags that land at or beyond `bincount` are
+   dropped, a negative bin number counts from the end of the histogram (the loop indexed a Python list),
+   and a tag more than one window before zero or a non-finite tag raises IndexError / ValueError. With
+   `fold=True` the tags are first folded modulo `period`, so several excitation periods can be stacked
+   into one histogram.
+
+2. save:
+   Writes the histogram with np.savez(out_name/index.npz, hist, wls[, extra_data]), i.e. the same
+   arr_0/arr_1/arr_2 layout the analysis scripts already read.
+"""
+
+import os
+import numpy as np
+
+
+class StreamingHistogram:
+    def __init__(self, timebase, bincount, period, channels=1, fold=False, chunk_size=1 << 22):
+        """
+        :param timebase: Duration of one time-tag unit, in the same unit as `period`.
+        :param bincount: Number of histogram bins spanning one period.
+        :param period: Histogram window (and folding period when `fold` is True).
+        :param channels: Number of detector channels accumulated side by side.
+        :param fold: Fold every tag into [0, period) before binning.
+        :param chunk_size: Maximum number of tags processed at once; bounds the size of temporaries.
+        """
+        self.timebase = timebase
+        self.bincount = int(bincount)
+        self.period = period
+        self.channels = int(channels)
+        self.fold = fold
+        self.chunk_size = int(chunk_size)
+        self.hist = np.zeros((self.channels, self.bincount), dtype=np.int64)
+        self.n_events = 0
+
+    def reset(self):
+        """Clear the accumulated counts."""
+        self.hist[:] = 0
+        self.n_events = 0
+
+    def _bin_numbers(self, stops):
+        scaled = np.asarray(stops, dtype=np.float64) * self.timebase
+        if self.fold:
+            scaled = np.mod(scaled, self.period)
+        # Same order as int(tdiff * timebase * bincount / period), so bin edges round exactly as before
+        scaled = scaled * self.bincount / self.period
+        if not np.all(np.isfinite(scaled)):
+            raise ValueError("Stop times must be finite.")
+        # Clip before the cast so huge tags cannot overflow int64: the old loop dropped every tag beyond the
+        # window and failed on every tag more than a window before zero, which the clipped values still do
+        scaled = np.clip(scaled, -self.bincount - 1, self.bincount)
+        # np.trunc mirrors int(), i.e. rounds towards zero
+        bins = np.trunc(scaled).astype(np.int64)
+        if np.any(bins < -self.bincount):
+            raise IndexError(f"Stop time {np.min(stops)} is more than one histogram window before zero.")
+        # The old loop added to hist[binNumber], so a negative bin number counted from the end
+        return np.where(bins < 0, bins + self.bincount, bins)
+
+    def accumulate(self, stoparray, channel=0):
+        """
+        Add a block of stop times to the histogram.
+
+        :param stoparray: Array-like (or memory-mapped array) of stop times in units of `timebase`.
+        :param channel: Channel index for the whole block, or an integer array with one channel per tag.
+        :return: The number of tags that fell inside the histogram window.
+        :raises ValueError, IndexError: For a non-finite tag or one more than a window before zero; the chunks
+                                        before the offending one have already been added.
+        """
+        stoparray = np.asarray(stoparray).ravel()
+        per_tag_channel = np.ndim(channel) > 0
+        if per_tag_channel:
+            channel = np.asarray(channel).ravel()
+            if channel.shape != stoparray.shape:
+                raise ValueError("channel must be a scalar or have one entry per stop time.")
+
+        binned = 0
+        flat = self.hist.reshape(-1)
+        for start in range(0, len(stoparray), self.chunk_size):
+            bins = self._bin_numbers(stoparray[start:start + self.chunk_size])
+            keep = bins < self.bincount
+            if per_tag_channel:
+                ch = channel[start:start + self.chunk_size]
+                keep &= (ch >= 0) & (ch < self.channels)
+                flat_index = ch[keep].astype(np.int64) * self.bincount + bins[keep]
+                flat += np.bincount(flat_index, minlength=flat.size)
+            else:
+                self.hist[channel] += np.bincount(bins[keep], minlength=self.bincount)
+            binned += int(np.count_nonzero(keep))
+
+        self.n_events += len(stoparray)
+        return binned
+
+    def accumulate_file(self, path, channel=0):
+        """
+        Memory-map a .npy file of stop times and accumulate it chunk by chunk.
+
+        :param path: Path to a .npy file.
+        :param channel: Same as for `accumulate`.
+        :return: The number of tags that fell inside the histogram window.
+        """
+        stoparray = np.load(path, mmap_mode='r')
+        return self.accumulate(stoparray, channel=channel)
+
+    def save(self, out_name, index, wls, extra_data=False, channel=None):
+        """
+        Store the histogram as out_name/index.npz in the createHistogram layout.
+
+        :param out_name: Output directory.
+        :param index: File index, usually the wavelength point.
+        :param wls: Wavelength data stored next to the histogram.
+        :param extra_data: Optional third array; skipped when False.
+        :param channel: Channel to store. None stores channel 0 for a single-channel histogram and
+                        the full (channels, bincount) array otherwise.
+        :return: Path of the written file.
+        """
+        if channel is None:
+            hist = self.hist[0] if self.channels == 1 else self.hist
+        else:
+            hist = self.hist[channel]
+
+        file_path = os.path.join(out_name, str(index))
+        if extra_data is False:
+            np.savez(file_path, hist, wls)
+        else:
+            np.savez(file_path, hist, wls, extra_data)
+        print('Data stored under File Name: ' + file_path + '.npz')
+        return file_path + '.npz'
@@ -0,0 +1,105 @@
+"""
+Feed-Forward Calibration for Laser Homing
+
+Overview:
+Homing used to start from the current motor setpoint and correct it by the measured offset, waiting a full
+drift time per step and typically needing several steps per point. WavelengthCalibration learns how the
+wavelength measured by the wavemeter relates to the requested `laser1:ctl:wavelength-set`, so the first
+setpoint for a new target already accounts for the offset and most points land within precision in one step.
+
+1. Model:
+   The offset measured - setpoint is fitted as a low-order polynomial of the setpoint (degree up to
+   `degree`, limited by the number of distinct setpoints). The setpoint for a target is found by solving
+   setpoint + offset(setpoint) = target with a few fixed-point iterations. The polynomial is only trusted
+   between the lowest and the highest calibrated setpoint; outside it the offset at the nearest end is used
+   instead of extrapolating the polynomial, which diverges quickly away from the samples.
+
+2. Outliers:
+   A sample whose offset is far from the model (e.g. read during a mode hop) is ignored, unless several arrive
+   in a row. Samples further than `max_gap` from every calibrated setpoint are always accepted: there the model
+   is only a guess, so a different offset is a new range being learned, not an outlier.
+
+3. Persistence:
+   Every (setpoint, measured) pair is appended with `add`. The most recent `max_samples` pairs are kept and
+   written to an .npz file with `save`, and loaded again when the calibration is created.
+"""
+
+import os
+import numpy as np
+
+
+class WavelengthCalibration:
+    def __init__(self, path=None, degree=2, max_samples=2000, max_residual=0.05, max_gap=0.5):
+        """
+        :param path: .npz file the samples are loaded from and saved to; None keeps them in memory only.
+        :param degree: Maximum polynomial degree of the offset model.
+        :param max_samples: Number of most recent samples kept for the fit.
+        :param max_residual: Samples whose offset is further than this (nm) from the model are ignored
+                             (e.g. readings taken during a mode hop). Three such samples in a row are taken
+                             as a real change of the laser and accepted.
+        :param max_gap: Samples further than this (nm) from every calibrated setpoint are accepted unchecked.
+        """
+        self.path = path
+        self.degree = degree
+        self.max_samples = max_samples
+        self.max_residual = max_residual
+        self.max_gap = max_gap
+        self.setpoints = np.zeros(0)
+        self.measured = np.zeros(0)
+        self.coefficients = None
+        self.rejected = 0
+        if path and os.path.exists(path):
+            data = np.load(path)
+            self.setpoints = data['setpoints']
+            self.measured = data['measured']
+            self.fit()
+
+    def add(self, setpoint, measured):
+        """Record the wavelength measured after the motor settled at `setpoint`, and refit."""
+        if (self.coefficients is not None and self.covers(setpoint)
+                and abs(measured - setpoint - self.offset(setpoint)) > self.max_residual):
+            self.rejected += 1
+            if self.rejected < 3:
+                print(f'Calibration sample ignored: offset {measured - setpoint}nm is far from the model.')
+                return
+        self.rejected = 0
+        self.setpoints = np.append(self.setpoints, setpoint)[-self.max_samples:]
+        self.measured = np.append(self.measured, measured)[-self.max_samples:]
+        self.fit()
+
+    def fit(self):
+        n_distinct = len(np.unique(np.round(self.setpoints, 4)))
+        if n_distinct == 0:
+            self.coefficients = None
+            return
+        degree = min(self.degree, n_distinct - 1)
+        # Centre the setpoints so the polynomial fit stays well conditioned around 1500nm
+        self.center = np.mean(self.setpoints)
+        self.coefficients = np.polyfit(self.setpoints - self.center, self.measured - self.setpoints, degree)
+
+    def covers(self, setpoint):
+        """Whether a calibrated setpoint lies within `max_gap` of `setpoint`."""
+        return len(self.setpoints) > 0 and np.min(np.abs(self.setpoints - setpoint)) <= self.max_gap
+
+    def offset(self, setpoint):
+        """Predicted measured - setpoint at `setpoint`, held constant beyond the calibrated setpoints."""
+        setpoint = np.clip(setpoint, self.setpoints.min(), self.setpoints.max())
+        return np.polyval(self.coefficients, setpoint - self.center)
+
+    def setpoint_for(self, target, iterations=3):
+        """
+        :return: The setpoint expected to make the wavemeter read `target`, or None without any samples.
+        """
+        if self.coefficients is None:
+            return None
+        setpoint = target
+        for _ in range(iterations):
+            setpoint = target - self.offset(setpoint)
+        return float(setpoint)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, setpoints=self.setpoints, measured=self.measured)
+        os.replace(tmp_path, self.path)
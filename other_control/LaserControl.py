@@ -8,16 +8,30 @@ This script introduces an adaptive PID control strategy tailored for a specific
 
 1. AdaptivePID Class:
    An implementation of a self-adapting PID controller. This class not only offers the conventional PID algorithm 
-   but also adapts the PID parameters based on the system's response over time.
+   but also adapts the PID parameters based on the system's response over time. PIDTuner simulates it against a
+   model of the laser to tune its gains offline.
 
 2. Laser Control Methods:
-   - get_avg_wavelength: Computes the average wavelength based on readings from a wavelength meter.
+   - get_avg_wavelength: Computes the average wavelength based on readings from a wavelength meter. Given a
+   WavemeterBuffer (or one of its readers) instead of the driver, it averages bulk blocks of fresh samples.
+   Outliers (glitches, short mode hops) are rejected by their distance from the median (RobustAverage), and
+   with a `precision` it returns as soon as the average is known well enough. The result is a float that also
+   reports the number of readings and their spread.
    - adjust_motor_scan: Utilizes the adaptive PID to tweak the motor scan position of the laser, aiming to bring 
    the laser's wavelength closer to a target value.
    - adjust_piezo: Employs the adaptive PID to modify the piezoelectric voltage of the laser, ensuring that the 
-   laser's wavelength is closer to the desired value.
+   laser's wavelength is closer to the desired value. Errors are converted to volts with the laser's online
+   estimate of the local piezo tuning slope (PiezoSlope), which every step refines.
    - homelaser: A holistic adjustment procedure that first ensures the laser's piezo control is enabled, then 
    adjusts the laser's wavelength in two stages - first via motor scan and subsequently via piezo adjustment.
+   - motor_step / piezo_step (from CorrectionSteps): One PID correction of the motor set point or the piezo
+   voltage.
+   The loops of these routines are written once as control loops (the *_steps generators, see ControlSteps):
+   the functions above run them blocking, AsyncLaserControl runs the same loops on an asyncio event loop.
+   All of them accept an optional PhaseTimer (`timer`) that books wavemeter reads, laser requests and settling
+   waits as the phases 'wavemeter', 'laser' and 'settle', and counts 'motor iterations' and 'piezo iterations'.
+   With an optional SettleDetector (`settle`), the waits after every actuation end as soon as the laser has
+   settled, and `drift_time` is only the timeout.
 
 3. Decorators:
     - signal_connector: 
@@ -45,7 +59,13 @@ interactions with a wavelength meter and the laser system.
 
 from types import NoneType
 import numpy as np
-from toptica.lasersdk.client import Client
+from LaserSession import laser_session
+from ControlSteps import Call, Sleep, run_steps
+from CorrectionSteps import motor_step, piezo_step
+from PhaseTimer import NULL_TIMER
+from SettleDetection import wait_for_laser_steps
+from PiezoSlope import piezo_slope_estimator
+from SequentialAveraging import RobustAverage
 import time
 from lantz.drivers.bristol import Bristol_771
 from PyQt5.QtCore import pyqtSignal
@@ -152,68 +172,86 @@ class AdaptivePID:
         return np.clip(value, min_value, max_value)
 
 
-    
-def get_avg_wavelength(wm, measure_time):
+
+def get_avg_wavelength(wm, measure_time, timer=NULL_TIMER, precision=None, clock=time):
     """
     Measures the average wavelength over a specified period of time.
     
-    :param wm: Wavelength meter instance for measurement.
+    :param wm: Wavelength meter instance for measurement, or a WavemeterBuffer.
     :param measure_time: Number of times to measure.
-    :return: The average wavelength measured over the given period.
+    :param timer: Optional PhaseTimer.
+    :param precision: Optional precision in nm; measuring stops early once the average is known within it.
+    :param clock: Time module used for the pauses between readings.
+    :return: The outlier-rejected average wavelength (WavelengthAverage, with count and spread).
     """
-            
-    wls = []
-    for _ in range(measure_time):
-        wl = wm.measure_wavelength()
-        wls.append(wl)
-        time.sleep(0.2)  # Wait 200ms to respect the 5Hz measurement rate
-    return np.mean(wls)
+    return run_steps(get_avg_wavelength_steps(wm, measure_time, timer, precision, clock))
+
+
+def get_avg_wavelength_steps(wm, measure_time, timer=NULL_TIMER, precision=None, clock=time):
+    """Control loop of get_avg_wavelength, for run_steps or run_steps_async."""
+    averager = RobustAverage(measure_time, precision)
+    robust_average = getattr(wm, 'robust_average', None)
+    with timer.phase('wavemeter'):
+        if robust_average is not None:
+            avg = yield Call(robust_average, averager)
+        else:
+            while not averager.done():
+                averager.add((yield Call(wm.measure_wavelength)))
+                if not averager.done():
+                    yield Sleep(0.2, clock)  # Wait 200ms to respect the 5Hz measurement rate
+            avg = averager.result()
+    timer.count('wavemeter readings', avg.count)
+    return avg
 
         
 
-def adjust_motor_scan(laser, wm, target, precision, drift_time, max_iterations,P_m=1.13,I_m=0.5,D_m=0):
+def adjust_motor_scan(laser, wm, target, precision, drift_time, max_iterations,P_m=1.13,I_m=0.5,D_m=0, timer=NULL_TIMER, settle=None, clock=time):
     """
     Adjusts the motor scan to achieve a target wavelength with specified precision.
     
-    :param laser: Laser controller instance.
+    :param laser: Laser controller instance (LaserSession, connection or IP address).
     :param wm: Wavelength meter instance for measurement.
     :param target: The target wavelength.
     :param precision: Desired precision for achieving the target wavelength.
     :param drift_time: Time to wait before measuring the wavelength again.
     :param max_iterations: Maximum number of iterations before giving up.
     :param P_m, I_m, D_m: PID controller parameters.
+    :param timer: Optional PhaseTimer.
+    :param settle: Optional SettleDetector; `drift_time` is then the longest wait.
+    :param clock: Time module used for the fixed waits.
     :return: Number of iterations taken to achieve the target.
     """
-    pid = AdaptivePID(P_m, I_m, D_m, target, min_iterations_for_I_adaptation = 10 , integral_limit=0.5)
+    return run_steps(adjust_motor_scan_steps(laser, wm, target, precision, drift_time, max_iterations, P_m, I_m, D_m, timer, settle, clock))
 
-    with Client(laser) as client:
-        iter = 0
-        current = wm.measure_wavelength()
-        while current < target - precision or current > target + precision:
-            iter += 1
-            if iter > max_iterations:
-                print('Max iteration exceeded.')
-                break
-            setting = client.get('laser1:ctl:wavelength-set', float)
-            adjustment = pid.compute(current)
-
-            new_motor = setting + adjustment
-            
-            clamped_motor = AdaptivePID.clamp(new_motor, 1490, 1580)
 
-            if clamped_motor != new_motor:
-                print(f"Warning: motor was clamped to remain within [1490, 1580] range.")
-            client.set('laser1:ctl:wavelength-set', clamped_motor)
-            time.sleep(drift_time)
-            current = wm.measure_wavelength()
-            print(f"{iter} current: {current} target: {target} new wl setting: {setting + adjustment} diff: {current - target}")
-        return iter
+def adjust_motor_scan_steps(laser, wm, target, precision, drift_time, max_iterations,P_m=1.13,I_m=0.5,D_m=0, timer=NULL_TIMER, settle=None, clock=time):
+    """Control loop of adjust_motor_scan, for run_steps or run_steps_async."""
+    pid = AdaptivePID(P_m, I_m, D_m, target, min_iterations_for_I_adaptation = 10 , integral_limit=0.5)
 
-def adjust_piezo(laser, wm, target, precision, measure_time, drift_time, max_iterations,P_p=0.9,I_p=0.4,D_p=0, iter_limit =0):
+    client = laser_session(laser)
+    iter = 0
+    with timer.phase('wavemeter'):
+        current = yield Call(wm.measure_wavelength)
+    while current < target - precision or current > target + precision:
+        iter += 1
+        if iter > max_iterations:
+            print('Max iteration exceeded.')
+            break
+        timer.count('motor iterations')
+        with timer.phase('laser'):
+            setting = yield Call(client.get, 'laser1:ctl:wavelength-set', float)
+        clamped_motor, new_motor = motor_step(pid, setting, current)
+        with timer.phase('laser'):
+            yield Call(client.set, 'laser1:ctl:wavelength-set', clamped_motor)
+        current = yield from wait_for_laser_steps(wm, drift_time, settle, timer, clock)
+        print(f"{iter} current: {current} target: {target} new wl setting: {new_motor} diff: {current - target}")
+    return iter
+
+def adjust_piezo(laser, wm, target, precision, measure_time, drift_time, max_iterations,P_p=0.9,I_p=0.4,D_p=0, iter_limit =0, timer=NULL_TIMER, settle=None, slope=None, clock=time):
     """
     Adjusts the piezo voltage to achieve a target wavelength with specified precision.
     
-    :param laser: Laser controller instance.
+    :param laser: Laser controller instance (LaserSession, connection or IP address).
     :param wm: Wavelength meter instance for measurement.
     :param target: The target wavelength.
     :param precision: Desired precision for achieving the target wavelength.
@@ -222,44 +260,57 @@ def adjust_piezo(laser, wm, target, precision, measure_time, drift_time, max_ite
     :param max_iterations: Maximum number of iterations before giving up.
     :param P_p, I_p, D_p: PID controller parameters.
     :param iter_limit: Limit of iterations regardless of precision.
+    :param timer: Optional PhaseTimer.
+    :param settle: Optional SettleDetector; the fixed wait before re-averaging is then only the timeout.
+    :param slope: PiezoSlopeEstimator updated from every step; the shared estimator of the laser by default.
+    :param clock: Time module used for the fixed waits.
     :return: Number of iterations taken to achieve the target.
     """
-    pid = AdaptivePID(P_p, I_p, D_p, target, min_iterations_for_I_adaptation = 10, integral_limit = 0.0005)
-    with Client(laser) as client:
-        iter = 0
-        avg = get_avg_wavelength(wm, measure_time)
-        
-        while iter < iter_limit or (avg < target - precision or avg > target + precision):
-            iter += 1
-            if iter > max_iterations:
-                print('Max iteration exceeded for piezo adjustment.')
-                break
+    return run_steps(adjust_piezo_steps(laser, wm, target, precision, measure_time, drift_time, max_iterations, P_p, I_p, D_p, iter_limit, timer, settle, slope, clock))
 
-            piezo = client.get('laser1:dl:pc:voltage-set')
-            # The adaptive PID computes the adjustment
-            adjustment = pid.compute(avg)
-            new_piezo = piezo - round(adjustment / 0.001338, 3)
-            
-            clamped_piezo_voltage = AdaptivePID.clamp(new_piezo, 30, 110)
 
-            if clamped_piezo_voltage != new_piezo:
-                print(f"Warning: Piezo voltage was clamped to remain within [0, 140]V range.")
-                        
-            client.set('laser1:dl:pc:voltage-set', clamped_piezo_voltage)
-            print(f'New piezo voltage: {clamped_piezo_voltage}V.')
+def adjust_piezo_steps(laser, wm, target, precision, measure_time, drift_time, max_iterations,P_p=0.9,I_p=0.4,D_p=0, iter_limit =0, timer=NULL_TIMER, settle=None, slope=None, clock=time):
+    """Control loop of adjust_piezo, for run_steps or run_steps_async."""
+    pid = AdaptivePID(P_p, I_p, D_p, target, min_iterations_for_I_adaptation = 10, integral_limit = 0.0005)
+    client = laser_session(laser)
+    slope = piezo_slope_estimator(laser) if slope is None else slope
+    iter = 0
+    avg = yield from get_avg_wavelength_steps(wm, measure_time, timer, precision, clock)
+    
+    while iter < iter_limit or (avg < target - precision or avg > target + precision):
+        iter += 1
+        if iter > max_iterations:
+            print('Max iteration exceeded for piezo adjustment.')
+            break
+        timer.count('piezo iterations')
+
+        with timer.phase('laser'):
+            piezo = yield Call(client.get, 'laser1:dl:pc:voltage-set')
+        clamped_piezo_voltage = piezo_step(pid, piezo, avg, slope)
+                    
+        with timer.phase('laser'):
+            yield Call(client.set, 'laser1:dl:pc:voltage-set', clamped_piezo_voltage)
+        print(f'New piezo voltage: {clamped_piezo_voltage}V.')
 
-            
-            time.sleep(np.maximum(drift_time - 0.2 * measure_time, 2))
-            avg = get_avg_wavelength(wm, measure_time)
-            print(f'{iter} current: Average Wavelength during piezo scan: {avg}nm, target: {target}nm, diff: {avg-target}nm')
-        return iter
+        
+        with timer.phase('settle'):
+            if settle is None:
+                yield Sleep(np.maximum(drift_time - 0.2 * measure_time, 2), clock)
+            else:
+                yield from settle.steps(wm.measure_wavelength, np.maximum(drift_time - 0.2 * measure_time, 2))
+        previous = avg
+        avg = yield from get_avg_wavelength_steps(wm, measure_time, timer, precision, clock)
+        slope.add(piezo, clamped_piezo_voltage, avg - previous)
+        print(f'{iter} current: Average Wavelength during piezo scan: {avg}nm ({avg.report()}), target: {target}nm, diff: {avg-target}nm')
+    yield Call(slope.save)
+    return iter
 
 
-def homelaser(laser, wm, target, measure_time=15, motor_scan_precision=0.001, precision=0.00002, drift_time=4,P_m=1.13,I_m=0.5,D_m=0,P_p=0.9,I_p=0.4,D_p=0):
+def homelaser(laser, wm, target, measure_time=15, motor_scan_precision=0.001, precision=0.00002, drift_time=4,P_m=1.13,I_m=0.5,D_m=0,P_p=0.9,I_p=0.4,D_p=0, timer=NULL_TIMER, settle=None, clock=time):
     """
     Controls the laser to home in on a target wavelength, adjusting both motor and piezo as needed.
     
-    :param laser: Laser controller instance.
+    :param laser: Laser controller instance (LaserSession, connection or IP address).
     :param wm: Wavelength meter instance for measurement.
     :param target: The target wavelength.
     :param measure_time: Time interval for average wavelength measurement.
@@ -267,30 +318,47 @@ def homelaser(laser, wm, target, measure_time=15, motor_scan_precision=0.001, pr
     :param precision: Desired precision for achieving the target wavelength with piezo adjustment.
     :param drift_time: Time to wait before measuring the wavelength again.
     :param P_m, I_m, D_m, P_p, I_p, D_p: PID controller parameters for motor and piezo adjustments respectively.
+    :param timer: Optional PhaseTimer.
+    :param settle: Optional SettleDetector used after every motor and piezo step.
+    :param clock: Time module used for the fixed waits.
     :return: Number of iterations taken for both motor and piezo adjustments.
     """
+    return run_steps(homelaser_steps(laser, wm, target, measure_time, motor_scan_precision, precision, drift_time, P_m, I_m, D_m, P_p, I_p, D_p, timer, settle, clock))
+
+
+def homelaser_steps(laser, wm, target, measure_time=15, motor_scan_precision=0.001, precision=0.00002, drift_time=4,P_m=1.13,I_m=0.5,D_m=0,P_p=0.9,I_p=0.4,D_p=0, timer=NULL_TIMER, settle=None, clock=time):
+    """Control loop of homelaser, for run_steps or run_steps_async."""
     # Ensure laser's piezo control is enabled
-    with Client(laser) as client:
-        client.set('laser1:dl:pc:enabled', True)
-        piezo = client.get('laser1:dl:pc:voltage-set')
-        if abs(piezo - 70) > 2:
-            client.set('laser1:dl:pc:voltage-set', 70)
-            time.sleep(5)
+    client = laser_session(laser)
+
+    def enable_piezo():
+        with client:
+            client.set('laser1:dl:pc:enabled', True)
+            piezo = client.get('laser1:dl:pc:voltage-set')
+            if abs(piezo - 70) > 2:
+                client.set('laser1:dl:pc:voltage-set', 70)
+        return piezo
+
+    with timer.phase('laser'):
+        piezo = yield Call(enable_piezo)
+    if abs(piezo - 70) > 2:
+        with timer.phase('settle'):
+            yield Sleep(5, clock)
 
-    avg = get_avg_wavelength(wm, measure_time)
-    print(f'Average Wavelength before adjustments: {avg}nm, target: {target}nm, diff: {avg-target}nm')
+    avg = yield from get_avg_wavelength_steps(wm, measure_time, timer, motor_scan_precision, clock)
+    print(f'Average Wavelength before adjustments: {avg}nm ({avg.report()}), target: {target}nm, diff: {avg-target}nm')
 
     motor_iterations = 0
     piezo_iterations = 0
 
     if abs(avg - target) > motor_scan_precision:
-        motor_iterations = adjust_motor_scan(laser, wm, target, motor_scan_precision, drift_time, max_iterations=30,P_m=P_m,I_m=I_m,D_m=D_m)
-        avg = get_avg_wavelength(wm, measure_time)
-        print(f'Average Wavelength after motor scan: {avg}nm, target: {target}nm, diff: {avg-target}nm')
+        motor_iterations = yield from adjust_motor_scan_steps(laser, wm, target, motor_scan_precision, drift_time, max_iterations=30,P_m=P_m,I_m=I_m,D_m=D_m, timer=timer, settle=settle, clock=clock)
+        avg = yield from get_avg_wavelength_steps(wm, measure_time, timer, precision, clock)
+        print(f'Average Wavelength after motor scan: {avg}nm ({avg.report()}), target: {target}nm, diff: {avg-target}nm')
 
-    piezo_iterations = adjust_piezo(laser, wm, target, precision, measure_time, drift_time, max_iterations=30,P_p=P_p,I_p=I_p,D_p=D_p,iter_limit = 2)
-    avg = get_avg_wavelength(measure_time)
-    print(f'Final Average Wavelength after piezo adjustment: {avg}nm, target: {target}nm, diff: {avg-target}nm')
+    piezo_iterations = yield from adjust_piezo_steps(laser, wm, target, precision, measure_time, drift_time, max_iterations=30,P_p=P_p,I_p=I_p,D_p=D_p,iter_limit = 2, timer=timer, settle=settle, clock=clock)
+    avg = yield from get_avg_wavelength_steps(wm, measure_time, timer, precision, clock)
+    print(f'Final Average Wavelength after piezo adjustment: {avg}nm ({avg.report()}), target: {target}nm, diff: {avg-target}nm')
     return motor_iterations, piezo_iterations
 
 
@@ -0,0 +1,130 @@
+"""
+Persistent Toptica Laser Session
+
+Overview:
+Every correction step used to open its own `Client(connection)`, so connection setup was paid on every motor
+or piezo step. LaserSession keeps one client open for the lifetime of the program, serialises all requests
+through a lock so it can be shared between tasks and threads, and reconnects transparently when the
+connection drops.
+
+1. LaserSession Class:
+   - get / set: single parameter access, same arguments as the Toptica `Client`.
+   - get_many / set_many: several parameters under one lock acquisition, so no other thread can interleave
+     requests in between.
+   - The client is opened lazily on first use; on a connection error the session reopens the client and
+     retries the request once.
+
+2. laser_session:
+   Returns the shared session for an address, a `NetworkConnection`/`SerialConnection`, or passes an existing
+   LaserSession through, so every laser-control path ends up on the same session.
+"""
+
+import threading
+from toptica.lasersdk.client import Client, NetworkConnection, DeviceNotFoundError
+
+
+class LaserSession:
+    def __init__(self, connection, name=None):
+        """
+        :param connection: A Toptica `NetworkConnection` or `SerialConnection`.
+        :param name: Address of the laser, used to keep per-laser data (e.g. the piezo slope estimate).
+        """
+        self.connection = connection
+        self.name = name
+        self.client = None
+        self.lock = threading.RLock()
+
+    def open(self):
+        with self.lock:
+            if self.client is None:
+                client = Client(self.connection)
+                client.open()
+                self.client = client
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                try:
+                    self.client.close()
+                finally:
+                    self.client = None
+
+    def reconnect(self):
+        with self.lock:
+            try:
+                self.close()
+            except (DeviceNotFoundError, OSError):
+                self.client = None
+            self.open()
+
+    def _call(self, method, *args):
+        with self.lock:
+            self.open()
+            try:
+                return getattr(self.client, method)(*args)
+            except (DeviceNotFoundError, OSError) as e:
+                print(f'Laser connection lost ({e}), reconnecting...')
+                self.reconnect()
+                return getattr(self.client, method)(*args)
+
+    def get(self, param_name, *param_types):
+        """Read one parameter, e.g. get('laser1:ctl:wavelength-set', float)."""
+        return self._call('get', param_name, *param_types)
+
+    def set(self, param_name, *param_values):
+        """Write one parameter, e.g. set('laser1:dl:pc:voltage-set', 70)."""
+        return self._call('set', param_name, *param_values)
+
+    def get_many(self, params):
+        """
+        Read several parameters back to back.
+
+        :param params: Iterable of parameter names, or of (name, type) tuples.
+        :return: Dictionary name -> value.
+        """
+        with self.lock:
+            values = {}
+            for param in params:
+                name, *types = (param,) if isinstance(param, str) else param
+                values[name] = self.get(name, *types)
+            return values
+
+    def set_many(self, values):
+        """
+        Write several parameters back to back, in the given order.
+
+        :param values: Dictionary (or iterable of pairs) name -> value.
+        """
+        items = values.items() if isinstance(values, dict) else values
+        with self.lock:
+            for name, value in items:
+                self.set(name, value)
+
+    def __enter__(self):
+        # Sessions stay open; the context manager only holds the lock so a block of requests is not interleaved
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lock.release()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def laser_session(laser):
+    """
+    Return the shared LaserSession for `laser`.
+
+    :param laser: A LaserSession (returned unchanged), an IP address string, or a Toptica connection object.
+    :return: The LaserSession shared by every caller using the same address or connection.
+    """
+    if isinstance(laser, LaserSession):
+        return laser
+    with _sessions_lock:
+        key = laser if isinstance(laser, str) else id(laser)
+        if key not in _sessions:
+            connection = NetworkConnection(laser) if isinstance(laser, str) else laser
+            _sessions[key] = LaserSession(connection, name=laser if isinstance(laser, str) else None)
+        return _sessions[key]
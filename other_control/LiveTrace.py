@@ -0,0 +1,108 @@
+"""
+Bounded Live Trace
+
+Overview:
+The stabilizer's live wavelength plot appended every reading to Python lists and converted the whole lists to new
+arrays on every update, so both memory and the cost of an update grew for as long as the stabilizer ran.
+LiveTrace keeps a fixed number of samples in preallocated arrays and hands the plot a view of constant size.
+
+1. RingBuffer Class:
+   Preallocated (time, value) storage of fixed capacity. `extend` writes a block with at most two slice
+   assignments and overwrites the oldest samples once full; `view` returns the contents in time order.
+
+2. LiveTrace Class:
+   A RingBuffer of the most recent samples at full rate, plus an optional RingBuffer of the long-term history,
+   downsampled by averaging every `decimation` samples into one. `view()` joins the history older than the
+   recent samples with the recent samples, so the plot shows the whole session at a constant cost per update.
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        """
+        :param capacity: Number of samples kept.
+        """
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.start = 0
+        self.size = 0
+
+    def extend(self, times, values):
+        times = np.asarray(times, dtype=np.float64)[-self.capacity:]
+        values = np.asarray(values, dtype=np.float64)[-self.capacity:]
+        n = len(values)
+        if not n:
+            return
+        end = (self.start + self.size) % self.capacity
+        first = min(n, self.capacity - end)
+        self.times[end:end + first] = times[:first]
+        self.values[end:end + first] = values[:first]
+        self.times[:n - first] = times[first:]
+        self.values[:n - first] = values[first:]
+        overflow = max(self.size + n - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def view(self):
+        """:return: (times, values) in time order; copies, safe to hand to another thread."""
+        index = (self.start + np.arange(self.size)) % self.capacity
+        return self.times[index], self.values[index]
+
+    def first_time(self):
+        return self.times[self.start] if self.size else np.inf
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+
+class LiveTrace:
+    def __init__(self, capacity=3000, history=3000, decimation=50):
+        """
+        :param capacity: Number of most recent samples kept at full rate.
+        :param history: Number of downsampled points kept for the long-term history; 0 disables it.
+        :param decimation: Number of samples averaged into one history point.
+        """
+        self.recent = RingBuffer(capacity)
+        self.history = RingBuffer(history) if history else None
+        self.decimation = max(int(decimation), 1)
+        self.pending_times = np.zeros(0)
+        self.pending_values = np.zeros(0)
+
+    def extend(self, times, values):
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        self.recent.extend(times, values)
+        if self.history is None:
+            return
+        # Average complete groups of `decimation` samples into history points; keep the rest for the next call
+        times = np.concatenate([self.pending_times, times])
+        values = np.concatenate([self.pending_values, values])
+        n = len(values) // self.decimation * self.decimation
+        if n:
+            self.history.extend(times[:n].reshape(-1, self.decimation).mean(axis=1),
+                                values[:n].reshape(-1, self.decimation).mean(axis=1))
+        self.pending_times = times[n:]
+        self.pending_values = values[n:]
+
+    def view(self):
+        """
+        :return: (times, values) of the downsampled history before the recent samples followed by the recent
+                 samples; at most `capacity + history` points.
+        """
+        times, values = self.recent.view()
+        if self.history is None or not self.history.size:
+            return times, values
+        history_times, history_values = self.history.view()
+        older = history_times < self.recent.first_time()
+        return np.concatenate([history_times[older], times]), np.concatenate([history_values[older], values])
+
+    def clear(self):
+        self.recent.clear()
+        if self.history is not None:
+            self.history.clear()
+        self.pending_times = np.zeros(0)
+        self.pending_values = np.zeros(0)
@@ -0,0 +1,388 @@
+"""
+Offline Gain Tuning for AdaptivePID
+
+Overview:
+The motor and piezo gains of homelaser (P/I/D 1.13/0.5/0 and 0.9/0.4/0) were picked by hand, and trying others on
+the laser costs minutes per homing. This module simulates the two homing loops for thousands of AdaptivePID
+configurations at once with NumPy and reports the configuration that reaches the target precision in the fewest
+iterations. It needs neither instruments nor the lantz/PyQt5 environment.
+
+1. VectorPID Class:
+   AdaptivePID.compute and adapt_parameters applied elementwise to arrays, so every element is an independent
+   controller with its own gains, integral limit and I adaptation threshold. It follows AdaptivePID step by step
+   and has to be kept in line with it.
+
+2. HomingPlant Class:
+   Vectorized model of the Toptica response between two iterations of the homing loops, with the parameters of
+   SimulatedLaser as defaults:
+   - motor: set point offset, first-order lag with `motor_tau` and backlash of `motor_backlash` nm;
+   - piezo: nonlinear tuning coefficient, hysteresis of `piezo_hysteresis` V and creep with `piezo_tau`;
+   - random-walk drift, and wavemeter noise reduced by the number of averaged readings.
+
+3. Simulation and Tuning:
+   `simulate_motor` and `simulate_piezo` run adjust_motor_scan and adjust_piezo (with their default arguments from
+   homelaser) for an array of configurations over `trials` random starting points. Every iteration applies the
+   correction steps of the real loops (motor_step, piezo_step from CorrectionSteps), the piezo step with a
+   PiezoSlopeEstimator as in production; by default one that has learned the plant's piezo from random steps, as
+   the estimator of a laser in use has. All configurations see the same starting points, drift and noise, so
+   their iteration counts compare directly. `tune` scores every configuration
+   by its mean number of iterations, counting a failure as `max_iterations + 1`, and returns the best one.
+
+Usage:
+    python PIDTuner.py --stage piezo --trials 20
+"""
+
+import argparse
+import itertools
+import numpy as np
+
+from CorrectionSteps import motor_step, piezo_step
+from PiezoSlope import PiezoSlopeEstimator
+
+
+class VectorPID:
+    def __init__(self, P, I, D, set_point, min_iterations_for_I_adaptation=10, n_errors_for_adaptation=4,
+                 integral_limit=0.5, shape=()):
+        """
+        :param P, I, D, set_point, min_iterations_for_I_adaptation, integral_limit: As for AdaptivePID; scalars or
+                                                                                    arrays broadcastable to `shape`.
+        :param n_errors_for_adaptation: As for AdaptivePID, one value for all controllers.
+        :param shape: Shape of the controller array.
+        """
+        def full(value):
+            return np.broadcast_to(np.asarray(value, dtype=np.float64), shape).copy()
+
+        self.Kp, self.Ki, self.Kd = full(P), full(I), full(D)
+        self.set_point = full(set_point)
+        self.min_iterations_for_I = full(min_iterations_for_I_adaptation)
+        self.integral_limit = full(integral_limit)
+        self.n_errors_for_adaptation = int(n_errors_for_adaptation)
+        self.integral = np.zeros(shape)
+        self.previous_error = np.zeros(shape)
+        self.derivative = np.zeros(shape)
+        self.last_n_errors = np.zeros(shape + (self.n_errors_for_adaptation,))
+        self.iteration = 0
+
+    def adapt_parameters(self):
+        last = self.last_n_errors
+        avg_error = np.mean(np.abs(last), axis=-1)
+        nonzero = avg_error != 0
+        rsd = np.where(nonzero, np.std(last, axis=-1) / np.where(nonzero, avg_error, 1), 0)
+        moving = self.previous_error != 0
+        relative_derivative = np.where(moving, np.abs(self.derivative) / np.where(moving, np.abs(self.previous_error), 1), 0)
+        same_sign = np.all(last > 0, axis=-1) | np.all(last < 0, axis=-1)
+
+        over_tuned = np.all(np.abs(0.9 * last) < np.abs(self.previous_error)[..., None], axis=-1)
+        self.Kp = np.where(over_tuned, self.Kp * 0.9, np.where(same_sign, self.Kp * 1.1, self.Kp))
+
+        late = self.iteration >= self.min_iterations_for_I
+        wound_up = same_sign & (np.abs(self.integral) >= self.integral_limit)
+        oscillating = (~same_sign & (np.count_nonzero(last > 0, axis=-1) == last.shape[-1] // 2)
+                       & (np.abs(self.previous_error) > 0.9 * avg_error))
+        self.Ki = np.where(late & wound_up, self.Ki * 1.1, np.where(late & oscillating, self.Ki * 0.9, self.Ki))
+
+        slow = relative_derivative < 0.7
+        self.Kd = np.where(late & slow, self.Kd * 1.1, np.where(late & ~slow & (rsd > 3.5), self.Kd * 0.9, self.Kd))
+
+    def compute(self, current_value):
+        error = self.set_point - current_value
+        self.integral = np.clip(self.integral + error, -self.integral_limit, self.integral_limit)
+        self.derivative = error - self.previous_error
+        output = self.Kp * error + self.Ki * self.integral + self.Kd * self.derivative
+
+        self.previous_error = error
+        self.last_n_errors = np.roll(self.last_n_errors, -1, axis=-1)
+        self.last_n_errors[..., -1] = error
+        self.iteration += 1
+
+        if (2 * self.iteration) % self.n_errors_for_adaptation == 0:
+            self.adapt_parameters()
+        return output
+
+
+def _relax(value, target, tau, wait, average):
+    """
+    First-order approach of `value` to `target`.
+
+    :return: (mean over the `average` seconds following a `wait`, value at the end of them)
+    """
+    if tau <= 0:
+        return target, target
+    end = np.exp(-(wait + average) / tau)
+    if average > 0:
+        mean = tau / average * (np.exp(-wait / tau) - end)
+    else:
+        mean = end
+    return target + (value - target) * mean, target + (value - target) * end
+
+
+class HomingPlant:
+    def __init__(self, shape, motor_tau=1.0, set_offset=0.012, set_slope=2e-4, motor_backlash=0.001,
+                 piezo_coefficient=-0.001338, piezo_curvature=0.004, piezo_hysteresis=0.2, piezo_tau=0.5,
+                 drift_rate=2e-7, noise=2e-5, rng=None):
+        """
+        :param shape: (configurations, trials); random numbers are drawn per trial and shared by all configurations.
+        :param motor_tau: Time constant of the motor approaching a new set point, in seconds.
+        :param set_offset, set_slope: True wavelength = set point + set_offset + set_slope * (set point - 1500).
+        :param motor_backlash: Play of the motor drive, in nm of set point.
+        :param piezo_coefficient: Tuning coefficient at 70V in nm/V.
+        :param piezo_curvature: Relative change of the tuning coefficient per 10V away from 70V.
+        :param piezo_hysteresis: Play of the piezo, in V.
+        :param piezo_tau: Time constant of the piezo creep, in seconds.
+        :param drift_rate: Random-walk wavelength drift in nm/sqrt(s).
+        :param noise: Standard deviation of one wavemeter reading, in nm.
+        """
+        self.shape = shape
+        self.motor_tau = motor_tau
+        self.set_offset = set_offset
+        self.set_slope = set_slope
+        self.motor_backlash = motor_backlash
+        self.piezo_coefficient = piezo_coefficient
+        self.piezo_curvature = piezo_curvature
+        self.piezo_hysteresis = piezo_hysteresis
+        self.piezo_tau = piezo_tau
+        self.drift_rate = drift_rate
+        self.noise = noise
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.settle(np.full(shape[-1:], 1500.0))
+
+    def motor_target(self, setpoint):
+        return setpoint + self.set_offset + self.set_slope * (setpoint - 1500)
+
+    def piezo_shift(self, voltage):
+        dv = voltage - 70.0
+        return self.piezo_coefficient * dv * (1 + self.piezo_curvature * dv / 10 / 2)
+
+    def settle(self, setpoint, piezo=70.0):
+        """Put every element at rest at the motor `setpoint` (per trial) and piezo voltage `piezo`."""
+        self.motor_set = np.broadcast_to(np.asarray(setpoint, dtype=np.float64), self.shape).copy()
+        self.motor_position = self.motor_set.copy()
+        self.motor_wavelength = self.motor_target(self.motor_position)
+        self.piezo = np.full(self.shape, float(piezo))
+        self.piezo_position = self.piezo.copy()
+        self.shift = self.piezo_shift(self.piezo_position)
+        self.drift = np.zeros(self.shape)
+
+    def set_motor(self, setpoint, active):
+        self.motor_set = np.where(active, setpoint, self.motor_set)
+        half = self.motor_backlash / 2
+        self.motor_position = np.clip(self.motor_position, self.motor_set - half, self.motor_set + half)
+
+    def set_piezo(self, voltage, active):
+        self.piezo = np.where(active, voltage, self.piezo)
+        half = self.piezo_hysteresis / 2
+        self.piezo_position = np.clip(self.piezo_position, self.piezo - half, self.piezo + half)
+
+    def wait(self, seconds, average=0.0, readings=1):
+        """
+        Let `seconds` pass, then measure for `average` seconds.
+
+        :return: Wavelength measured as the mean of `readings` wavemeter readings, in nm.
+        """
+        motor_mean, self.motor_wavelength = _relax(self.motor_wavelength, self.motor_target(self.motor_position),
+                                                   self.motor_tau, seconds, average)
+        shift_mean, self.shift = _relax(self.shift, self.piezo_shift(self.piezo_position),
+                                        self.piezo_tau, seconds, average)
+        trials = self.shape[-1:]
+        self.drift = self.drift + self.drift_rate * np.sqrt(seconds + average) * self.rng.standard_normal(trials)
+        noise = self.noise / np.sqrt(readings) * self.rng.standard_normal(trials)
+        return motor_mean + shift_mean + self.drift + noise
+
+
+def _controller(configs, target, shape):
+    column = lambda key: np.asarray(configs[key], dtype=np.float64)[:, None]
+    n_errors = np.unique(configs['n_errors_for_adaptation'])
+    if len(n_errors) != 1:
+        raise ValueError('Simulate one n_errors_for_adaptation at a time; evaluate() groups them.')
+    return VectorPID(column('P'), column('I'), column('D'), target,
+                     min_iterations_for_I_adaptation=column('min_iterations_for_I_adaptation'),
+                     n_errors_for_adaptation=n_errors[0], integral_limit=column('integral_limit'), shape=shape)
+
+
+def simulate_motor(configs, trials=20, target=1530.0, start_error=0.05, precision=0.001, drift_time=4,
+                   max_iterations=30, seed=0, **plant_options):
+    """
+    Run adjust_motor_scan for every configuration from `trials` motor set points within `start_error` nm of the
+    target.
+
+    :param configs: Dictionary of equally long arrays, see config_grid.
+    :return: (iterations, converged), arrays of shape (configurations, trials).
+    """
+    rng = np.random.default_rng(seed)
+    shape = (len(configs['P']), trials)
+    plant = HomingPlant(shape, rng=rng, **plant_options)
+    plant.settle(target + rng.uniform(-start_error, start_error, trials))
+    pid = _controller(configs, target, shape)
+
+    current = plant.wait(0.0)
+    iterations = np.zeros(shape, dtype=int)
+    active = np.abs(current - target) > precision
+    while active.any():
+        iterations += active
+        active &= iterations <= max_iterations
+        new_motor, _ = motor_step(pid, plant.motor_set, current)
+        plant.set_motor(new_motor, active)
+        current = np.where(active, plant.wait(drift_time), current)
+        active &= np.abs(current - target) > precision
+    return iterations, iterations <= max_iterations
+
+
+def learned_slope(plant, steps=200, seed=0):
+    """
+    PiezoSlopeEstimator fed with `steps` random piezo steps of `plant` within [40, 100]V, like the estimator of a
+    laser that has been homed for a while.
+    """
+    rng = np.random.default_rng(seed)
+    slope = PiezoSlopeEstimator()
+    voltage = 70.0
+    for _ in range(steps):
+        target = np.clip(voltage + rng.uniform(-8, 8), 40, 100)
+        change = plant.piezo_shift(target) - plant.piezo_shift(voltage) + plant.noise * rng.standard_normal()
+        slope.add(voltage, target, change)
+        voltage = target
+    return slope
+
+
+def simulate_piezo(configs, trials=20, target=1530.0, start_error=0.001, precision=0.00002, measure_time=15,
+                   drift_time=4, max_iterations=30, iter_limit=2, seed=0, slope=None, **plant_options):
+    """
+    Run adjust_piezo for every configuration from `trials` wavelengths within `start_error` nm of the target, as
+    left by the motor scan.
+
+    :param configs: Dictionary of equally long arrays, see config_grid.
+    :param slope: PiezoSlopeEstimator used by piezo_step; learned_slope of the plant by default. All
+                  configurations share it, so it is not updated during the simulation.
+    :return: (iterations, converged), arrays of shape (configurations, trials).
+    """
+    rng = np.random.default_rng(seed)
+    shape = (len(configs['P']), trials)
+    plant = HomingPlant(shape, rng=rng, **plant_options)
+    slope = learned_slope(plant, seed=seed) if slope is None else slope
+    start = target + rng.uniform(-start_error, start_error, trials)
+    plant.settle((start - plant.set_offset + plant.set_slope * 1500) / (1 + plant.set_slope))
+    pid = _controller(configs, target, shape)
+
+    average = 0.2 * measure_time
+    wait = max(drift_time - average, 2)
+    avg = plant.wait(0.0, average, measure_time)
+    iterations = np.zeros(shape, dtype=int)
+    active = (iter_limit > 0) | (np.abs(avg - target) > precision)
+    while active.any():
+        iterations += active
+        active &= iterations <= max_iterations
+        new_piezo = piezo_step(pid, plant.piezo, avg, slope)
+        plant.set_piezo(new_piezo, active)
+        avg = np.where(active, plant.wait(wait, average, measure_time), avg)
+        active &= (iterations < iter_limit) | (np.abs(avg - target) > precision)
+    return iterations, iterations <= max_iterations
+
+
+SIMULATIONS = {'motor': simulate_motor, 'piezo': simulate_piezo}
+
+DEFAULTS = {
+    'motor': {'P': 1.13, 'I': 0.5, 'D': 0, 'min_iterations_for_I_adaptation': 10, 'n_errors_for_adaptation': 4,
+              'integral_limit': 0.5},
+    'piezo': {'P': 0.9, 'I': 0.4, 'D': 0, 'min_iterations_for_I_adaptation': 10, 'n_errors_for_adaptation': 4,
+              'integral_limit': 0.0005},
+}
+
+GRIDS = {
+    'motor': {'P': np.linspace(0.5, 1.5, 11), 'I': np.linspace(0, 1, 11), 'D': [0, 0.1, 0.2],
+              'min_iterations_for_I_adaptation': [5, 10], 'n_errors_for_adaptation': [4, 6], 'integral_limit': [0.5]},
+    'piezo': {'P': np.linspace(0.3, 1.3, 11), 'I': np.linspace(0, 1, 11), 'D': [0, 0.1, 0.2],
+              'min_iterations_for_I_adaptation': [5, 10], 'n_errors_for_adaptation': [4, 6],
+              'integral_limit': [0.0002, 0.0005, 0.001]},
+}
+
+
+def config_grid(**values):
+    """
+    :param values: Candidate values for every AdaptivePID argument (P, I, D, min_iterations_for_I_adaptation,
+                   n_errors_for_adaptation, integral_limit).
+    :return: Dictionary of equally long arrays holding every combination.
+    """
+    keys = list(values)
+    combinations = np.array(list(itertools.product(*(np.atleast_1d(values[key]) for key in keys))), dtype=np.float64)
+    configs = {key: combinations[:, i] for i, key in enumerate(keys)}
+    configs['n_errors_for_adaptation'] = configs['n_errors_for_adaptation'].astype(int)
+    return configs
+
+
+def evaluate(stage, configs, max_iterations=30, **options):
+    """
+    Simulate every configuration, one batch per value of n_errors_for_adaptation.
+
+    :param stage: 'motor' or 'piezo'.
+    :return: (iterations, converged), arrays of shape (configurations, trials).
+    """
+    simulate = SIMULATIONS[stage]
+    n_configs = len(configs['P'])
+    iterations = converged = None
+    for n_errors in np.unique(configs['n_errors_for_adaptation']):
+        index = np.flatnonzero(configs['n_errors_for_adaptation'] == n_errors)
+        batch = {key: np.asarray(value)[index] for key, value in configs.items()}
+        batch_iterations, batch_converged = simulate(batch, max_iterations=max_iterations, **options)
+        if iterations is None:
+            iterations = np.zeros((n_configs, batch_iterations.shape[1]), dtype=int)
+            converged = np.zeros(iterations.shape, dtype=bool)
+        iterations[index] = batch_iterations
+        converged[index] = batch_converged
+    return iterations, converged
+
+
+def tune(stage='piezo', configs=None, **options):
+    """
+    Find the AdaptivePID configuration that homes in the fewest iterations.
+
+    :param stage: 'motor' or 'piezo'.
+    :param configs: Dictionary of equally long arrays (see config_grid); GRIDS[stage] by default.
+    :param options: Passed to simulate_motor / simulate_piezo (trials, precision, plant parameters, ...).
+    :return: Dictionary with 'configs', the per-configuration 'mean iterations' and 'failure rate', the 'best'
+             configuration and the 'default' configuration, each with its scores.
+    """
+    configs = config_grid(**GRIDS[stage]) if configs is None else configs
+    default = {key: np.array([value]) for key, value in DEFAULTS[stage].items()}
+    configs = {key: np.concatenate([np.asarray(configs[key]), default[key]]) for key in default}
+
+    iterations, converged = evaluate(stage, configs, **options)
+    mean_iterations = iterations.mean(axis=1)
+    failure_rate = 1 - converged.mean(axis=1)
+    order = np.lexsort((failure_rate, mean_iterations))
+
+    def entry(i):
+        config = {key: value[i].item() for key, value in configs.items()}
+        config.update({'mean iterations': mean_iterations[i], 'failure rate': failure_rate[i],
+                       'p90 iterations': np.percentile(iterations[i], 90)})
+        return config
+
+    return {'configs': configs, 'mean iterations': mean_iterations, 'failure rate': failure_rate, 'order': order,
+            'best': entry(order[0]), 'default': entry(len(mean_iterations) - 1), 'entry': entry}
+
+
+def print_report(result, top=10):
+    header = ['P', 'I', 'D', 'min I iter', 'n errors', 'integral limit', 'mean iter', 'p90 iter', 'failures']
+    keys = ['P', 'I', 'D', 'min_iterations_for_I_adaptation', 'n_errors_for_adaptation', 'integral_limit']
+    rows = []
+    for label, config in [('default', result['default'])] + [(str(rank + 1), result['entry'](i))
+                                                             for rank, i in enumerate(result['order'][:top])]:
+        rows.append([label] + [f'{config[key]:.4g}' for key in keys]
+                    + [f"{config['mean iterations']:.2f}", f"{config['p90 iterations']:.0f}",
+                       f"{100 * config['failure rate']:.0f}%"])
+    header = ['rank'] + header
+    widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune the AdaptivePID gains of homelaser against a simulated laser.')
+    parser.add_argument('--stage', choices=sorted(SIMULATIONS), default='piezo')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--max-iterations', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    result = tune(args.stage, trials=args.trials, max_iterations=args.max_iterations, seed=args.seed)
+    print(f"{len(result['mean iterations'])} configurations, {args.trials} trials each.")
+    print_report(result, args.top)
@@ -0,0 +1,155 @@
+"""
+Per-Phase Timing for Scans
+
+Overview:
+A long scan spends its time in a handful of places: homing iterations, fixed waits, instrument reads, GUI
+updates and saving. PhaseTimer records how long every wavelength point spends in each of these phases, and
+how many iterations the loops inside it needed, cheaply enough to stay on in every scan.
+
+1. Recording:
+   - `with timer.phase('homing'):` adds the duration of the block to the phase of the current point.
+     Phases may be nested; a nested phase is counted in both.
+   - `timer.count('homing iterations', n)` adds to a counter of the current point.
+   - `timer.end_point()` closes the current point and returns its {name: value} record; everything recorded
+     afterwards belongs to the next point.
+   Timing uses `clock.perf_counter` (the time module by default, the SimClock's time module in the scan
+   benchmark, so simulated waits and instrument latency show up in the phases) and plain dictionary updates, a
+   microsecond or so per phase.
+
+2. Storage:
+   The names declared when the timer is created (`phases`, `counters`) are the ones stored per point by
+   ScanWriter (pass `timing_keys=timer.keys()`), under /timing/<name>. Undeclared names are still recorded
+   and show up in `summary()`.
+
+3. NULL_TIMER:
+   A timer that records nothing, used as the default by functions that accept an optional timer.
+"""
+
+import time
+
+
+class _Phase:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.timer.clock.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, self.timer.clock.perf_counter() - self.start)
+        return False
+
+
+class PhaseTimer:
+    def __init__(self, phases=(), counters=(), clock=time):
+        """
+        :param phases: Names of the timed phases stored per point.
+        :param counters: Names of the iteration counters stored per point.
+        :param clock: Module or object providing perf_counter().
+        """
+        self.clock = clock
+        self.phases = list(phases)
+        self.counters = list(counters)
+        self.reset()
+
+    def reset(self):
+        self.points = []
+        self.current = {}
+        self.calls = {}
+        self.start_time = self.clock.perf_counter()
+
+    def elapsed(self):
+        """Seconds since the timer was created or reset."""
+        return self.clock.perf_counter() - self.start_time
+
+    def keys(self):
+        """Names stored per point: the declared phases, then the declared counters."""
+        return tuple(self.phases) + tuple(self.counters)
+
+    def phase(self, name):
+        """Context manager timing a block as phase `name` of the current point."""
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        """Book `seconds` to phase `name` of the current point."""
+        if name not in self.phases and name not in self.calls:
+            self.phases.append(name)
+        self.current[name] = self.current.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        """Add `n` to counter `name` of the current point."""
+        if name not in self.counters:
+            self.counters.append(name)
+        self.current[name] = self.current.get(name, 0) + n
+
+    def end_point(self):
+        """
+        Close the current point.
+
+        :return: Dictionary with the phase durations (s) and counter values of the point.
+        """
+        record = self.current
+        self.points.append(record)
+        self.current = {}
+        return record
+
+    def totals(self):
+        """Phase durations and counter values summed over all closed points and the current one."""
+        totals = {}
+        for record in self.points + [self.current]:
+            for name, value in record.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def summary(self):
+        """
+        :return: Table with, per phase, the total time, its share of the elapsed time, the number of calls and
+                 the mean time per point; and per counter the total, mean and maximum per point.
+        """
+        elapsed = self.elapsed()
+        totals = self.totals()
+        n_points = max(len(self.points), 1)
+        lines = [f'Scan timing: {len(self.points)} points in {elapsed:.1f}s',
+                 f"{'phase':<24}{'total s':>10}{'share':>8}{'calls':>8}{'s/point':>10}"]
+        for name in self.phases:
+            total = totals.get(name, 0.0)
+            share = total / elapsed if elapsed > 0 else 0.0
+            lines.append(f'{name:<24}{total:>10.2f}{share:>8.1%}{self.calls.get(name, 0):>8}{total / n_points:>10.3f}')
+        if self.counters:
+            lines.append(f"{'counter':<24}{'total':>10}{'mean':>8}{'max':>8}")
+            for name in self.counters:
+                values = [record.get(name, 0) for record in self.points] or [0]
+                lines.append(f'{name:<24}{totals.get(name, 0):>10}{sum(values) / len(values):>8.2f}{max(values):>8}')
+        return '\n'.join(lines)
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _NullTimer:
+    """PhaseTimer stand-in that records nothing."""
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_TIMER = _NullTimer()
@@ -0,0 +1,279 @@
+"""
+High-Rate Piezo Lock
+
+Overview:
+adjust_piezo corrects the laser every few seconds from averaged readings, and AdaptivePID.compute is written for
+that pace: it rolls a NumPy array, recomputes NumPy reductions and prints on every adaptation. PiezoLock instead
+closes the loop at the wavemeter rate, correcting the piezo after every reading from a dedicated thread.
+
+1. LockPID Class:
+   AdaptivePID with the same control law and adaptation rules, but cheap enough to run at every reading:
+   - the error history is a preallocated ring of `n_errors_for_adaptation` floats;
+   - the statistics adapt_parameters needs (sum, sum of squares and sum of absolute errors, counts of positive
+     and negative errors, sliding maximum of the absolute error) are updated incrementally with every error and
+     recomputed exactly once per turn of the ring, so rounding errors cannot build up;
+   - messages go to the `log` callable (a queue in PiezoLock) instead of being printed on the control thread.
+
+2. PiezoLock Class:
+   Runs a thread that every 1 / `rate` seconds takes the newest wavemeter data (a WavemeterBuffer reader is
+   drained, a plain wavemeter is read once), computes the correction and writes the piezo voltage. The voltage is
+   tracked locally, so a tick costs one laser request, or none when the step rounds to zero. Ticks are scheduled
+   on a fixed grid; the lateness of every tick and the time spent in it are kept in preallocated arrays and
+   summarised by `jitter()`, and ticks missed entirely are counted as overruns. Log messages are printed by a
+   separate thread. `hold()` suspends the corrections, e.g. while a scan moves the laser, and `release(target)`
+   resumes them with a fresh controller and the piezo voltage read back from the laser.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from LaserControl import AdaptivePID
+from LaserSession import laser_session
+
+
+class LockPID(AdaptivePID):
+    def __init__(self, P, I, D, set_point, min_iterations_for_I_adaptation=10, n_errors_for_adaptation=4,
+                 integral_limit=0.5, log=None):
+        """
+        :param log: Callable taking a message; messages are dropped by default.
+        """
+        self.log = log or (lambda message: None)
+        self.pushed = 0
+        super().__init__(P, I, D, set_point, min_iterations_for_I_adaptation, n_errors_for_adaptation, integral_limit)
+        self.limit = float(integral_limit)
+
+    @property
+    def last_n_errors(self):
+        """The error history, oldest first."""
+        return np.roll(np.array(self.errors), -self.position)
+
+    @last_n_errors.setter
+    def last_n_errors(self, errors):
+        self.errors = [float(error) for error in errors]
+        self.position = 0
+        self.peaks = deque()
+        for i, error in enumerate(self.errors):
+            self._push_peak(self.pushed - len(self.errors) + i, abs(error))
+        self._recompute()
+
+    def _recompute(self):
+        self.sum = sum(self.errors)
+        self.sum_squares = sum(error * error for error in self.errors)
+        self.sum_abs = sum(abs(error) for error in self.errors)
+        self.n_positive = sum(error > 0 for error in self.errors)
+        self.n_negative = sum(error < 0 for error in self.errors)
+
+    def _push_peak(self, index, magnitude):
+        # Sliding maximum: indices of decreasing magnitudes, the oldest one leaves when it drops out of the ring
+        while self.peaks and self.peaks[-1][1] <= magnitude:
+            self.peaks.pop()
+        self.peaks.append((index, magnitude))
+        if self.peaks[0][0] <= index - len(self.errors):
+            self.peaks.popleft()
+
+    def push(self, error):
+        old = self.errors[self.position]
+        self.errors[self.position] = error
+        self.position = (self.position + 1) % len(self.errors)
+        self.sum += error - old
+        self.sum_squares += error * error - old * old
+        self.sum_abs += abs(error) - abs(old)
+        self.n_positive += (error > 0) - (old > 0)
+        self.n_negative += (error < 0) - (old < 0)
+        self._push_peak(self.pushed, abs(error))
+        self.pushed += 1
+        if self.position == 0:
+            self._recompute()
+
+    def adapt_parameters(self):
+        n = len(self.errors)
+        avg_error = self.sum_abs / n
+        mean = self.sum / n
+        std = max(self.sum_squares / n - mean * mean, 0.0) ** 0.5
+        rsd = std / avg_error if avg_error != 0 else 0
+        relative_derivative = abs(self.derivative) / abs(self.previous_error) if self.previous_error != 0 else 0
+        same_sign = self.n_positive == n or self.n_negative == n
+
+        if 0.9 * self.peaks[0][1] < abs(self.previous_error):
+            self.Kp *= 0.9
+            self.log(f"Detected over-tuning. Adjusting Kp to {self.Kp}")
+        elif same_sign:
+            self.Kp *= 1.1
+            self.log(f"Detected under-tuning. Adjusting Kp to {self.Kp}")
+
+        if self.iteration >= self.min_iterations_for_I:
+            if same_sign:
+                if abs(self.integral) >= self.limit:
+                    self.Ki *= 1.1
+                    self.log(f"Consistent error observed. Adjusting Ki to {self.Ki}")
+            elif self.n_positive == n // 2 and abs(self.previous_error) > 0.9 * avg_error:
+                self.Ki *= 0.9
+                self.log(f"Oscillating error observed. Adjusting Ki to {self.Ki}")
+
+            if relative_derivative < 0.7:
+                self.Kd *= 1.1
+                self.log(f"Relative slow response detected. Adjusting Kd to {self.Kd}")
+            elif rsd > 3.5:
+                self.Kd *= 0.9
+                self.log(f"High relative noise detected. Adjusting Kd to {self.Kd}")
+
+    def compute(self, current_value):
+        error = float(self.set_point - current_value)
+        self.integral = min(max(self.integral + error, -self.limit), self.limit)
+        self.derivative = error - self.previous_error
+        output = self.Kp * error + self.Ki * self.integral + self.Kd * self.derivative
+
+        self.previous_error = error
+        self.push(error)
+        self.iteration += 1
+
+        if (2 * self.iteration) % self.n_errors_for_adaptation == 0:
+            self.adapt_parameters()
+        return output
+
+
+class PiezoLock:
+    def __init__(self, laser, wm, target, rate=5.0, P=0.9, I=0.4, D=0, integral_limit=0.0005, slope=None,
+                 jitter_history=1000, clock=time, log=print):
+        """
+        :param laser: Anything laser_session accepts.
+        :param wm: WavemeterBuffer reader (anything with drain()) or wavemeter with measure_wavelength().
+        :param target: Wavelength to lock to, in nm.
+        :param rate: Control rate in Hz; at most the wavemeter rate for a buffered reader.
+        :param P, I, D, integral_limit: Gains and integral limit of the LockPID.
+        :param slope: Optional PiezoSlopeEstimator; the fixed -0.001338nm/V of piezo_step otherwise.
+        :param jitter_history: Number of ticks kept for the jitter statistics.
+        :param clock: Module or object providing perf_counter() and sleep().
+        :param log: Callable printing a message; called from the logging thread only.
+        """
+        self.client = laser_session(laser)
+        self.wm = wm
+        self.period = 1 / rate
+        self.gains = (P, I, D, integral_limit)
+        self.slope = slope
+        self.clock = clock
+        self.log = log
+        self.messages = queue.SimpleQueue()
+        self.lateness = np.zeros(jitter_history)
+        self.durations = np.zeros(jitter_history)
+        self.ticks = 0
+        self.overruns = 0
+        self.stale = 0
+        self.holding = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.log_thread = None
+        self.errors = []
+        self.reset(target)
+
+    def reset(self, target):
+        """New controller for `target`; the piezo voltage is read back from the laser before the next correction."""
+        P, I, D, integral_limit = self.gains
+        self.target = target
+        self.pid = LockPID(P, I, D, target, integral_limit=integral_limit, log=self.messages.put)
+        self.piezo = None
+
+    def hold(self):
+        self.holding.set()
+
+    def release(self, target=None):
+        target = self.target if target is None else target
+        if self.holding.is_set() or target != self.target:
+            self.reset(target)
+        self.holding.clear()
+
+    def read(self):
+        """:return: Newest wavelength in nm, or None if the wavemeter has nothing new."""
+        drain = getattr(self.wm, 'drain', None)
+        if drain is None:
+            return self.wm.measure_wavelength()
+        times, values = drain()
+        return values.mean() if len(values) else None
+
+    def tick(self, late):
+        i = self.ticks % len(self.lateness)
+        self.lateness[i] = late
+        t0 = self.clock.perf_counter()
+        wavelength = self.read()
+        if wavelength is None:
+            self.stale += 1
+        elif not self.holding.is_set():
+            if self.piezo is None:
+                self.piezo = float(self.client.get('laser1:dl:pc:voltage-set'))
+            adjustment = self.pid.compute(wavelength)
+            if self.slope is None:
+                step = round(-adjustment / 0.001338, 3)
+            else:
+                step = round(self.slope.volts_for(adjustment, self.piezo), 3)
+            if step:
+                new_piezo = min(max(self.piezo + step, 30), 110)
+                if new_piezo != self.piezo + step:
+                    self.messages.put('Warning: Piezo voltage was clamped to remain within [30, 110]V range.')
+                self.client.set('laser1:dl:pc:voltage-set', new_piezo)
+                self.piezo = new_piezo
+        self.durations[i] = self.clock.perf_counter() - t0
+        self.ticks += 1
+
+    def _run(self):
+        try:
+            next_tick = self.clock.perf_counter()
+            while not self.stop_event.is_set():
+                now = self.clock.perf_counter()
+                if now < next_tick:
+                    self.clock.sleep(next_tick - now)
+                    now = self.clock.perf_counter()
+                late = now - next_tick
+                if late >= self.period:
+                    # Ticks missed entirely are dropped, not caught up
+                    missed = int(late // self.period)
+                    self.overruns += missed
+                    next_tick += missed * self.period
+                    late -= missed * self.period
+                self.tick(late)
+                next_tick += self.period
+        except Exception as e:
+            self.errors.append(e)
+            self.messages.put(f'Piezo lock stopped: {e}')
+
+    def _print_messages(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            self.log(message)
+
+    def jitter(self):
+        """
+        :return: Dictionary with the number of 'ticks', 'overruns' (missed ticks), 'stale' ticks without new
+                 wavemeter data, and mean/std/max of the tick 'lateness' and mean/max 'duration' in seconds over
+                 the last `jitter_history` ticks.
+        """
+        n = min(self.ticks, len(self.lateness))
+        lateness = self.lateness[:n]
+        durations = self.durations[:n]
+        result = {'ticks': self.ticks, 'overruns': self.overruns, 'stale': self.stale}
+        if n:
+            result.update({'lateness mean': lateness.mean(), 'lateness std': lateness.std(),
+                           'lateness max': lateness.max(), 'duration mean': durations.mean(),
+                           'duration max': durations.max()})
+        return result
+
+    def start(self):
+        self.stop_event.clear()
+        self.log_thread = threading.Thread(target=self._print_messages, daemon=True)
+        self.log_thread.start()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.log_thread is not None:
+            self.messages.put(None)
+            self.log_thread.join()
+            self.log_thread = None
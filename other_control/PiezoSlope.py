@@ -0,0 +1,128 @@
+"""
+Online Estimate of the Piezo Tuning Coefficient
+
+Overview:
+adjust_piezo converted a wavelength error into volts with the fixed coefficient -0.001338nm/V, which only holds
+near 70V; away from it the piezo loop overshoots or crawls. PiezoSlopeEstimator learns the local tuning slope
+from every piezo step by recursive least squares and is kept per laser across runs.
+
+1. Model:
+   The slope is taken as linear in the voltage, s(V) = a + b (V - 70). A step from V0 to V1 then changes the
+   wavelength by the integral of s, a (V1 - V0) + b ((V1 - 70)^2 - (V0 - 70)^2) / 2, which is linear in (a, b).
+   Every step updates (a, b) by recursive least squares with forgetting factor `forgetting`, so the estimate
+   follows slow changes of the laser. Steps shorter than `min_step` carry little information and are skipped;
+   steps whose wavelength change misses the prediction by more than `max_residual` plus half the predicted
+   change (mode hops, drift during the step) are ignored.
+
+2. Use:
+   `volts_for(change, voltage)` is the voltage step expected to change the wavelength by `change` nm starting at
+   `voltage`, evaluated at the midpoint of the step. adjust_piezo, its asyncio version and the stabilizer get the
+   estimator of their laser from `piezo_slope_estimator(laser)`.
+
+3. Persistence:
+   Estimators of lasers created from an IP address are saved to and loaded from
+   ~/toptica_piezo_slope_<address>.npz, like WavelengthCalibration; others are kept in memory only.
+"""
+
+import os
+import threading
+import numpy as np
+
+
+class PiezoSlopeEstimator:
+    def __init__(self, path=None, slope=-0.001338, curvature=0.0, center=70.0, forgetting=0.98,
+                 slope_std=3e-4, curvature_std=1e-5, min_step=0.05, max_residual=0.003,
+                 noise_std=2e-5):
+        """
+        :param path: .npz file the estimate is loaded from and saved to; None keeps it in memory only.
+        :param slope: Initial slope at `center`, in nm/V.
+        :param curvature: Initial change of the slope per volt, in nm/V^2.
+        :param center: Voltage the model is centred on.
+        :param forgetting: RLS forgetting factor; older steps are weighted down by this factor per step.
+        :param slope_std, curvature_std: Prior uncertainty of slope and curvature.
+        :param min_step: Smallest voltage step used for an update, in V.
+        :param max_residual: Largest deviation from the predicted wavelength change accepted for an update, on
+                             top of half the predicted change, in nm.
+        :param noise_std: Uncertainty of a measured wavelength change, in nm.
+        """
+        self.path = path
+        self.center = center
+        self.forgetting = forgetting
+        self.min_step = min_step
+        self.max_residual = max_residual
+        self.noise_variance = noise_std ** 2
+        self.prior = np.diag([slope_std ** 2, curvature_std ** 2])
+        self.theta = np.array([slope, curvature], dtype=np.float64)
+        self.P = self.prior.copy()
+        self.updates = 0
+        if path and os.path.exists(path):
+            data = np.load(path)
+            self.theta = data['theta']
+            self.P = data['P']
+            self.updates = int(data['updates'])
+
+    def slope(self, voltage):
+        """Local tuning slope at `voltage`, in nm/V."""
+        return self.theta[0] + self.theta[1] * (voltage - self.center)
+
+    def volts_for(self, change, voltage):
+        """
+        :param change: Wavelength change wanted, in nm.
+        :param voltage: Current piezo voltage in V.
+        :return: Voltage step expected to produce `change`.
+        """
+        step = change / self.slope(voltage)
+        return change / self.slope(voltage + step / 2)
+
+    def add(self, v_from, v_to, change):
+        """Update the estimate with the wavelength `change` (nm) measured after a step from `v_from` to `v_to` (V)."""
+        if abs(v_to - v_from) < self.min_step:
+            return
+        phi = np.array([v_to - v_from, ((v_to - self.center) ** 2 - (v_from - self.center) ** 2) / 2])
+        predicted = phi @ self.theta
+        if abs(change - predicted) > self.max_residual + 0.5 * abs(predicted):
+            print(f'Piezo slope update ignored: {change}nm measured, {predicted}nm expected.')
+            return
+        Pphi = self.P @ phi
+        gain = Pphi / (self.forgetting * self.noise_variance + phi @ Pphi)
+        theta = self.theta + gain * (change - predicted)
+        # A slope that changes sign inside the piezo range is a bad update (e.g. drift during the step)
+        if np.sign(theta[0] + theta[1] * (30 - self.center)) != np.sign(theta[0] + theta[1] * (110 - self.center)):
+            print('Piezo slope update ignored: the slope would change sign within [30, 110]V.')
+            return
+        self.theta = theta
+        self.P = (self.P - np.outer(gain, Pphi)) / self.forgetting
+        # Without informative steps forgetting inflates P; never let it exceed the prior
+        if np.trace(self.P) > np.trace(self.prior):
+            self.P = self.prior.copy()
+        self.updates += 1
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, theta=self.theta, P=self.P, updates=self.updates)
+        os.replace(tmp_path, self.path)
+
+
+_estimators = {}
+_estimators_lock = threading.Lock()
+
+
+def piezo_slope_path(name):
+    return os.path.join(os.path.expanduser('~'), 'toptica_piezo_slope_{}.npz'.format(name.replace(':', '_')))
+
+
+def piezo_slope_estimator(laser):
+    """
+    :param laser: Anything laser_session accepts.
+    :return: The PiezoSlopeEstimator shared by every caller using the same laser.
+    """
+    # Imported here so the estimator itself does not need the Toptica SDK (e.g. for PIDTuner)
+    from LaserSession import laser_session
+    session = laser_session(laser)
+    with _estimators_lock:
+        if id(session) not in _estimators:
+            name = getattr(session, 'name', None)
+            _estimators[id(session)] = PiezoSlopeEstimator(piezo_slope_path(name) if name else None)
+        return _estimators[id(session)]
@@ -0,0 +1,86 @@
+"""
+Background Plot Rendering
+
+Overview:
+End-of-scan figures used to be built and saved with pyplot on the measurement task thread, leaving the laser
+and the instruments idle while PNGs rendered. PlotRenderer accepts plot jobs and renders them on a thread or
+process pool, so a task can return as soon as its data is on disk.
+
+1. Rendering:
+   Jobs draw on a bare `matplotlib.figure.Figure` with the non-GUI Agg canvas. Unlike pyplot this keeps no
+   global state, so several figures can be rendered concurrently and nothing touches the Qt event loop.
+
+2. PlotRenderer Class:
+   `submit(job, *args)` queues any module-level rendering function and returns a Future; `lineplot` is the
+   shortcut for render_lineplot. `use_processes=True` renders in separate processes instead of threads; job
+   functions and their arguments must then be picklable. `wait()` blocks until the queued figures are written,
+   `shutdown()` also stops the workers; a task owns one renderer and shuts it down in its finalizer.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+def render_lineplot(x, y, title, xlabel, ylabel, fig_path):
+    """
+    Render a line plot with markers and save it to `fig_path`.
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    ax.plot(x, y, color='blue', linestyle='-', marker='o')
+
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+
+    fig.savefig(fig_path, facecolor='white')
+    return fig_path
+
+
+def _report(future):
+    error = future.exception()
+    if error is not None:
+        print(f'Plot rendering failed: {error}')
+    else:
+        print('Figure saved at', future.result())
+
+
+class PlotRenderer:
+    def __init__(self, max_workers=2, use_processes=False):
+        """
+        :param max_workers: Number of figures rendered concurrently.
+        :param use_processes: Render in worker processes instead of threads.
+        """
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor(max_workers=max_workers)
+        self.futures = []
+
+    def submit(self, job, *args, **kwargs):
+        """
+        Queue `job(*args, **kwargs)` for rendering and return its Future.
+        """
+        # Drop the futures that are already finished so the list does not grow over a long session
+        self.futures = [f for f in self.futures if not f.done()]
+        future = self.executor.submit(job, *args, **kwargs)
+        future.add_done_callback(_report)
+        self.futures.append(future)
+        return future
+
+    def lineplot(self, x, y, title, xlabel, ylabel, PATH, file_name):
+        """Queue a render_lineplot job saving PATH/file_name.png."""
+        # Copy the data so the task can keep reusing its arrays while the figure renders
+        return self.submit(render_lineplot, np.array(x), np.array(y), title, xlabel, ylabel, os.path.join(PATH, file_name + ".png"))
+
+    def wait(self):
+        """Block until every queued figure has been written."""
+        for future in list(self.futures):
+            future.exception()
+
+    def shutdown(self):
+        """Wait for the queued figures, then stop the workers; the renderer cannot be used afterwards."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,95 @@
+"""
+Block Readout of the PM100D
+
+Overview:
+The repeat loop read `pmd.power` once per sample: one USB request, one pint Quantity and one unit conversion per
+reading, up to 1000 times per point. PowerBlockReader lets the meter average internally and fetches blocks of
+readings as raw floats, converting them to uW once per block.
+
+1. Instrument-Side Averaging:
+   `configure()` sets the meter's averaging count (SENS:AVER:COUN); every reading is then the mean of that many
+   internal samples (about 3ms each), so fewer readings give the same noise on the mean. The count set before
+   is read back first, and `restore()` sets it again when the scan is done, so other users of the meter (e.g. the
+   per-reading `pmd.power` of later scans) are not left with a long averaging time.
+
+2. Block Fetch:
+   `read_block(n)` takes `n` readings in requests of up to `block` READ? queries each, parses the reply with
+   numpy and returns the powers in uW with a timestamp per reading. The timestamps are spread evenly over the
+   request, which is as precise as the meter reports them. Waits and timestamps go through `clock` (the time
+   module by default), as in SettleDetector.
+
+3. Instrument Access:
+   A power meter object that provides `read_block(n)`, `set_averaging(count)` and `get_averaging()` (e.g.
+   SimulatedPowerMeter) is used directly; otherwise the SCPI commands go through the VISA resource of the lantz driver.
+"""
+
+import time
+import numpy as np
+
+
+class PowerBlockReader:
+    def __init__(self, pmd, averaging=1, block=50, clock=time):
+        """
+        :param pmd: PM100D driver instance.
+        :param averaging: Internal samples averaged by the meter per reading.
+        :param block: Largest number of readings fetched per request.
+        :param clock: Module or object providing perf_counter() and sleep().
+        """
+        self.pmd = pmd
+        self.averaging = max(int(averaging), 1)
+        self.block = max(int(block), 1)
+        self.clock = clock
+        self.previous_averaging = None
+
+    def get_averaging(self):
+        get_averaging = getattr(self.pmd, 'get_averaging', None)
+        if get_averaging is not None:
+            return int(get_averaging())
+        return int(float(self.pmd.resource.query('SENS:AVER:COUN?')))
+
+    def set_averaging(self, count):
+        set_averaging = getattr(self.pmd, 'set_averaging', None)
+        if set_averaging is not None:
+            set_averaging(count)
+        else:
+            self.pmd.resource.write(f'SENS:AVER:COUN {count}')
+
+    def configure(self):
+        """Set the averaging count of the meter, remembering the one set before."""
+        if self.previous_averaging is None:
+            self.previous_averaging = self.get_averaging()
+        self.set_averaging(self.averaging)
+
+    def restore(self):
+        """Set the averaging count from before `configure` again."""
+        if self.previous_averaging is not None:
+            self.set_averaging(self.previous_averaging)
+            self.previous_averaging = None
+
+    def fetch(self, n):
+        """One request for `n` readings; powers in W."""
+        read_block = getattr(self.pmd, 'read_block', None)
+        if read_block is not None:
+            return np.asarray(read_block(n), dtype=np.float64)
+        reply = self.pmd.resource.query(';'.join(['READ?'] * n))
+        return np.array(reply.replace(';', ',').split(','), dtype=np.float64)
+
+    def read_block(self, n):
+        """
+        Take `n` readings.
+
+        :return: (powers in uW, timestamps in seconds), both float arrays of length `n`.
+        """
+        powers = np.zeros(n)
+        stamps = np.zeros(n)
+        for start in range(0, n, self.block):
+            size = min(self.block, n - start)
+            t0 = self.clock.perf_counter()
+            values = self.fetch(size)
+            t1 = self.clock.perf_counter()
+            if len(values) != size:
+                raise ValueError(f'Power meter returned {len(values)} readings, expected {size}.')
+            powers[start:start + size] = values
+            stamps[start:start + size] = t0 + (np.arange(size) + 0.5) * (t1 - t0) / size
+        powers *= 1e6  # W -> uW
+        return powers, stamps
@@ -0,0 +1,157 @@
+"""
+Reference Spectrum Interpolation
+
+Overview:
+Transmission points are normalized by the reference power interpolated at the measured wavelength. The old
+per-point helpers rebuilt and argsorted the whole reference for every point and could not cope with unsorted
+references containing repeated wavelengths. ReferenceSpectrum prepares the reference once and then evaluates
+whole arrays of wavelengths in a single vectorized call.
+
+1. ReferenceSpectrum Class:
+   Sorts the reference by wavelength, merges duplicate wavelengths (their powers are averaged) and keeps the
+   sorted grid for np.searchsorted lookups. Two methods are available:
+   - 'lagrange': second-order Lagrange interpolation through the three nearest reference points.
+   - 'spline': cubic interpolating spline through all reference points.
+
+2. renormalize_scan:
+   Recomputes the transmission rate of a stored scan against a (possibly different) reference file. Columns are
+   selected by name from the stored layout (see SCAN_COLUMNS): the sample of a two-pass transmission scan is
+   "Laser wavelength"/"Power", the reference of a single-pass scan is "Reference wavelength"/"Reference power".
+   Rows are matched by "RF power" when the scan has that column; a reference without it (saved before the
+   column existed) is used for every RF power. Any other layout is rejected.
+"""
+
+import numpy as np
+from scipy.interpolate import make_interp_spline
+
+from ScanStorage import load_scan
+
+
+class ReferenceSpectrum:
+    def __init__(self, wavelength, power, method='lagrange'):
+        """
+        :param wavelength: Reference wavelengths, in any order, duplicates allowed.
+        :param power: Reference powers, one per wavelength.
+        :param method: 'lagrange' or 'spline'.
+        """
+        wavelength = np.asarray(wavelength, dtype=np.float64).ravel()
+        power = np.asarray(power, dtype=np.float64).ravel()
+        if wavelength.shape != power.shape:
+            raise ValueError("Reference wavelength and power must have the same length.")
+        if method not in ('lagrange', 'spline'):
+            raise ValueError(f"Unknown interpolation method '{method}'.")
+
+        # np.unique sorts; duplicate wavelengths are merged by averaging their powers
+        self.wavelength, inverse, counts = np.unique(wavelength, return_inverse=True, return_counts=True)
+        self.power = np.bincount(inverse, weights=power) / counts
+        self.method = method
+
+        if method == 'spline' and len(self.wavelength) >= 4:
+            self.spline = make_interp_spline(self.wavelength, self.power, k=3)
+        else:
+            self.spline = None
+
+    def _lagrange(self, x):
+        xs, ys = self.wavelength, self.power
+        n = len(xs)
+        if n < 3:
+            return np.interp(x, xs, ys)
+
+        # The three nearest points form a contiguous window [start, start + 3) of the sorted grid that
+        # contains the left or the right neighbour of x; pick the candidate window with the smallest reach
+        left = np.clip(np.searchsorted(xs, x), 1, n - 1) - 1
+        candidates = np.clip(left[..., np.newaxis] + np.arange(-2, 2), 0, n - 3)
+        reach = np.maximum(np.abs(x[..., np.newaxis] - xs[candidates]), np.abs(xs[candidates + 2] - x[..., np.newaxis]))
+        start = np.take_along_axis(candidates, np.argmin(reach, axis=-1)[..., np.newaxis], axis=-1)[..., 0]
+
+        x0, x1, x2 = xs[start], xs[start + 1], xs[start + 2]
+        y0, y1, y2 = ys[start], ys[start + 1], ys[start + 2]
+        return y0 * (x - x1) * (x - x2) / ((x0 - x1) * (x0 - x2)) + \
+            y1 * (x - x0) * (x - x2) / ((x1 - x0) * (x1 - x2)) + \
+            y2 * (x - x0) * (x - x1) / ((x2 - x0) * (x2 - x1))
+
+    def __call__(self, x):
+        """
+        Reference power at wavelength(s) `x`.
+
+        :param x: Scalar or array of wavelengths.
+        :return: Interpolated power with the shape of `x`.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if self.spline is not None:
+            return self.spline(x)
+        return self._lagrange(x)
+
+    def normalize(self, wavelength, power):
+        """
+        Transmission rate of `power` measured at `wavelength`, relative to this reference.
+        """
+        return np.asarray(power, dtype=np.float64) / self(wavelength)
+
+
+# Layout -> (wavelength, power) columns of the reference and of the sample, as written by ScanWriter
+SCAN_COLUMNS = {
+    'two_pass': (("Laser wavelength", "Power"), ("Laser wavelength", "Power")),
+    'single_pass': (("Reference wavelength", "Reference power"), ("Laser wavelength", "Power")),
+}
+
+
+def scan_layout(scan):
+    """
+    :param scan: Dictionary returned by load_scan.
+    :return: 'single_pass' or 'two_pass'.
+    """
+    if "Reference wavelength" in scan or "Reference power" in scan:
+        layout = 'single_pass'
+    else:
+        layout = 'two_pass'
+    for columns in SCAN_COLUMNS[layout]:
+        missing = [key for key in columns if key not in scan]
+        if missing:
+            raise ValueError(f"Unsupported scan layout: no {', '.join(missing)} column in {sorted(scan)}.")
+    return layout
+
+
+def renormalize_scan(scan_file, reference_file=None, method='lagrange'):
+    """
+    Recompute the transmission rate of a stored scan.
+
+    :param scan_file: Transmission scan (.h5 or .pkl), two-pass or single-pass.
+    :param reference_file: Reference scan (.h5 or .pkl), a two-pass reference or the reference arm of a
+                           single-pass scan; by default the scan's own reference arm (single-pass scans only).
+    :param method: Interpolation method passed to ReferenceSpectrum.
+    :return: (wavelength, power, transmission_rate) arrays of the scan.
+    """
+    scan = load_scan(scan_file)
+    layout = scan_layout(scan)
+    sample_wavelength, sample_power = SCAN_COLUMNS[layout][1]
+    if reference_file is None:
+        if layout != 'single_pass':
+            raise ValueError("A two-pass scan needs a reference file.")
+        reference = scan
+    else:
+        reference = load_scan(reference_file)
+    reference_wavelength, reference_power = SCAN_COLUMNS[scan_layout(reference)][0]
+
+    wavelength = np.asarray(scan[sample_wavelength], dtype=np.float64)
+    power = np.asarray(scan[sample_power], dtype=np.float64)
+    rf_power = scan.get("RF power")
+    reference_rf_power = reference.get("RF power")
+    if rf_power is None or reference_rf_power is None:
+        if rf_power is None and reference_rf_power is not None and len(np.unique(reference_rf_power)) > 1:
+            raise ValueError("The scan has no RF power column but the reference was measured at several RF powers.")
+        spectrum = ReferenceSpectrum(reference[reference_wavelength], reference[reference_power], method=method)
+        return wavelength, power, spectrum.normalize(wavelength, power)
+
+    rf_power = np.asarray(rf_power, dtype=np.float64)
+    reference_rf_power = np.asarray(reference_rf_power, dtype=np.float64).ravel()
+    transmission_rate = np.empty(np.broadcast(wavelength, power).shape)
+    for rf in np.unique(rf_power):
+        reference_rows = np.isclose(reference_rf_power, rf)
+        if not np.any(reference_rows):
+            raise ValueError(f"The reference has no measurement at RF power {rf}dBm.")
+        spectrum = ReferenceSpectrum(np.ravel(reference[reference_wavelength])[reference_rows],
+                                     np.ravel(reference[reference_power])[reference_rows], method=method)
+        rows = rf_power == rf
+        transmission_rate[rows] = spectrum.normalize(wavelength[rows], power[rows])
+    return wavelength, power, transmission_rate
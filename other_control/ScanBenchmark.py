@@ -0,0 +1,260 @@
+"""
+Hardware-Free Benchmark for Spectrum_Scan
+
+Overview:
+Runs the real Spectrum_Scan scan methods (reference, transmission and single-pass) against the simulated
+instruments in SimulatedInstruments, outside of spyre, and reports how fast they go. Slowdowns in homing,
+acquisition or saving show up here without touching the optical table.
+
+1. SimulatedScan Class:
+   Borrows the scan methods from Spectrum_Scan and provides everything they expect from the spyrelet:
+   instruments, parameter widgets, signal holder and beam router. `run(name)` mirrors the task
+   initializer/finalizer around a scan method.
+
+2. benchmark_scans:
+   Runs the scans and reports, per scan, the wall time, points per second, the virtual (hardware) time split
+   into requested sleeps and per-instrument latency, the peak Python memory, and the per-phase totals recorded
+   by the scan's PhaseTimer. While a scan runs, the `time` module of the spyrelet is replaced by the SimClock's,
+   which the PhaseTimer (created with `clock=time`) then times with, so the phases are in virtual time.
+
+Usage:
+    python ScanBenchmark.py --points 21 --repeats 100
+Requires the same Python environment as the spyrelets (spyre, lantz, toptica, PyQt5), but no instruments.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'spyrelet'))
+
+import transmission_spectrum_spyrelet as scan_module
+from transmission_spectrum_spyrelet import Spectrum_Scan
+from lantz import Q_
+
+from SimulatedInstruments import simulated_instruments
+from BeamRouting import LocalRouter
+from PlotRenderer import PlotRenderer
+
+
+class NullSignal:
+    def emit(self, value):
+        pass
+
+
+class NullSignalHolder:
+    update_reference_measurement = NullSignal()
+    update_transmission_measurement = NullSignal()
+    check_the_scanning = NullSignal()
+    update_temp_measurement = NullSignal()
+
+
+class Params:
+    """Stand-in for a ParamWidget Element: `params.widget.get()` returns the values."""
+
+    def __init__(self, values):
+        self.values = dict(values)
+        self.widget = self
+
+    def get(self):
+        return dict(self.values)
+
+
+class SimulatedScan:
+    homelaser = Spectrum_Scan.homelaser
+    read_power = Spectrum_Scan.read_power
+    measure_repeats = Spectrum_Scan.measure_repeats
+    measure_repeats_blocks = Spectrum_Scan.measure_repeats_blocks
+    read_power_block = Spectrum_Scan.read_power_block
+    read_wavelength_timed = Spectrum_Scan.read_wavelength_timed
+    start_wavemeter = Spectrum_Scan.start_wavemeter
+    stop_wavemeter = Spectrum_Scan.stop_wavemeter
+    start_power_meter = Spectrum_Scan.start_power_meter
+    stop_power_meter = Spectrum_Scan.stop_power_meter
+    make_stopping = Spectrum_Scan.make_stopping
+    open_scan = Spectrum_Scan.open_scan
+    reference_spectra = Spectrum_Scan.reference_spectra
+    load_calibration = Spectrum_Scan.load_calibration
+    make_settle_detector = Spectrum_Scan.make_settle_detector
+    start_updatebus = Spectrum_Scan.start_updatebus
+    lineplot_save = Spectrum_Scan.lineplot_save
+    reference_scan = Spectrum_Scan.reference_scan
+    transmission_scan = Spectrum_Scan.transmission_scan
+    single_pass_scan = Spectrum_Scan.single_pass_scan
+
+    def __init__(self, instruments, wl_params, exp_params):
+        self.instruments = instruments
+        self.clock = instruments['clock']
+        self.laser = instruments['laser']
+        self.wm = instruments['wm']
+        self.pmd = instruments['pmd']
+        self.fungen = instruments['fungen']
+        self.windfreak = instruments['windfreak']
+        self.wl_parameters = Params(wl_params)
+        self.exp_parameters = Params(exp_params)
+        self.signalholder = NullSignalHolder()
+        self.router = LocalRouter(on_switch=self.pmd.select_arm)
+
+    def run(self, name):
+        """Run scan method `name` between the same setup and teardown steps as its task."""
+        # The reference scan sees the bare laser, the transmission scan the sample
+        if name == 'reference_scan':
+            self.router.select('reference')
+        elif name == 'transmission_scan':
+            self.router.select('sample')
+
+        original_time = scan_module.time
+        scan_module.time = self.clock.time_module
+        self.start_wavemeter()
+        self.start_power_meter()
+        self.start_updatebus()
+        self.load_calibration()
+        self.settle = self.make_settle_detector()
+        self.renderer = PlotRenderer()
+        try:
+            getattr(self, name)()
+        finally:
+            self.updatebus.stop()
+            self.renderer.shutdown()
+            self.stop_wavemeter()
+            self.stop_power_meter()
+            scan_module.time = original_time
+
+
+def default_parameters(points, repeats, start, stop, out_dir):
+    wl_params = {
+        'Laser WL Start': start,
+        'Laser WL Stop': stop,
+        'Number of Laser WL Point': points,
+        'Adaptive Sampling': False,
+        'Adaptive Point Budget': points,
+        'Adaptive Tolerance': 0.01,
+    }
+    exp_params = {
+        'Windfreak frequency': Q_(200, 'MHz'),
+        '# of AOMs': 3,
+        'Number of Repeating': repeats,
+        'RF Powers': '14.40',
+        'Resume Scan': False,
+        'Concurrent Sampling': False,
+        'Buffered Wavemeter': False,
+        'Wavemeter Rate': Q_(100, 'Hz'),
+        'Power Block Readout': False,
+        'Power Meter Averaging': 1,
+        'Power Block Size': 50,
+        'Sequential Stopping': False,
+        'Minimum Repeating': 50,
+        'Wavelength SEM Tolerance': 1e-6,
+        'Power SEM Tolerance': 1e-3,
+        'Settle Detection': False,
+        'Settle Slope': 5e-5,
+        'Settle Deviation': 5e-5,
+        'Settle Window': 8,
+        'Pulse Channel': 1,
+        'File Name': out_dir,
+        'Reference File Name': '',
+        'Normalization Method': 'lagrange',
+        'GUI Frame Rate': 10,
+        'Arm Routing': 'local',
+        'Reference Attenuator': '',
+        'Sample Attenuator': '',
+        'Homing Calibration File': '',
+    }
+    return wl_params, exp_params
+
+
+def benchmark_scans(points=21, repeats=100, start=1500.0, stop=1501.0, time_scale=0.0,
+                    scans=('reference_scan', 'transmission_scan', 'single_pass_scan'), out_dir=None, trace_memory=True,
+                    exp_overrides=None, seed=0):
+    """
+    Run the scans against simulated instruments and report their performance.
+
+    :param points: Number of wavelength points per scan.
+    :param repeats: 'Number of Repeating' per point.
+    :param time_scale: Fraction of simulated delays that is really slept (0 = as fast as possible).
+    :param scans: Names of the SimulatedScan methods to run, in order.
+    :param out_dir: Directory for the data files; a temporary directory by default.
+    :param trace_memory: Record peak Python memory with tracemalloc (slows the run down somewhat).
+    :param exp_overrides: Dictionary of 'Experiment Parameters' overriding the defaults.
+    :return: List of result dictionaries, one per scan.
+    """
+    out_dir = out_dir or tempfile.mkdtemp(prefix='scan_benchmark_')
+    wl_params, exp_params = default_parameters(points, repeats, start, stop, out_dir)
+    exp_params.update(exp_overrides or {})
+
+    instruments = simulated_instruments(time_scale=time_scale, seed=seed)
+    harness = SimulatedScan(instruments, wl_params, exp_params)
+    clock = instruments['clock']
+
+    results = []
+    for name in scans:
+        busy_before = dict(clock.busy_time)
+        slept_before = clock.slept
+        virtual_before = clock.now()
+        if trace_memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+
+        harness.run(name)
+
+        wall = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else float('nan')
+        if trace_memory:
+            tracemalloc.stop()
+
+        busy = {key: value - busy_before.get(key, 0.0) for key, value in clock.busy_time.items()}
+        results.append({
+            'scan': name,
+            'points': points,
+            'wall time': wall,
+            'points/s': points / wall,
+            'virtual time': clock.now() - virtual_before,
+            'sleep': clock.slept - slept_before,
+            'instrument busy': busy,
+            'peak memory MB': peak / 1e6,
+            'phases': harness.timer.totals(),
+        })
+
+    print_report(results)
+    print('Data written to', out_dir)
+    return results
+
+
+def print_report(results):
+    instruments = sorted({key for r in results for key in r['instrument busy']})
+    header = ['scan', 'wall s', 'points/s', 'virtual s', 'sleep s'] + [f'{key} s' for key in instruments] + ['peak MB']
+    rows = []
+    for r in results:
+        rows.append([r['scan'], f"{r['wall time']:.3f}", f"{r['points/s']:.2f}", f"{r['virtual time']:.1f}", f"{r['sleep']:.1f}"]
+                    + [f"{r['instrument busy'].get(key, 0.0):.2f}" for key in instruments]
+                    + [f"{r['peak memory MB']:.1f}"])
+    widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark Spectrum_Scan against simulated instruments.')
+    parser.add_argument('--points', type=int, default=21)
+    parser.add_argument('--repeats', type=int, default=100)
+    parser.add_argument('--start', type=float, default=1500.0)
+    parser.add_argument('--stop', type=float, default=1501.0)
+    parser.add_argument('--time-scale', type=float, default=0.0)
+    parser.add_argument('--concurrent', action='store_true', help='Use concurrent wavemeter/power meter sampling.')
+    parser.add_argument('--buffered', action='store_true', help='Drain the wavemeter buffer in bulk.')
+    parser.add_argument('--power-block', action='store_true', help='Read the power meter in raw blocks.')
+    parser.add_argument('--sequential', action='store_true', help='Use sequential-stopping averaging.')
+    parser.add_argument('--settle', action='store_true', help='Detect laser settling instead of waiting the full drift time.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc memory tracing.')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args()
+
+    benchmark_scans(points=args.points, repeats=args.repeats, start=args.start, stop=args.stop,
+                    time_scale=args.time_scale, out_dir=args.out, trace_memory=not args.no_memory,
+                    exp_overrides={'Concurrent Sampling': args.concurrent, 'Buffered Wavemeter': args.buffered,
+                                   'Power Block Readout': args.power_block,
+                                   'Sequential Stopping': args.sequential,
+                                   'Settle Detection': args.settle})
@@ -0,0 +1,113 @@
+"""
+Point-Level Checkpoints for Resumable Scans
+
+Overview:
+A scan interrupted by a lost laser connection or a reboot used to start over from 'Laser WL Start'. Every scan
+now keeps a small JSON checkpoint next to its data file that lists the wavelength indices already written, and
+the experiment and instrument settings of the scan. A resumed scan skips those points and keeps appending to
+the same data file (see ScanWriter.resume).
+
+1. ScanCheckpoint Class:
+   `mark_done(index, target)` after a point has been written to the data file, `finish()` once the scan is
+   complete. Every change is written atomically (temporary file + os.replace), so the checkpoint on disk is
+   never half-written and never lists a point the data file does not hold.
+
+2. find_unfinished:
+   Finds the newest unfinished checkpoint of a given scan in a directory whose settings match the current ones,
+   so a scan is only resumed with the parameters it was started with.
+"""
+
+import os
+import json
+import glob
+
+
+def checkpoint_path(data_file):
+    """Checkpoint file belonging to `data_file`."""
+    return os.path.splitext(data_file)[0] + '.checkpoint.json'
+
+
+def _plain(settings):
+    """Settings as JSON values, so that saved and current settings compare equal."""
+    def convert(value):
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, (bool, int, float, str)) or value is None:
+            return value
+        return str(value)
+    return {str(key): convert(value) for key, value in settings.items()}
+
+
+class ScanCheckpoint:
+    def __init__(self, data_file, scan, experiment_setting, instrument_setting=None, completed=(), finished=False):
+        """
+        :param data_file: Path of the scan's .h5 data file.
+        :param scan: Kind of scan, e.g. 'reference' or 'transmission'; only scans of the same kind are resumed.
+        :param experiment_setting: Scan parameters that have to match for a resume.
+        :param instrument_setting: Instrument settings that have to match for a resume.
+        :param completed: List of [index, target wavelength] of the points already written.
+        """
+        self.data_file = data_file
+        self.path = checkpoint_path(data_file)
+        self.scan = scan
+        self.experiment_setting = _plain(experiment_setting)
+        self.instrument_setting = _plain(instrument_setting or {})
+        self.completed = [list(point) for point in completed]
+        self.finished = finished
+        self.rows = {index: row for row, (index, target) in enumerate(self.completed)}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        return cls(state['data_file'], state['scan'], state['experiment_setting'], state['instrument_setting'],
+                   state['completed'], state['finished'])
+
+    def save(self):
+        state = {
+            'data_file': self.data_file,
+            'scan': self.scan,
+            'experiment_setting': self.experiment_setting,
+            'instrument_setting': self.instrument_setting,
+            'completed': self.completed,
+            'finished': self.finished,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def row(self, index):
+        """Row of point `index` in the data file, or None if it has not been measured yet."""
+        return self.rows.get(index)
+
+    def mark_done(self, index, target):
+        self.rows[index] = len(self.completed)
+        self.completed.append([int(index), float(target)])
+        self.save()
+
+    def finish(self):
+        self.finished = True
+        self.save()
+
+    def matches(self, scan, experiment_setting, instrument_setting=None):
+        return (self.scan == scan and self.experiment_setting == _plain(experiment_setting)
+                and self.instrument_setting == _plain(instrument_setting or {}))
+
+
+def find_unfinished(directory, scan, experiment_setting, instrument_setting=None):
+    """
+    :return: The most recently updated unfinished ScanCheckpoint in `directory` for this scan and these
+             settings whose data file still exists, or None.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, '*.checkpoint.json')), key=os.path.getmtime, reverse=True)
+    for path in paths:
+        try:
+            checkpoint = ScanCheckpoint.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f'Ignoring unreadable checkpoint {path}: {e}')
+            continue
+        if (not checkpoint.finished and os.path.exists(checkpoint.data_file)
+                and checkpoint.matches(scan, experiment_setting, instrument_setting)):
+            return checkpoint
+    return None
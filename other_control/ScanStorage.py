@@ -0,0 +1,234 @@
+"""
+Incremental HDF5 Storage for Spectrum Scans
+
+Overview:
+Reference and transmission scans used to keep every result in memory and pickle it once at the end, so a
+crash or a stop late in a scan lost everything. ScanWriter appends every wavelength point to a chunked HDF5
+file as soon as it is measured and flushes it, so the file on disk is always complete up to the last point.
+The file is written in SWMR (single-writer/multiple-reader) mode and can be opened with `load_scan` while
+the scan is still running.
+
+1. Layout:
+   - One 1-D dataset per summary quantity, one entry per wavelength point. The old pickle keys map onto
+     dataset names through DATASET_NAMES ("Laser wavelength" -> /laser_wavelength, "Power" -> /power, ...).
+   - Raw per-repeat samples are stored flat under /raw/<name>; /raw/sample_count holds the number of
+     samples of every point, so point i is raw[offset[i]:offset[i] + sample_count[i]]. Streams that can take a
+     different number of samples per point (e.g. the reference arm of a single-pass scan) are counted by their
+     own dataset, named in `raw_counts` and in the 'count' attribute of the stream.
+   - "Experiment Setup" is stored as attributes of the /experiment_setup group.
+   - Optional per-point timing (see PhaseTimer) is stored under /timing/<name>, one entry per point.
+   The datasets have to be chunked to be resizable, and chunked datasets cannot be memory-mapped; readers use
+   h5py slicing (or load_scan) instead, which only reads the chunks of the requested points.
+
+2. Resuming:
+   `ScanWriter.resume(path, n_points)` reopens an interrupted scan to append to it. HDF5 refuses to reopen a
+   file for writing that was not closed cleanly, so the first `n_points` points are copied into a fresh file
+   that replaces the old one; this also drops a point that was only partly written.
+
+3. load_scan:
+   Reads a scan back as a dictionary keyed like the old pickle files, and also accepts old .pkl files.
+"""
+
+import os
+import pickle
+import numpy as np
+import h5py
+
+
+# Pickle key -> HDF5 dataset name
+DATASET_NAMES = {
+    "Laser wavelength": "laser_wavelength",
+    "Power": "power",
+    "transmission_rate": "transmission_rate",
+    "Target wavelength": "target_wavelength",
+}
+
+
+def dataset_name(key):
+    """Return the HDF5 dataset name used for a pickle-style key."""
+    return DATASET_NAMES.get(key, key.lower().replace(' ', '_'))
+
+
+class ScanWriter:
+    def __init__(self, path, experiment_setting, summary_keys=("Laser wavelength", "Power"), raw_keys=("wavelength", "power"), timing_keys=(), chunk_points=64, chunk_samples=4096, raw_counts=None):
+        """
+        Creates the HDF5 file and all of its datasets, then switches it to SWMR mode.
+
+        :param path: Path of the .h5 file to create.
+        :param experiment_setting: Dictionary stored as attributes of /experiment_setup.
+        :param summary_keys: Pickle-style keys of the per-point summary values.
+        :param raw_keys: Names of the raw per-repeat sample streams.
+        :param timing_keys: Names of the per-point timing values (phase durations and counters).
+        :param chunk_points: HDF5 chunk length of the summary datasets.
+        :param chunk_samples: HDF5 chunk length of the raw datasets.
+        :param raw_counts: Dictionary raw key -> name of the dataset counting its samples per point, for streams
+                           not counted by /raw/sample_count.
+        """
+        self.path = path
+        self.summary_keys = tuple(summary_keys)
+        self.raw_keys = tuple(raw_keys)
+        self.timing_keys = tuple(timing_keys)
+        self.raw_counts = {key: (raw_counts or {}).get(key, 'sample_count') for key in self.raw_keys}
+        self.n_points = 0
+        self.n_timing = 0
+        self.offsets = {'sample_count': 0}
+        self.offsets.update({name: 0 for name in self.raw_counts.values()})
+
+        self.file = h5py.File(path, 'w', libver='latest')
+        setup = self.file.create_group('experiment_setup')
+        for key, value in experiment_setting.items():
+            setup.attrs[key] = value
+
+        self.summary = {}
+        for key in self.summary_keys:
+            self.summary[key] = self.file.create_dataset(dataset_name(key), shape=(0,), maxshape=(None,), dtype='f8', chunks=(chunk_points,))
+            self.summary[key].attrs['key'] = key
+
+        raw = self.file.create_group('raw')
+        self.raw = {}
+        for key in self.raw_keys:
+            self.raw[key] = raw.create_dataset(key, shape=(0,), maxshape=(None,), dtype='f8', chunks=(chunk_samples,))
+            self.raw[key].attrs['count'] = self.raw_counts[key]
+        self.counts = {name: raw.create_dataset(name, shape=(0,), maxshape=(None,), dtype='i8', chunks=(chunk_points,))
+                       for name in self.offsets}
+
+        # Datasets cannot be created once SWMR mode is on, so the timing layout is fixed here as well
+        timing = self.file.create_group('timing')
+        self.timing = {}
+        for key in self.timing_keys:
+            self.timing[key] = timing.create_dataset(key, shape=(0,), maxshape=(None,), dtype='f8', chunks=(chunk_points,))
+
+        self.file.swmr_mode = True
+        self.file.flush()
+
+    @classmethod
+    def resume(cls, path, n_points, n_timing=None):
+        """
+        Reopen the scan file `path` for appending, keeping its first `n_points` points.
+
+        :param n_timing: Timing records to keep, when a point spans several rows (default `n_points`).
+        :return: ScanWriter positioned after point `n_points`.
+        """
+        with h5py.File(path, 'r', libver='latest', swmr=True) as f:
+            experiment_setting = dict(f['experiment_setup'].attrs)
+            summary = {node.attrs['key']: node[:n_points] for node in f.values() if isinstance(node, h5py.Dataset)}
+            raw_counts = {name: node.attrs['count'] for name, node in f['raw'].items() if 'count' in node.attrs}
+            counts = {name: f['raw'][name][:n_points] for name in {'sample_count', *raw_counts.values()}}
+            raw = {name: node[:int(counts[raw_counts.get(name, 'sample_count')].sum())]
+                   for name, node in f['raw'].items() if name not in counts}
+            n_timing = n_points if n_timing is None else n_timing
+            timing = {name: node[:n_timing] for name, node in f['timing'].items()} if 'timing' in f else {}
+            chunk_points = f['raw/sample_count'].chunks[0]
+            chunk_samples = next((node.chunks[0] for name, node in f['raw'].items() if name not in counts), 4096)
+        if len(counts['sample_count']) < n_points:
+            raise ValueError(f"{path} holds {len(counts['sample_count'])} points, cannot resume after {n_points}.")
+
+        tmp_path = path + '.tmp'
+        writer = cls(tmp_path, experiment_setting, summary_keys=tuple(summary), raw_keys=tuple(raw), timing_keys=tuple(timing),
+                     chunk_points=chunk_points, chunk_samples=chunk_samples, raw_counts=raw_counts)
+        for datasets, values in ((writer.summary, summary), (writer.raw, raw), (writer.timing, timing), (writer.counts, counts)):
+            for key, dset in datasets.items():
+                dset.resize((len(values[key]),))
+                dset[:] = values[key]
+        writer.close()
+        os.replace(tmp_path, path)
+
+        writer.path = path
+        writer.file = h5py.File(path, 'r+', libver='latest')
+        writer.summary = {key: writer.file[dataset_name(key)] for key in writer.summary_keys}
+        writer.raw = {key: writer.file['raw'][key] for key in writer.raw_keys}
+        writer.counts = {name: writer.file['raw'][name] for name in writer.offsets}
+        writer.timing = {key: writer.file['timing'][key] for key in writer.timing_keys}
+        writer.n_points = n_points
+        writer.offsets = {name: int(values.sum()) for name, values in counts.items()}
+        writer.n_timing = min(n_timing, min((len(values) for values in timing.values()), default=n_timing))
+        writer.file.swmr_mode = True
+        return writer
+
+    def append_point(self, summary, raw=None):
+        """
+        Append one wavelength point and flush it to disk.
+
+        :param summary: Dictionary with one scalar per summary key.
+        :param raw: Optional dictionary with one 1-D array per raw key; all arrays counted by the same count
+                    dataset must have the same length.
+        """
+        i = self.n_points
+        for key, dset in self.summary.items():
+            dset.resize((i + 1,))
+            dset[i] = summary.get(key, np.nan)
+
+        raw = raw or {}
+        for name, count in self.counts.items():
+            keys = [key for key in self.raw_keys if self.raw_counts[key] == name]
+            given = [key for key in keys if key in raw]
+            n = len(raw[given[0]]) if given else 0
+            offset = self.offsets[name]
+            for key in keys:
+                values = np.asarray(raw[key], dtype=np.float64) if key in raw else np.full(n, np.nan)
+                if len(values) != n:
+                    raise ValueError(f"Raw stream '{key}' has {len(values)} samples, expected {n}.")
+                self.raw[key].resize((offset + n,))
+                self.raw[key][offset:] = values
+            count.resize((i + 1,))
+            count[i] = n
+            self.offsets[name] = offset + n
+
+        self.n_points += 1
+        self.file.flush()
+
+    @property
+    def n_samples(self):
+        """Number of raw samples stored in the streams counted by /raw/sample_count."""
+        return self.offsets['sample_count']
+
+    def append_timing(self, timing):
+        """
+        Append the timing record of one point (e.g. PhaseTimer.end_point()) and flush it to disk.
+        Names without a timing dataset are ignored; phases or counters the point did not use are stored as 0.
+        """
+        i = self.n_timing
+        for key, dset in self.timing.items():
+            dset.resize((i + 1,))
+            dset[i] = timing.get(key, 0.0)
+        self.n_timing += 1
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.flush()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_scan(path, raw=False):
+    """
+    Load a scan stored by ScanWriter (or an old pickle file) into a dictionary keyed like the pickle files.
+
+    :param path: Path to a .h5 or .pkl scan file.
+    :param raw: Also return the raw per-repeat samples under the "Raw" key (HDF5 files only).
+    :return: Dictionary with "Laser wavelength", "Power", ..., "Experiment Setup" and, for files with timing
+             data, "Timing".
+    """
+    if os.path.splitext(path)[1] == '.pkl':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    data = {}
+    with h5py.File(path, 'r', libver='latest', swmr=True) as f:
+        for name, node in f.items():
+            if isinstance(node, h5py.Dataset):
+                data[node.attrs.get('key', name)] = node[:]
+        data["Experiment Setup"] = dict(f['experiment_setup'].attrs)
+        if 'timing' in f and len(f['timing']):
+            data["Timing"] = {name: node[:] for name, node in f['timing'].items()}
+        if raw:
+            raw_group = f['raw']
+            data["Raw"] = {name: node[:] for name, node in raw_group.items()}
+    return data
@@ -0,0 +1,179 @@
+"""
+Sequential-Stopping Averaging
+
+Overview:
+A fixed repeat count spends the same number of samples on every point, whether the readings have long
+converged or are still noisy. SequentialStopping keeps running statistics of every sampled quantity and
+declares a point done as soon as the standard error of the mean of each quantity is below its tolerance,
+within a minimum and maximum number of samples.
+
+1. RunningStats Class:
+   Welford's online mean and variance: `add(x)` is O(1) and numerically stable, so the stopping rule can be
+   checked after every sample.
+
+2. SequentialStopping Class:
+   `reset()` at the start of a point, `add(name=value, ...)` after every sample, `done()` to ask whether
+   sampling can stop. A quantity read at its own rate (e.g. a block drained from the wavemeter buffer) is added
+   with `extend(name, values)` and does not count towards the number of samples. The minimum sample count keeps the variance estimate meaningful; the SEM assumes the
+   samples are independent, so slow drifts within a point are not accounted for.
+
+3. RobustAverage Class:
+   Outlier-resistant wavelength average for get_avg_wavelength. Readings further than `threshold` robust
+   standard deviations (1.4826 * MAD) from the median are rejected, so a wavemeter glitch or a short mode hop
+   does not shift the mean of the rest. With a `precision`, sampling stops as soon as `confidence` standard
+   errors of the kept readings fit inside it; otherwise, and at the latest, after `max_samples` readings.
+   `result()` is a WavelengthAverage: a float, so it replaces a plain mean anywhere, that also carries the
+   number of readings taken and kept and their spread.
+"""
+
+import math
+import numpy as np
+
+
+class RunningStats:
+    __slots__ = ('n', 'mean', 'm2')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        """Sample variance (n - 1 in the denominator)."""
+        return self.m2 / (self.n - 1) if self.n > 1 else math.inf
+
+    @property
+    def sem(self):
+        """Standard error of the mean."""
+        return math.sqrt(self.variance / self.n) if self.n > 1 else math.inf
+
+
+class SequentialStopping:
+    def __init__(self, tolerances, min_samples=50, max_samples=1000):
+        """
+        :param tolerances: Dictionary mapping a quantity name to the SEM at which it counts as converged,
+                           in the units of that quantity.
+        :param min_samples: Samples always taken per point.
+        :param max_samples: Samples after which a point stops even if it has not converged.
+        """
+        if min_samples < 2:
+            raise ValueError('At least 2 samples are needed to estimate a standard error.')
+        self.tolerances = dict(tolerances)
+        self.min_samples = min_samples
+        self.max_samples = max(max_samples, min_samples)
+        self.reset()
+
+    def reset(self):
+        self.stats = {name: RunningStats() for name in self.tolerances}
+        self.n = 0
+
+    def add(self, **values):
+        """Add one sample of every quantity given as a keyword argument."""
+        for name, value in values.items():
+            if name in self.stats:
+                self.stats[name].add(value)
+        self.n += 1
+
+    def extend(self, name, values):
+        """Add readings of quantity `name` that are not tied to a sample."""
+        if name in self.stats:
+            for value in values:
+                self.stats[name].add(value)
+
+    def converged(self):
+        return all(self.stats[name].sem <= tolerance for name, tolerance in self.tolerances.items())
+
+    def done(self):
+        if self.n >= self.max_samples:
+            return True
+        return self.n >= self.min_samples and self.converged()
+
+    def remaining(self):
+        """Samples still needed before the stopping rule can first fire (at least one while not done)."""
+        if self.done():
+            return 0
+        return max(self.min_samples - self.n, 1)
+
+    def report(self):
+        return ', '.join(f'{name} SEM {stats.sem:.3g}' for name, stats in self.stats.items())
+
+
+class WavelengthAverage(float):
+    """Average wavelength in nm, with `count` readings taken, `kept` after outlier rejection, their `spread`
+    (standard deviation) and the standard error `sem` of the average, both in nm."""
+
+    def __new__(cls, value, count=0, kept=0, spread=math.nan, sem=math.nan):
+        average = super().__new__(cls, value)
+        average.count = count
+        average.kept = kept
+        average.spread = spread
+        average.sem = sem
+        return average
+
+    def report(self):
+        return f'{self.kept}/{self.count} readings, spread {self.spread:.2g}nm, SEM {self.sem:.2g}nm'
+
+
+class RobustAverage:
+    def __init__(self, max_samples, precision=None, min_samples=5, threshold=3.5, confidence=2.0, resolution=1e-6):
+        """
+        :param max_samples: Readings after which the average is returned in any case.
+        :param precision: Half width in nm the confidence interval of the average has to fit in for an early
+                          return; None always takes `max_samples` readings.
+        :param min_samples: Readings always taken before an early return.
+        :param threshold: Rejection threshold in robust standard deviations from the median.
+        :param confidence: Standard errors making up the half width of the confidence interval.
+        :param resolution: Smallest robust standard deviation assumed, in nm, so identical readings (MAD of 0)
+                           do not reject every reading that differs in the last digit.
+        """
+        self.max_samples = max(int(max_samples), 1)
+        self.precision = precision
+        self.min_samples = min(max(int(min_samples), 2), self.max_samples)
+        self.threshold = threshold
+        self.confidence = confidence
+        self.resolution = resolution
+        self.values = []
+        self.stats = None
+
+    def extend(self, values):
+        self.values.extend(float(value) for value in values)
+        self.stats = None
+
+    def add(self, value):
+        self.extend([value])
+
+    def remaining(self):
+        return max(self.max_samples - len(self.values), 0)
+
+    def statistics(self):
+        """:return: (mean, spread, sem, kept) of the readings within the rejection threshold."""
+        if self.stats is None:
+            values = np.array(self.values[:self.max_samples])
+            median = np.median(values)
+            sigma = max(1.4826 * np.median(np.abs(values - median)), self.resolution)
+            kept = values[np.abs(values - median) <= self.threshold * sigma]
+            spread = kept.std(ddof=1) if len(kept) > 1 else math.inf
+            self.stats = (kept.mean(), spread, spread / math.sqrt(len(kept)), len(kept))
+        return self.stats
+
+    def done(self):
+        n = len(self.values)
+        if n >= self.max_samples:
+            return True
+        if self.precision is None or n < self.min_samples:
+            return False
+        mean, spread, sem, kept = self.statistics()
+        return kept >= self.min_samples and self.confidence * sem <= self.precision
+
+    def result(self):
+        if not self.values:
+            raise ValueError('No wavelength readings to average.')
+        mean, spread, sem, kept = self.statistics()
+        return WavelengthAverage(mean, min(len(self.values), self.max_samples), kept, spread, sem)
@@ -0,0 +1,132 @@
+"""
+Settle Detection After Laser Actuation
+
+Overview:
+Homing used to sleep a fixed drift time (4s) after every motor step and piezo change before measuring
+again, even when the laser had settled after a fraction of that. SettleDetector instead streams wavemeter
+readings right after an actuation and stops as soon as the wavelength has stopped moving; the old fixed delay
+is kept as the timeout.
+
+1. Settle Criterion:
+   Over the last `window` readings, a straight line is fitted against the reading timestamps. The laser counts
+   as settled when the magnitude of the slope is below `max_slope` (nm/s) and the standard deviation of the
+   residuals is below `max_deviation` (nm), and at least `min_wait` seconds have passed since the actuation.
+   Both thresholds have to sit above the wavemeter's own noise, or the detector only ends at the timeout.
+   Readings are taken at the wavemeter's update rate; a reading equal to the previous one that arrives within one
+   update `period` is a repeat of a stale value and is skipped, since repeats would shrink the measured spread
+   and let the laser count as settled too early.
+
+2. wait_for_laser:
+   One call for the homing loops: waits with the detector (or sleeps the fixed time when there is none) and
+   returns the wavelength to use for the next correction step.
+   Both waits are written once as control loops (`SettleDetector.steps`, `wait_for_laser_steps`, see
+   ControlSteps) that the blocking functions here and the coroutines in AsyncLaserControl run.
+
+3. Clock:
+   Timestamps and pauses go through `clock` (anything with `perf_counter` and `sleep`, the time module by
+   default), so the detector also runs on the simulated clock of SimulatedInstruments.
+"""
+
+import time
+from collections import deque
+import numpy as np
+
+from ControlSteps import Call, Sleep, run_steps
+from PhaseTimer import NULL_TIMER
+
+
+class SettleDetector:
+    def __init__(self, max_slope=5e-5, max_deviation=5e-5, window=8, interval=0.2, min_wait=0.2, period=0.2,
+                 clock=time):
+        """
+        :param max_slope: Largest wavelength slope counted as settled, in nm/s.
+        :param max_deviation: Largest standard deviation around the fitted line counted as settled, in nm.
+        :param window: Number of most recent readings the criterion is evaluated on.
+        :param interval: Pause between two readings, in seconds; the wavemeter's update period by default.
+        :param period: Update period of the wavemeter (5Hz for the Bristol 771), in seconds.
+        :param min_wait: Time after the actuation before the laser may count as settled, in seconds.
+        :param clock: Module or object providing perf_counter() and sleep().
+        """
+        self.max_slope = max_slope
+        self.max_deviation = max_deviation
+        self.window = max(window, 3)
+        self.interval = interval
+        self.min_wait = min_wait
+        self.period = period
+        self.clock = clock
+
+    def fresh(self, times, values, value, now):
+        """False for a repeat of the previous reading within one update period."""
+        return not values or value != values[-1] or now - times[-1] >= self.period
+
+    def check(self, times, values):
+        """
+        :return: (settled, slope in nm/s, deviation in nm) for the readings `values` taken at `times`.
+        """
+        t = np.asarray(times) - times[0]
+        y = np.asarray(values)
+        dt = t - t.mean()
+        denominator = np.dot(dt, dt)
+        slope = np.dot(dt, y - y.mean()) / denominator if denominator > 0 else 0.0
+        residuals = y - y.mean() - slope * dt
+        deviation = np.sqrt(np.dot(residuals, residuals) / max(len(y) - 2, 1))
+        return abs(slope) <= self.max_slope and deviation <= self.max_deviation, slope, deviation
+
+    def wait(self, read, timeout):
+        """
+        Read the wavelength until the laser has settled or `timeout` seconds have passed.
+
+        :param read: Callable returning one wavelength reading in nm.
+        :param timeout: Longest wait in seconds (the old fixed drift time).
+        :return: (wavelength, elapsed seconds, settled). The wavelength is the mean of the settled window, or
+                 the last reading on timeout.
+        """
+        return run_steps(self.steps(read, timeout))
+
+    def steps(self, read, timeout):
+        """Control loop of `wait`, for run_steps or run_steps_async."""
+        start = self.clock.perf_counter()
+        times = deque(maxlen=self.window)
+        values = deque(maxlen=self.window)
+        while True:
+            value = yield Call(read)
+            now = self.clock.perf_counter()
+            if self.fresh(times, values, value, now):
+                values.append(value)
+                times.append(now)
+            elapsed = now - start
+            if len(values) == self.window and elapsed >= self.min_wait:
+                settled, slope, deviation = self.check(times, values)
+                if settled:
+                    return float(np.mean(values)), elapsed, True
+            if elapsed >= timeout:
+                print(f'Settle timeout after {elapsed:.2f}s.')
+                return values[-1], elapsed, False
+            if self.interval:
+                yield Sleep(self.interval, self.clock)
+
+
+def wait_for_laser(wm, timeout, detector=None, timer=NULL_TIMER, clock=time):
+    """
+    Wait for the laser to settle after an actuation and return its wavelength.
+
+    :param wm: Wavelength meter instance.
+    :param timeout: Fixed drift time in seconds; the full wait without a detector, the timeout with one.
+    :param detector: Optional SettleDetector.
+    :param timer: Optional PhaseTimer; the wait is booked as 'settle', a separate reading as 'wavemeter'.
+    :param clock: Time module used for the fixed wait.
+    :return: Wavelength in nm.
+    """
+    return run_steps(wait_for_laser_steps(wm, timeout, detector, timer, clock))
+
+
+def wait_for_laser_steps(wm, timeout, detector=None, timer=NULL_TIMER, clock=time):
+    """Control loop of wait_for_laser, for run_steps or run_steps_async."""
+    if detector is None:
+        with timer.phase('settle'):
+            yield Sleep(timeout, clock)
+        with timer.phase('wavemeter'):
+            return (yield Call(wm.measure_wavelength))
+    with timer.phase('settle'):
+        wavelength, elapsed, settled = yield from detector.steps(wm.measure_wavelength, timeout)
+    return wavelength
@@ -0,0 +1,350 @@
+"""
+Simulated Instruments
+
+Overview:
+Drop-in stand-ins for the instruments used by Spectrum_Scan, so scan code can be run and timed away from the
+optical table. They expose the same attributes and methods the scans use, and share one SimClock so laser
+dynamics, drift and instrument latency all follow the same (virtual) time.
+
+1. SimClock:
+   Virtual time that advances by every requested sleep and instrument latency. `time_scale` sets how much of
+   that is really slept: 0 runs as fast as the code allows, 1 runs in real time. `time_module` is a drop-in for
+   the `time` module whose `sleep` and `perf_counter` go through the clock.
+
+2. Instruments:
+   - SimulatedLaser: Toptica DLC pro (motor wavelength set point, piezo voltage), with a first-order motor lag,
+     a wavelength-dependent set point offset, a slightly nonlinear piezo response and slow drift.
+     It is a LaserSession, so it can be passed anywhere a laser session is expected.
+   - SimulatedWavemeter: Bristol 771 (measure_wavelength, start_data, stop_data, and fetch_buffer for
+     WavemeterBuffer; a drained block sees the laser wavelength at the time of the request).
+   - SimulatedPowerMeter: Thorlabs PM100D (`power` in W), seeing a synthetic transmission spectrum on the sample
+     arm and the bare laser power on the reference arm; `set_averaging`, `get_averaging` and `read_block` for
+     PowerBlockReader.
+   - SimulatedFunctionGenerator: Keysight 33622A channel features used by the scans.
+   - SimulatedSynthNVPro: Windfreak SynthNV Pro.
+"""
+
+import time
+import threading
+import numpy as np
+
+from LaserSession import LaserSession
+
+
+class SimClock:
+    def __init__(self, time_scale=0.0):
+        """
+        :param time_scale: Fraction of every simulated delay that is really slept.
+        """
+        self.time_scale = time_scale
+        self.offset = 0.0
+        self.slept = 0.0
+        self.busy_time = {}
+        self.lock = threading.Lock()
+        self.time_module = _ClockedTime(self)
+
+    def now(self):
+        """Virtual time in seconds."""
+        return time.perf_counter() + self.offset
+
+    def sleep(self, seconds):
+        """Advance virtual time by `seconds`, really sleeping `time_scale * seconds`."""
+        seconds = float(getattr(seconds, 'magnitude', seconds))
+        if seconds <= 0:
+            return
+        real = seconds * self.time_scale
+        with self.lock:
+            self.offset += seconds - real
+            self.slept += seconds
+        if real:
+            time.sleep(real)
+
+    def busy(self, seconds, name='instrument'):
+        """Instrument latency: same as sleep, but booked as busy time of instrument `name`."""
+        self.sleep(seconds)
+        with self.lock:
+            self.slept -= seconds
+            self.busy_time[name] = self.busy_time.get(name, 0.0) + seconds
+
+
+class _ClockedTime:
+    """Stand-in for the `time` module whose sleep advances a SimClock."""
+
+    def __init__(self, clock):
+        self._clock = clock
+
+    def sleep(self, seconds):
+        self._clock.sleep(seconds)
+
+    def perf_counter(self):
+        return self._clock.now()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def lorentzian_dips(centers, widths, depths, baseline=1.0):
+    """
+    :return: Transmission spectrum T(wavelength) with Lorentzian dips (FWHM `widths`) at `centers`.
+    """
+    centers, widths, depths = (np.atleast_1d(v)[:, np.newaxis] for v in (centers, widths, depths))
+
+    def spectrum(wavelength):
+        wavelength = np.atleast_1d(wavelength)
+        dips = depths / (1 + ((wavelength - centers) / (widths / 2)) ** 2)
+        result = baseline - dips.sum(axis=0)
+        return result if result.size > 1 else float(result[0])
+    return spectrum
+
+
+class _SimulatedToptica:
+    """Client-side parameter interface of the simulated DLC pro."""
+
+    def __init__(self, laser):
+        self.laser = laser
+
+    def get(self, param_name, *param_types):
+        laser = self.laser
+        laser.clock.busy(laser.latency, 'laser')
+        if param_name == 'laser1:ctl:wavelength-set':
+            return laser.motor_set
+        if param_name == 'laser1:dl:pc:voltage-set':
+            return laser.piezo
+        if param_name == 'laser1:dl:pc:enabled':
+            return laser.piezo_enabled
+        return laser.parameters.get(param_name)
+
+    def set(self, param_name, *param_values):
+        laser = self.laser
+        laser.clock.busy(laser.latency, 'laser')
+        value = param_values[0]
+        if param_name == 'laser1:ctl:wavelength-set':
+            laser.move_motor(value)
+        elif param_name == 'laser1:dl:pc:voltage-set':
+            laser.piezo = float(value)
+        elif param_name == 'laser1:dl:pc:enabled':
+            laser.piezo_enabled = bool(value)
+        else:
+            laser.parameters[param_name] = value
+        return 0
+
+    def close(self):
+        pass
+
+
+class SimulatedLaser(LaserSession):
+    def __init__(self, clock, wavelength=1500.0, latency=0.02, motor_tau=1.0, set_offset=0.012, set_slope=2e-4,
+                 piezo_coefficient=-0.001338, piezo_curvature=0.004, drift_rate=2e-7, seed=None):
+        """
+        :param clock: Shared SimClock.
+        :param wavelength: Initial motor set point in nm.
+        :param latency: Time per get/set request, in seconds.
+        :param motor_tau: Time constant of the motor approaching a new set point, in seconds.
+        :param set_offset, set_slope: True wavelength = set point + set_offset + set_slope * (set point - 1500).
+        :param piezo_coefficient: Tuning coefficient at 70V in nm/V.
+        :param piezo_curvature: Relative change of the tuning coefficient per 10V away from 70V.
+        :param drift_rate: Random-walk wavelength drift in nm/sqrt(s).
+        """
+        super().__init__(connection=None)
+        self.clock = clock
+        self.latency = latency
+        self.motor_tau = motor_tau
+        self.set_offset = set_offset
+        self.set_slope = set_slope
+        self.piezo_coefficient = piezo_coefficient
+        self.piezo_curvature = piezo_curvature
+        self.drift_rate = drift_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.motor_set = wavelength
+        self.motor_from = self.motor_target(wavelength)
+        self.motor_time = clock.now()
+        self.piezo = 70.0
+        self.piezo_enabled = True
+        self.parameters = {}
+        self.drift = 0.0
+        self.drift_time = clock.now()
+
+    def open(self):
+        with self.lock:
+            if self.client is None:
+                self.client = _SimulatedToptica(self)
+
+    def motor_target(self, setpoint):
+        return setpoint + self.set_offset + self.set_slope * (setpoint - 1500)
+
+    def motor_wavelength(self):
+        t = self.clock.now() - self.motor_time
+        target = self.motor_target(self.motor_set)
+        return target + (self.motor_from - target) * np.exp(-t / self.motor_tau)
+
+    def move_motor(self, setpoint):
+        self.motor_from = self.motor_wavelength()
+        self.motor_set = float(setpoint)
+        self.motor_time = self.clock.now()
+
+    def piezo_shift(self):
+        dv = self.piezo - 70.0
+        return self.piezo_coefficient * dv * (1 + self.piezo_curvature * dv / 10 / 2)
+
+    def wavelength(self):
+        """True optical wavelength at the current virtual time."""
+        now = self.clock.now()
+        dt = now - self.drift_time
+        if dt > 0:
+            self.drift += self.drift_rate * np.sqrt(dt) * self.rng.standard_normal()
+            self.drift_time = now
+        return self.motor_wavelength() + self.piezo_shift() + self.drift
+
+
+class SimulatedWavemeter:
+    def __init__(self, clock, laser, latency=0.005, noise=2e-5, glitch_probability=0.0, period=0.01, seed=None):
+        """
+        :param latency: Time per reading or buffer request, in seconds.
+        :param period: Measurement period of the buffered acquisition, in seconds.
+        :param noise: Standard deviation of the reading noise, in nm.
+        :param glitch_probability: Probability of a reading being off by a mode hop (0.01-0.1nm).
+        """
+        self.clock = clock
+        self.laser = laser
+        self.latency = latency
+        self.noise = noise
+        self.glitch_probability = glitch_probability
+        self.period = period
+        self.rng = np.random.default_rng(seed)
+        self.reads = 0
+        self.buffer_start = None
+        self.buffered = 0
+
+    def start_data(self):
+        self.buffer_start = self.clock.now()
+        self.buffered = 0
+
+    def stop_data(self):
+        self.buffer_start = None
+
+    def reading(self, n=None):
+        value = self.laser.wavelength() + self.noise * self.rng.standard_normal(n)
+        if self.glitch_probability:
+            glitch = self.rng.random(n) < self.glitch_probability
+            value = value + glitch * self.rng.choice([-1, 1], n) * self.rng.uniform(0.01, 0.1, n)
+        return value
+
+    def measure_wavelength(self):
+        self.clock.busy(self.latency, 'wavemeter')
+        self.reads += 1
+        return float(self.reading())
+
+    def fetch_buffer(self):
+        """Records (WavemeterBuffer.RECORD layout) measured since the last request."""
+        self.clock.busy(self.latency, 'wavemeter')
+        self.reads += 1
+        if self.buffer_start is None:
+            return []
+        total = int((self.clock.now() - self.buffer_start) / self.period)
+        n = total - self.buffered
+        index = np.arange(self.buffered + 1, total + 1)
+        self.buffered = total
+        return [(wavelength, 0.0, 0, k) for wavelength, k in zip(self.reading(n), index)]
+
+
+class _Power:
+    """Minimal Quantity stand-in; PM100D returns powers in W."""
+
+    def __init__(self, magnitude):
+        self.magnitude = magnitude
+
+
+class SimulatedPowerMeter:
+    def __init__(self, clock, laser, spectrum=None, power=1e-6, latency=0.003, noise=0.005, sample_time=0.0003, seed=None):
+        """
+        :param spectrum: Transmission T(wavelength) seen on the sample arm; defaults to three Lorentzian dips.
+        :param power: Laser power at the meter in W.
+        :param latency: Time per reading or block request, in seconds.
+        :param noise: Relative standard deviation of the reading noise.
+        :param sample_time: Time per internal sample, averaged `averaging` times per reading.
+        """
+        self.clock = clock
+        self.laser = laser
+        self.spectrum = spectrum or lorentzian_dips([1500.2, 1500.5, 1500.8], [0.01, 0.004, 0.02], [0.6, 0.8, 0.3])
+        self.base_power = power
+        self.latency = latency
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.sample_time = sample_time
+        self.averaging = 1
+        self.arm = 'sample'
+        self.reads = 0
+
+    def select_arm(self, arm):
+        """Hook for LocalRouter: the reference arm sees the bare laser power."""
+        self.arm = arm
+
+    @property
+    def power(self):
+        self.clock.busy(self.latency, 'power meter')
+        self.reads += 1
+        return _Power(float(self.reading()))
+
+    def reading(self, n=None):
+        transmission = 1.0 if self.arm == 'reference' else self.spectrum(self.laser.wavelength())
+        noise = self.noise / np.sqrt(self.averaging)
+        return self.base_power * transmission * (1 + noise * self.rng.standard_normal(n))
+
+    def set_averaging(self, count):
+        self.clock.busy(self.latency, 'power meter')
+        self.averaging = int(count)
+
+    def get_averaging(self):
+        self.clock.busy(self.latency, 'power meter')
+        return self.averaging
+
+    def read_block(self, n):
+        """`n` readings in W in one request; the block sees the laser wavelength at the time of the request."""
+        self.clock.busy(self.latency + n * self.averaging * self.sample_time, 'power meter')
+        self.reads += 1
+        return self.reading(n)
+
+
+class SimulatedFunctionGenerator:
+    def __init__(self, clock, latency=0.002):
+        self.clock = clock
+        self.latency = latency
+        self.output = {1: 'OFF', 2: 'OFF'}
+        self.offset = {}
+        self.phase = {}
+        self.waveform = {}
+        self.voltage = {}
+
+    def clear_mem(self, channel):
+        self.clock.busy(self.latency, 'function generator')
+
+    def wait(self):
+        self.clock.busy(self.latency, 'function generator')
+
+
+class SimulatedSynthNVPro:
+    def __init__(self, clock, latency=0.002):
+        self.clock = clock
+        self.latency = latency
+        self.frequency = 0
+        self.output = 0
+        self.power = 0
+
+
+def simulated_instruments(time_scale=0.0, seed=0, **laser_options):
+    """
+    Build a consistent set of simulated instruments on one clock.
+
+    :return: Dictionary with 'clock', 'laser', 'wm', 'pmd', 'fungen' and 'windfreak'.
+    """
+    clock = SimClock(time_scale)
+    laser = SimulatedLaser(clock, seed=seed, **laser_options)
+    return {
+        'clock': clock,
+        'laser': laser,
+        'wm': SimulatedWavemeter(clock, laser, seed=seed + 1),
+        'pmd': SimulatedPowerMeter(clock, laser, seed=seed + 2),
+        'fungen': SimulatedFunctionGenerator(clock),
+        'windfreak': SimulatedSynthNVPro(clock),
+    }
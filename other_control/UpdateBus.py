@@ -0,0 +1,119 @@
+"""
+Rate-Limited GUI Update Bus
+
+Overview:
+The scan tasks used to emit a Qt signal after every single sample, which for long repeat loops means
+hundreds of thousands of cross-thread emissions and replots. UpdateBus sits between a measurement task and
+its signals: `publish` only stores the update and returns immediately, and a background thread emits the
+coalesced updates at a fixed frame rate.
+
+1. Policies (per signal):
+   - 'latest': only the newest payload is kept; older unsent payloads are dropped.
+     Suitable for signals that always carry the full arrays (reference/transmission spectra).
+   - 'merge': payloads are deltas (dictionaries of arrays holding only the new samples). Pending deltas
+     are concatenated key by key and emitted together with a 'reset' flag, so the receiver only has to
+     append the samples added since the last emission.
+
+2. DeltaBuffer:
+   Receiver-side helper that rebuilds the full arrays from a stream of 'merge' emissions.
+"""
+
+import threading
+import numpy as np
+
+
+class UpdateBus:
+    def __init__(self, frame_rate=10):
+        """
+        :param frame_rate: Maximum number of emissions per second and signal.
+        """
+        self.interval = 1 / frame_rate
+        self.signals = {}
+        self.policies = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, name, signal, policy='latest'):
+        """
+        Register a signal under `name` with its coalescing policy ('latest' or 'merge').
+        """
+        if policy not in ('latest', 'merge'):
+            raise ValueError(f"Unknown update policy '{policy}'.")
+        self.signals[name] = signal
+        self.policies[name] = policy
+
+    def publish(self, name, values, reset=False):
+        """
+        Queue an update for a registered signal without blocking on the GUI.
+
+        :param name: Name the signal was registered under.
+        :param values: Payload dictionary; for 'merge' signals only the new samples.
+        :param reset: For 'merge' signals, discard everything sent so far (e.g. at the start of a new point).
+        """
+        policy = self.policies[name]
+        with self.lock:
+            if policy == 'latest':
+                self.pending[name] = values
+            else:
+                entry = self.pending.get(name)
+                if entry is None or reset:
+                    entry = {'reset': reset, 'deltas': []}
+                    self.pending[name] = entry
+                entry['deltas'].append(values)
+
+    def flush(self):
+        """Emit every pending update immediately."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for name, entry in pending.items():
+            signal = self.signals[name]
+            if self.policies[name] == 'latest':
+                signal.emit(entry)
+            else:
+                deltas = entry['deltas']
+                values = {key: np.concatenate([np.atleast_1d(d[key]) for d in deltas]) for key in deltas[0]}
+                values['reset'] = entry['reset']
+                signal.emit(values)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the emitting thread and send whatever is still pending."""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+class DeltaBuffer:
+    """Rebuilds full arrays on the receiving side of a 'merge' signal."""
+
+    def __init__(self):
+        self.data = {}
+
+    def update(self, values):
+        """
+        :param values: Emitted payload with a 'reset' flag and one array per key.
+        :return: Dictionary with the full arrays accumulated since the last reset.
+        """
+        if values.get('reset', False):
+            self.data = {}
+        for key, delta in values.items():
+            if key == 'reset':
+                continue
+            if key in self.data:
+                self.data[key] = np.concatenate([self.data[key], delta])
+            else:
+                self.data[key] = np.asarray(delta)
+        return self.data
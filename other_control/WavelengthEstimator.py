@@ -0,0 +1,157 @@
+"""
+Continuous Wavelength Estimation
+
+Overview:
+The stabilizer averaged 15 fresh wavemeter readings (3s) before every decision, so drift was noticed seconds late
+and every check cost a full acquisition. WavelengthEstimator is fed by a background thread and keeps running
+statistics of the wavelength up to date, so the current estimate can be read at any moment at no cost.
+
+1. Statistics:
+   - Windowed mean and variance of the last `window` samples, from running sums over a ring of samples. The
+     sums are taken relative to a reference wavelength, so the variance of readings around 1500nm that differ in
+     the sixth decimal does not cancel out, and recomputed exactly once per turn of the ring.
+   - Exponentially weighted moving average and variance with smoothing factor 2 / (span + 1); it follows drift
+     within a few samples.
+   `snapshot()` returns all of them together with the sample count and the time of the newest sample.
+
+2. Feeding:
+   `start()` runs a thread that drains a WavemeterBuffer reader (or polls `measure_wavelength()` of a plain
+   wavemeter) every `interval` seconds; `add(times, values)` can also be called directly. `reset()` forgets all
+   samples, e.g. after a laser correction, and `wait_ready()` waits until the window is full again. A drain and
+   the addition of its samples happen under the same lock as `reset()`, which also skips what the reader has not
+   drained yet, so no reading from before a reset can end up in the new window. An exception in the thread ends
+   it and is kept in `errors`.
+"""
+
+import threading
+import time
+import numpy as np
+
+
+class WavelengthEstimator:
+    def __init__(self, source=None, window=15, span=5, interval=0.2, clock=time):
+        """
+        :param source: WavemeterBuffer reader (anything with drain()) or wavemeter with measure_wavelength().
+        :param window: Number of samples of the windowed mean and variance.
+        :param span: Span of the exponentially weighted statistics in samples.
+        :param interval: Pause of the background thread between two reads, in seconds.
+        :param clock: Module or object providing perf_counter() and sleep().
+        """
+        self.source = source
+        self.window = max(int(window), 2)
+        self.alpha = 2 / (span + 1)
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.feed_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.errors = []
+        self._clear()
+
+    def reset(self):
+        with self.feed_lock:
+            skip = getattr(self.source, 'skip', None)
+            if skip is not None:
+                skip()
+            self._clear()
+
+    def _clear(self):
+        with self.lock:
+            self.samples = np.zeros(self.window)
+            self.position = 0
+            self.count = 0
+            self.reference = None
+            self.sum = 0.0
+            self.sum_squares = 0.0
+            self.ewma = None
+            self.ewm_variance = 0.0
+            self.last_time = None
+
+    def add(self, times, values):
+        """Add readings (nm) taken at `times` (s)."""
+        with self.lock:
+            for value in values:
+                if self.reference is None:
+                    self.reference = value
+                x = value - self.reference
+                if self.count >= self.window:
+                    old = self.samples[self.position]
+                    self.sum -= old
+                    self.sum_squares -= old * old
+                self.samples[self.position] = x
+                self.position = (self.position + 1) % self.window
+                self.sum += x
+                self.sum_squares += x * x
+                self.count += 1
+                if self.position == 0:
+                    # Recompute the sums once per turn of the ring so rounding errors cannot build up
+                    self.sum = self.samples.sum()
+                    self.sum_squares = np.dot(self.samples, self.samples)
+
+                if self.ewma is None:
+                    self.ewma = x
+                else:
+                    delta = x - self.ewma
+                    self.ewma += self.alpha * delta
+                    self.ewm_variance = (1 - self.alpha) * (self.ewm_variance + self.alpha * delta * delta)
+            if len(values):
+                self.last_time = times[-1]
+                self.ready.notify_all()
+
+    def snapshot(self):
+        """
+        :return: Dictionary with 'mean' and 'variance' over the window, 'ewma' and 'ewm_variance', 'count' (samples
+                 since the last reset) and 'time' of the newest sample; the estimates are None before any sample.
+        """
+        with self.lock:
+            n = min(self.count, self.window)
+            if not n:
+                return {'mean': None, 'variance': None, 'ewma': None, 'ewm_variance': None, 'count': 0, 'time': None}
+            mean = self.sum / n
+            variance = max(self.sum_squares - n * mean * mean, 0.0) / (n - 1) if n > 1 else np.inf
+            return {'mean': self.reference + mean, 'variance': variance, 'ewma': self.reference + self.ewma,
+                    'ewm_variance': self.ewm_variance, 'count': self.count, 'time': self.last_time}
+
+    def wait_ready(self, count=None, timeout=None):
+        """
+        Wait until `count` samples (a full window by default) have arrived since the last reset.
+
+        :return: True if they arrived within `timeout` seconds.
+        """
+        count = self.window if count is None else count
+        with self.ready:
+            return self.ready.wait_for(lambda: self.count >= count or self.errors, timeout) and not self.errors
+
+    def read(self):
+        drain = getattr(self.source, 'drain', None)
+        if drain is not None:
+            return drain()
+        t0 = self.clock.perf_counter()
+        value = self.source.measure_wavelength()
+        return np.array([0.5 * (t0 + self.clock.perf_counter())]), np.array([value])
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                with self.feed_lock:
+                    times, values = self.read()
+                    self.add(times, values)
+                self.clock.sleep(self.interval)
+        except Exception as e:
+            self.errors.append(e)
+            print(f'Wavelength estimator stopped: {e}')
+            with self.ready:
+                self.ready.notify_all()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
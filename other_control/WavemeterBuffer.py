@@ -0,0 +1,313 @@
+"""
+Buffered Wavemeter Readout
+
+Overview:
+After `start_data()` the Bristol 771 keeps every measurement in its internal buffer, but the scan code still read
+one value per `measure_wavelength()` call, a full round trip per sample. WavemeterBuffer drains everything the
+instrument has captured since the last request in a single `:MMEM:DATA?` query, together with the instrument's
+scan index, so averages are computed from bulk blocks of real instrument samples.
+
+1. WavemeterBuffer Class:
+   `start()` / `stop()` wrap `start_data()` / `stop_data()`. `fetch()` issues one buffer request and keeps the
+   new samples in a bounded history. Timestamps are a linear function of the scan index on the host
+   `time.perf_counter` clock, so they can be paired with readings of other instruments (see pair_by_time). The
+   function is refitted at every request from the last `anchors` requests (newest index, time of the request).
+   A sample is always captured before the request that returns it, so the request times lie on or above the
+   true line and their lower convex hull hugs it: once the requests span at least `min_span` samples the slope
+   is that of the hull edge under the mean index (the nominal `period` before), and the offset puts the line
+   under the request times by the smallest delay seen in the window. Unlike a least-squares fit this is not
+   pulled up by the random delays of the requests, and an error of the nominal rate or a drift of the
+   instrument clock cannot build up over a session. Waits and timestamps go through `clock` (the time module
+   by default), as in SettleDetector.
+
+2. BufferReader Class:
+   One consumer's view of the buffer: `drain()` returns the samples since that reader's last call, `collect(n)`
+   waits for `n` fresh samples, `average(n)` is their mean, `robust_average(averager)` feeds fresh samples to a
+   RobustAverage until it is done, and `measure_wavelength()` the newest sample. Several
+   readers (e.g. the stabilizer and its live plot) can share one buffer without taking each other's samples.
+   The buffer itself behaves like its default reader, so it can be passed wherever a wavemeter is expected.
+
+3. Instrument Access:
+   The record layout of the buffer block is RECORD. A wavemeter object that provides `fetch_buffer()` returning
+   such records (e.g. SimulatedWavemeter) is used directly; otherwise the query goes through the VISA resource of
+   the lantz driver.
+
+4. Sharing:
+   The instrument has one buffer, so two WavemeterBuffers on the same wavemeter would take each other's samples
+   and stop each other's acquisition. `shared_wavemeter_buffer(wm)` returns the one WavemeterBuffer of a
+   wavemeter, started on first use, and counts its users; `release_wavemeter_buffer(buffer)` stops it when the
+   last user is done. Every user (the scans, the stabilizer and its live plot) reads through its own reader.
+"""
+
+import threading
+import time
+from collections import deque
+import numpy as np
+
+
+# One buffered measurement of the 771, as returned by :MMEM:DATA? (little endian)
+RECORD = np.dtype([('wavelength', '<f8'), ('power', '<f4'), ('status', '<u4'), ('index', '<u4')])
+
+
+def lower_envelope_slope(x, y):
+    """
+    Slope of the lower convex hull of the points (x, y), x increasing, at the mean of x: the line under all
+    points that is closest to them on average.
+    """
+    hull = []
+    for point in zip(x, y):
+        # Drop the last vertex while it does not make a left turn (Andrew's monotone chain)
+        while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (point[1] - hull[-2][1])
+                                  - (hull[-1][1] - hull[-2][1]) * (point[0] - hull[-2][0])) <= 0:
+            hull.pop()
+        hull.append(point)
+    mean = np.mean(x)
+    for (x0, y0), (x1, y1) in zip(hull, hull[1:]):
+        if x1 >= mean:
+            return (y1 - y0) / (x1 - x0)
+    return np.nan
+
+
+def fetch_records(wm):
+    """
+    Drain the wavemeter's measurement buffer in one request.
+
+    :return: Structured array with dtype RECORD.
+    """
+    fetch = getattr(wm, 'fetch_buffer', None)
+    if fetch is not None:
+        return np.asarray(fetch(), dtype=RECORD)
+    block = wm.resource.query_binary_values(':MMEM:DATA?', datatype='B', container=bytes)
+    return np.frombuffer(block, dtype=RECORD)
+
+
+class BufferReader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = buffer.count
+
+    def drain(self):
+        """
+        Samples captured since the last call of this reader (one buffer request).
+
+        :return: (times, wavelengths) as float arrays; times on the time.perf_counter clock in seconds.
+        """
+        self.buffer.fetch()
+        times, wavelengths, self.position = self.buffer.since(self.position)
+        return times, wavelengths
+
+    def skip(self):
+        """Drop all samples captured so far, e.g. those taken before a laser actuation."""
+        self.drain()
+
+    def collect(self, n, timeout=None):
+        """
+        Wait for `n` samples captured after this call.
+
+        :param timeout: Longest wait in seconds; by default three times the nominal time for `n` samples.
+        :return: (times, wavelengths) of at least one and at most `n` samples.
+        """
+        period = self.buffer.period
+        clock = self.buffer.clock
+        timeout = 3 * n * period + 1 if timeout is None else timeout
+        self.skip()
+        start = clock.perf_counter()
+        blocks = []
+        have = 0
+        while have < n:
+            clock.sleep(max(n - have, 1) * period)
+            times, wavelengths = self.drain()
+            if len(wavelengths):
+                blocks.append((times, wavelengths))
+                have += len(wavelengths)
+            if have < n and clock.perf_counter() - start > timeout:
+                if not have:
+                    raise TimeoutError(f'No wavemeter samples within {timeout:.1f}s, is the buffer running?')
+                print(f'Wavemeter buffer: {have} of {n} samples after {timeout:.1f}s.')
+                break
+        times = np.concatenate([block[0] for block in blocks])[:n]
+        wavelengths = np.concatenate([block[1] for block in blocks])[:n]
+        return times, wavelengths
+
+    def average(self, n, timeout=None):
+        """Mean wavelength of the next `n` samples."""
+        return float(np.mean(self.collect(n, timeout)[1]))
+
+    def robust_average(self, averager, timeout=None):
+        """
+        Feed samples captured after this call to `averager` (a RobustAverage) until it is done.
+
+        :param timeout: Longest wait in seconds; by default three times the nominal time for all its samples.
+        :return: averager.result()
+        """
+        period = self.buffer.period
+        clock = self.buffer.clock
+        timeout = 3 * averager.remaining() * period + 1 if timeout is None else timeout
+        self.skip()
+        start = clock.perf_counter()
+        while not averager.done():
+            # Wait for the samples that can end the average first, then one period at a time
+            needed = max(averager.min_samples - len(averager.values), 1)
+            clock.sleep(needed * period)
+            times, wavelengths = self.drain()
+            averager.extend(wavelengths)
+            if not averager.done() and clock.perf_counter() - start > timeout:
+                if not averager.values:
+                    raise TimeoutError(f'No wavemeter samples within {timeout:.1f}s, is the buffer running?')
+                print(f'Wavemeter buffer: {len(averager.values)} of {averager.max_samples} samples after {timeout:.1f}s.')
+                break
+        return averager.result()
+
+    def measure_wavelength(self):
+        """Newest sample, waiting for one if nothing was captured since the last call."""
+        times, wavelengths = self.drain()
+        while not len(wavelengths):
+            self.buffer.clock.sleep(self.buffer.period)
+            times, wavelengths = self.drain()
+        return float(wavelengths[-1])
+
+
+class WavemeterBuffer:
+    def __init__(self, wm, period=0.2, history=4096, clock=time, anchors=256, min_span=100):
+        """
+        :param wm: Bristol_771 driver instance.
+        :param period: Nominal measurement period of the instrument in seconds (5Hz by default).
+        :param history: Number of most recent samples kept for the readers.
+        :param clock: Module or object providing perf_counter() and sleep().
+        :param anchors: Number of most recent requests the timestamp mapping is fitted to.
+        :param min_span: Samples the requests have to span before the period is measured instead of nominal.
+        """
+        self.wm = wm
+        self.period = period
+        self.history = history
+        self.clock = clock
+        self.anchors = deque(maxlen=max(int(anchors), 2))  # (newest index, request time)
+        self.min_span = min_span
+        self.measured_period = period
+        self.blocks = deque()  # (number of the first sample, times, wavelengths)
+        self.stored = 0
+        self.count = 0
+        self.offset = None
+        self.lock = threading.Lock()
+        self.default_reader = BufferReader(self)
+
+    def start(self):
+        self.wm.start_data()
+        with self.lock:
+            fetch_records(self.wm)  # discard what was captured before the start
+            self.offset = None
+            self.anchors.clear()
+            self.measured_period = self.period
+        self.default_reader.position = self.count
+
+    def stop(self):
+        self.wm.stop_data()
+
+    def reader(self):
+        """New reader starting at the current end of the buffer."""
+        return BufferReader(self)
+
+    def fetch(self):
+        """
+        Move all samples captured by the instrument into the history.
+
+        :return: Number of new samples.
+        """
+        with self.lock:
+            records = fetch_records(self.wm)
+            now = self.clock.perf_counter()
+            # Wavelength 0 marks a scan without a valid measurement (no or too little light)
+            records = records[(records['status'] == 0) & (records['wavelength'] > 0)]
+            if not len(records):
+                return 0
+            index = records['index'].astype(np.float64)
+            self.anchors.append((index[-1], now))
+            self.update_mapping()
+            times = self.offset + index * self.measured_period
+            self.blocks.append((self.count, times, records['wavelength'].astype(np.float64)))
+            self.count += len(records)
+            self.stored += len(records)
+            while self.stored - len(self.blocks[0][2]) >= self.history:
+                self.stored -= len(self.blocks.popleft()[2])
+            return len(records)
+
+    def update_mapping(self):
+        """Refit the scan index -> host time mapping to the recent requests."""
+        index, request_time = np.array(self.anchors).T
+        period = self.period
+        if index[-1] - index[0] >= self.min_span:
+            fitted = lower_envelope_slope(index - index[0], request_time)
+            # A fit far off the nominal period means a restarted index or a stalled request, not a rate error
+            if abs(fitted - self.period) < 0.1 * self.period:
+                period = fitted
+        self.measured_period = period
+        self.offset = np.min(request_time - period * index)
+
+    def since(self, position):
+        """
+        :return: (times, wavelengths, new position) of the samples after sample number `position`; samples that
+                 have already left the history are lost.
+        """
+        with self.lock:
+            blocks = [(times[max(position - first, 0):], wavelengths[max(position - first, 0):])
+                      for first, times, wavelengths in self.blocks if first + len(wavelengths) > position]
+            if not blocks:
+                return np.zeros(0), np.zeros(0), self.count
+            return np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks]), self.count
+
+    def drain(self):
+        return self.default_reader.drain()
+
+    def skip(self):
+        self.default_reader.skip()
+
+    def collect(self, n, timeout=None):
+        return self.default_reader.collect(n, timeout)
+
+    def average(self, n, timeout=None):
+        return self.default_reader.average(n, timeout)
+
+    def robust_average(self, averager, timeout=None):
+        return self.default_reader.robust_average(averager, timeout)
+
+    def measure_wavelength(self):
+        return self.default_reader.measure_wavelength()
+
+
+_shared = {}  # wavemeter key -> [WavemeterBuffer, number of users]
+_shared_lock = threading.Lock()
+
+
+def _wavemeter_key(wm):
+    return getattr(wm, 'resource_name', None) or id(wm)
+
+
+def shared_wavemeter_buffer(wm, period=0.2, clock=time):
+    """
+    :param wm: Bristol_771 driver instance.
+    :param period, clock: Used when the buffer is created; a running buffer keeps its own.
+    :return: The WavemeterBuffer shared by every user of `wm`, started. Release it with release_wavemeter_buffer.
+    """
+    with _shared_lock:
+        entry = _shared.get(_wavemeter_key(wm))
+        if entry is None:
+            buffer = WavemeterBuffer(wm, period=period, clock=clock)
+            buffer.start()
+            entry = _shared[_wavemeter_key(wm)] = [buffer, 0]
+        elif entry[0].period != period:
+            print(f'Wavemeter buffer already running with a {entry[0].period}s period, {period}s requested.')
+        entry[1] += 1
+        return entry[0]
+
+
+def release_wavemeter_buffer(buffer):
+    """Give up one use of a shared buffer; the last user stops the instrument's acquisition."""
+    with _shared_lock:
+        key = _wavemeter_key(buffer.wm)
+        entry = _shared.get(key)
+        if entry is None or entry[0] is not buffer:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _shared[key]
+            buffer.stop()
@@ -4,14 +4,12 @@ import time
 import csv
 import os
 from pathlib import Path
-import pickle  # for saving large arrays
 import math
 
 from PyQt5.QtCore import pyqtSignal, QObject
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.Qsci import QsciScintilla, QsciLexerPython
 from PyQt5.QtWidgets import QPushButton, QTextEdit, QVBoxLayout
-import matplotlib.pyplot as plt
 
 from spyre import Spyrelet, Task, Element
 from spyre.widgets.task import TaskWidget
@@ -35,6 +33,7 @@ from lantz.drivers.thorlabs.pm100d import PM100D
 # from lantz.drivers.keysight import Arbseq_Class_MW
 from lantz.drivers.keysight import Keysight_33622A
 from lantz.drivers.stanford.srs900 import SRS900
+from lantz.drivers.attenuator import JDSHA9
 # from lantz.drivers.attocube import ANC350
 
 import Pyro5.api
@@ -42,6 +41,23 @@ import Pyro5.errors
 #import random
 from lantz.log import log_to_screen, DEBUG
 
+from HistogramEngine import StreamingHistogram
+from ScanStorage import ScanWriter, load_scan
+from UpdateBus import UpdateBus, DeltaBuffer
+from ConcurrentSampler import ConcurrentSampler, timed_read, pair_by_time
+from ReferenceInterpolator import ReferenceSpectrum
+from AdaptiveSampling import AdaptiveSampler
+from LaserSession import laser_session
+from HomingCalibration import WavelengthCalibration
+from BeamRouting import AttenuatorRouter
+from PlotRenderer import PlotRenderer
+from PhaseTimer import PhaseTimer, NULL_TIMER
+from SequentialAveraging import SequentialStopping
+from SettleDetection import SettleDetector, wait_for_laser
+from ScanCheckpoint import ScanCheckpoint, find_unfinished
+from WavemeterBuffer import shared_wavemeter_buffer, release_wavemeter_buffer
+from PowerMeterBlock import PowerBlockReader
+
 volt = Q_(1, 'V')
 milivolt = Q_(1, 'mV')
 Hz = Q_(1, 'Hz')
@@ -51,6 +67,23 @@ dB = Q_(1, 'dB')
 dBm = Q_(1, 'dB')
 s = Q_(1, 's')
 
+# Per-point timing stored with every scan (see other_control/PhaseTimer.py)
+SCAN_PHASES = ('setup', 'homing', 'settle', 'wavemeter', 'laser', 'acquire', 'routing', 'wait', 'save', 'gui')
+SCAN_COUNTERS = ('homing iterations', 'samples')
+
+
+def rf_power_list(text):
+    '''Windfreak RF powers in dBm from the 'RF Powers' parameter, e.g. "14.40" or "12, 13.5, 14.40".'''
+    powers = [float(value) for value in text.replace(';', ',').split(',') if value.strip()]
+    if not powers:
+        raise ValueError("'RF Powers' needs at least one power in dBm.")
+    return powers
+
+
+def rf_power_suffix(rf_power, n_powers):
+    '''File name suffix of the plots of one RF power; empty for a single-power scan.'''
+    return '' if n_powers == 1 else '_rf_{}dBm'.format(rf_power)
+
 class SignalHolder(QObject):
     '''
     This class is used to hold signals. These defination should not be in any spyrelet classes since the signals will not be instantiated
@@ -73,7 +106,7 @@ class Spectrum_Scan(Spyrelet):
         'windfreak': SynthNVPro
     }
     
-    laser = NetworkConnection('169.254.21.75')
+    laser = laser_session('169.254.21.75')
     signalholder=SignalHolder()
 
 
@@ -167,22 +200,43 @@ class Spectrum_Scan(Spyrelet):
         #         print('Average Wavelength:', avg, 'target:', target, 'diff:', avg - target)
         # return avg
 
-        current = self.wm.measure_wavelength()
+        timer = getattr(self, 'timer', NULL_TIMER)
+        settle = getattr(self, 'settle', None)
+        wm = getattr(self, 'wmbuffer', None) or self.wm
+        with timer.phase('wavemeter'):
+            current = wm.measure_wavelength()
         print(current, target, abs(current-target))
         iter = 0
+
+        # Feed-forward: jump straight to the setpoint the calibration predicts for this target
+        calibration = getattr(self, 'calibration', None)
+        if calibration is not None and not (target - precision <= current <= target + precision):
+            setting = calibration.setpoint_for(target)
+            if setting is not None:
+                iter = iter+1
+                with timer.phase('laser'):
+                    self.laser.set('laser1:ctl:wavelength-set', setting)
+                current = wait_for_laser(wm, drift_time.magnitude, settle, timer, clock=time)
+                calibration.add(setting, current)
+                print(str(iter)+" (calibrated) current: {} target: {} new wl setting: {} diff: {}".format(current, target, round(setting,6), round(current-target,6)))
+
         while current < target - precision or current > target + precision:
             # print('here1')
             iter = iter+1
             if iter > 30:
                 print('Max iteration exeeded.')
                 break
-            with Client(self.laser) as client:
-                setting = client.get('laser1:ctl:wavelength-set', float)
+            with timer.phase('laser'):
+                setting = self.laser.get('laser1:ctl:wavelength-set', float)
                 offset = current - target
-                client.set('laser1:ctl:wavelength-set', setting - offset)
-                time.sleep(drift_time.magnitude)
-                current = self.wm.measure_wavelength()
-                print(str(iter)+" current: {} target: {} new wl setting: {} diff: {}".format(current, target, round(setting - offset,6), round(current-target,6)))
+                self.laser.set('laser1:ctl:wavelength-set', setting - offset)
+            current = wait_for_laser(wm, drift_time.magnitude, settle, timer, clock=time)
+            if calibration is not None:
+                calibration.add(setting - offset, current)
+            print(str(iter)+" current: {} target: {} new wl setting: {} diff: {}".format(current, target, round(setting - offset,6), round(current-target,6)))
+        if calibration is not None:
+            calibration.save()
+        timer.count('homing iterations', iter)
         print("Laser homed.")
         return current, iter
 
@@ -215,100 +269,321 @@ class Spectrum_Scan(Spyrelet):
                 # doesn't need to do a while loop and keep adjusting until the wavelength is correct
         return freqs
     
-    def lineplot_save(self,x,y,title,xlabel,ylabel,PATH,file_name):
-
-        fig, ax = plt.subplots()
-
-
-        ax.plot(x, y, color='blue', linestyle='-', marker='o')
+    def read_power(self):
+        '''Power meter reading in uW.'''
+        return self.pmd.power.magnitude*1000000
 
+    def measure_repeats(self, number_of_repeating, concurrent=False, stopping=None, batch=10):
+        '''
+        Take `number_of_repeating` wavelength and power readings at the current laser setting.
+        In concurrent mode the wavemeter and the power meter are polled on separate threads that take their readings
+        in step, so every reading of both is kept; otherwise they are read alternately. Both modes record the time offset of
+        every power reading relative to its wavelength reading (seconds) under 'power_offset'.
+        With a SequentialStopping rule, sampling stops as soon as the rule is satisfied and `number_of_repeating`
+        is only the upper limit; concurrent sampling checks the rule between blocks of readings, taken by
+        persistent worker threads in batches of at least `batch` readings once the minimum is reached.
+        With the buffered wavemeter (see start_wavemeter) or the power block readout (see start_power_meter)
+        the readings are taken in blocks by measure_repeats_blocks instead, and the concurrent mode has no effect.
+        '''
+        if stopping is not None:
+            stopping.reset()
+            stopping.max_samples = number_of_repeating
+        if getattr(self, 'wmbuffer', None) is not None or getattr(self, 'pmblock', None) is not None:
+            return self.measure_repeats_blocks(number_of_repeating, stopping)
+        coordinate = np.linspace(1,number_of_repeating,number_of_repeating)
+        if concurrent:
+            with ConcurrentSampler({'wavelength': self.wm.measure_wavelength, 'power': self.read_power}) as sampler:
+                if stopping is not None:
+                    blocks = []
+                    n = 0
+                    while not stopping.done():
+                        # Past the minimum the rule is checked every `batch` readings, not after each one
+                        block = sampler.acquire_paired(min(max(stopping.remaining(), batch), number_of_repeating - n), 'wavelength')
+                        for wavelength, power in zip(block['wavelength'], block['power']):
+                            stopping.add(wavelength=wavelength, power=power)
+                        values={
+                            'coordinate':coordinate[n:n + len(block['wavelength'])],
+                            'laser':block['wavelength'],
+                            'power':block['power']
+                        }
+                        self.updatebus.publish('update_temp_measurement', values, reset=(n == 0))
+                        n += len(block['wavelength'])
+                        blocks.append(block)
+                    print(f'Sequential stopping after {n} samples: {stopping.report()}')
+                    return {key: np.concatenate([block[key] for block in blocks]) for key in ('wavelength', 'power', 'power_offset')}
+
+                data = sampler.acquire_paired(number_of_repeating, 'wavelength')
+            values={
+                'coordinate':coordinate,
+                'laser':data['wavelength'],
+                'power':data['power']
+            }
+            self.updatebus.publish('update_temp_measurement', values, reset=True)
+            return {'wavelength': data['wavelength'], 'power': data['power'], 'power_offset': data['power_offset']}
+
+        temp_laser_wavelength_data=np.zeros(number_of_repeating)
+        temp_power_data=np.zeros(number_of_repeating)
+        temp_offset_data=np.zeros(number_of_repeating)
+        n = number_of_repeating
+        for j in range(number_of_repeating):
+            temp_laser_wavelength_data[j], t_wavelength = timed_read(self.wm.measure_wavelength)
+            temp_power_data[j], t_power = timed_read(self.read_power)
+            temp_offset_data[j] = t_power - t_wavelength
+            values={
+                'coordinate':coordinate[j:j+1],
+                'laser':temp_laser_wavelength_data[j:j+1],
+                'power':temp_power_data[j:j+1]
+            }
+            self.updatebus.publish('update_temp_measurement', values, reset=(j == 0))
+            if stopping is not None:
+                stopping.add(wavelength=temp_laser_wavelength_data[j], power=temp_power_data[j])
+                if stopping.done():
+                    n = j + 1
+                    print(f'Sequential stopping after {n} samples: {stopping.report()}')
+                    break
+            time.sleep(0.01)
+        return {'wavelength': temp_laser_wavelength_data[:n], 'power': temp_power_data[:n], 'power_offset': temp_offset_data[:n]}
+
+    def measure_repeats_blocks(self, number_of_repeating, stopping=None):
+        '''
+        measure_repeats in blocks of readings. The power is read per sample, or with the block readout
+        (see start_power_meter) in requests of many raw readings. The wavelength is drained once per block from
+        the buffered wavemeter, or otherwise read once before the first block and after every block. Every power
+        reading is then paired with the nearest wavelength reading in time. A block is the whole point with the
+        buffered wavemeter and one power request ('Power Block Size') without it, and it also ends wherever a
+        stopping rule is checked. The stopping rule sees every wavelength reading once.
+        '''
+        wmbuffer = getattr(self, 'wmbuffer', None)
+        coordinate = np.linspace(1,number_of_repeating,number_of_repeating)
+        if wmbuffer is not None:
+            wmbuffer.skip()  # samples from before the point (homing, the other arm)
+        else:
+            t_wavelength, wavelength = self.read_wavelength_timed()
+        blocks = []
+        n = 0
+        while n < number_of_repeating and (stopping is None or not stopping.done()):
+            size = number_of_repeating - n if stopping is None else min(stopping.remaining(), number_of_repeating - n)
+            if wmbuffer is None:
+                size = min(size, self.pmblock.block)
+            power, t_power = self.read_power_block(size)
+            if wmbuffer is not None:
+                t_wavelength, wavelength = wmbuffer.drain()
+                if not len(wavelength):
+                    t_wavelength, wavelength = wmbuffer.collect(1)
+                new_wavelength = wavelength
+            else:
+                t_after, wavelength_after = self.read_wavelength_timed()
+                t_wavelength, wavelength = np.append(t_wavelength[-1:], t_after), np.append(wavelength[-1:], wavelength_after)
+                new_wavelength = wavelength if n == 0 else wavelength[1:]
+            index, offset = pair_by_time(t_power, t_wavelength)
+            block = {'wavelength': wavelength[index], 'power': power, 'power_offset': -offset}
+            if stopping is not None:
+                for value in power:
+                    stopping.add(power=value)
+                stopping.extend('wavelength', new_wavelength)
+            values={
+                'coordinate':coordinate[n:n + size],
+                'laser':block['wavelength'],
+                'power':power
+            }
+            self.updatebus.publish('update_temp_measurement', values, reset=(n == 0))
+            n += size
+            blocks.append(block)
+        if stopping is not None:
+            print(f'Sequential stopping after {n} samples: {stopping.report()}')
+        return {key: np.concatenate([block[key] for block in blocks]) for key in ('wavelength', 'power', 'power_offset')}
+
+    def read_power_block(self, n):
+        '''
+        `n` power readings in uW and their timestamps, through the block readout when it is on.
+        '''
+        pmblock = getattr(self, 'pmblock', None)
+        if pmblock is not None:
+            return pmblock.read_block(n)
+        power = np.zeros(n)
+        stamps = np.zeros(n)
+        for j in range(n):
+            t0 = time.perf_counter()
+            power[j] = self.read_power()
+            stamps[j] = 0.5 * (t0 + time.perf_counter())
+            time.sleep(0.01)
+        return power, stamps
+
+    def read_wavelength_timed(self):
+        '''One wavemeter reading as (timestamps, wavelengths) arrays of length 1.'''
+        t0 = time.perf_counter()
+        wavelength = self.wm.measure_wavelength()
+        return np.array([0.5 * (t0 + time.perf_counter())]), np.array([wavelength])
+
+    def start_power_meter(self):
+        '''
+        Set up the power readout. With 'Power Block Readout' on, the meter averages 'Power Meter Averaging'
+        internal samples per reading and the repeat loop fetches raw blocks of readings through self.pmblock;
+        otherwise self.pmblock is None and every reading is a separate request.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        if expparams['Power Block Readout']:
+            self.pmblock = PowerBlockReader(self.pmd, averaging=expparams['Power Meter Averaging'], block=expparams['Power Block Size'], clock=time)
+            self.pmblock.configure()
+        else:
+            self.pmblock = None
 
-        ax.set_title(title)
-        ax.set_xlabel(xlabel)
-        ax.set_ylabel(ylabel)
-        ax.legend()
-
-        fig_path = os.path.join(PATH, file_name + ".png")
-                
-        fig.savefig(fig_path, facecolor='white')
-
-        plt.close(fig)
+    def stop_power_meter(self):
+        '''Give the meter back the averaging count it had before start_power_meter.'''
+        if self.pmblock is not None:
+            self.pmblock.restore()
+            self.pmblock = None
 
+    def start_wavemeter(self):
+        '''
+        Start the wavemeter's data acquisition. With 'Buffered Wavemeter' on, all readings (repeat loop and homing)
+        are drained in bulk from the instrument buffer through the reader self.wmbuffer, and the buffer is shared
+        with the stabilizer so neither stops the other's acquisition. Otherwise self.wmbuffer is None, every
+        reading is a separate request and the acquisition is started and stopped directly, as without the buffer.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        if expparams['Buffered Wavemeter']:
+            self.wmshared = shared_wavemeter_buffer(self.wm, period=1 / expparams['Wavemeter Rate'].magnitude, clock=time)
+            self.wmbuffer = self.wmshared.reader()
+        else:
+            self.wmshared = None
+            self.wmbuffer = None
+            self.wm.start_data()
 
-    def createHistogram(self, stoparray, timebase, bincount, period, index, wls, out_name, extra_data=False):
-        print('creating histogram')
+    def stop_wavemeter(self):
+        if self.wmshared is not None:
+            release_wavemeter_buffer(self.wmshared)
+        else:
+            self.wm.stop_data()
+        self.wmshared = None
+        self.wmbuffer = None
 
-        hist = [0] * bincount
+    def open_scan(self, PATH, file_name, scan, experiment_setting, instrument_setting, rows_per_point=1, **writer_options):
+        '''
+        Create the data file PATH/file_name.h5 and its checkpoint. With 'Resume Scan' on, the newest unfinished
+        scan of the same kind with the same settings in PATH is continued instead. `rows_per_point` is the
+        number of data rows written per wavelength point (one per RF power).
 
-        tstart = 0
-        for k in range(len(stoparray)):
-            tdiff = stoparray[k]
+        :return: (writer, checkpoint, previous); `previous` holds the points measured before the interruption,
+                 keyed like load_scan, and is empty for a new scan.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        if expparams['Resume Scan']:
+            checkpoint = find_unfinished(PATH, scan, experiment_setting, instrument_setting)
+            if checkpoint is not None:
+                n_done = len(checkpoint.completed)
+                n_rows = n_done * rows_per_point
+                previous = {key: value[:n_rows] for key, value in load_scan(checkpoint.data_file).items() if isinstance(value, np.ndarray)}
+                writer = ScanWriter.resume(checkpoint.data_file, n_rows, n_timing=n_done)
+                print(f'Resuming {checkpoint.data_file} after {n_done} points.')
+                return writer, checkpoint, previous
+            print('No unfinished scan with these settings found, starting a new one.')
+        full_path = os.path.join(PATH, file_name + '.h5')
+        writer = ScanWriter(full_path, experiment_setting, **writer_options)
+        checkpoint = ScanCheckpoint(full_path, scan, experiment_setting, instrument_setting)
+        checkpoint.save()
+        return writer, checkpoint, {}
+
+    def make_stopping(self):
+        '''
+        Sequential-stopping rule from the 'Sequential Stopping' parameters, or None for a fixed repeat count.
+        Tolerances are standard errors of the mean, in nm for the wavelength and in uW for the power. The default
+        power tolerance (1nW, about 1% of the ~100nW pulse power) is within reach of the PM100D noise; a much
+        smaller one always runs to 'Number of Repeating'.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        if not expparams['Sequential Stopping']:
+            return None
+        tolerances = {'wavelength': expparams['Wavelength SEM Tolerance'], 'power': expparams['Power SEM Tolerance']}
+        return SequentialStopping(tolerances, min_samples=expparams['Minimum Repeating'], max_samples=expparams['Number of Repeating'])
 
-            binNumber = int(tdiff * timebase * bincount / (period))
-            """
-                print('tdiff: '+str(tdiff))
-                print('binNumber: '+str(binNumber))
-                print('stoparray[k]: '+str(stoparray[k]))
-                print('tstart: '+str(tstart))
-                """
-            if binNumber >= bincount:
-                continue
-            else:
-                # print('binNumber: '+str(binNumber))
-                hist[binNumber] += 1
+    def reference_spectra(self, wavelength, power, rf_power, rf_powers, method):
+        '''
+        One ReferenceSpectrum per RF power of the transmission scan. `rf_power` is the RF power of every
+        reference row; a reference without it (a single-power scan saved before the 'RF power' column
+        existed) is used for every power.
+        '''
+        if rf_power is None:
+            if len(rf_powers) > 1:
+                print('Reference has no RF power column, using it for every RF power.')
+            return [ReferenceSpectrum(wavelength, power, method=method) for _ in rf_powers]
+        spectra = []
+        for rf in rf_powers:
+            rows = np.isclose(rf_power, rf)
+            if not np.any(rows):
+                print('Reference has no measurement at RF power {}dBm, please measure it first!'.format(rf))
+                raise MeasureSequenceError()
+            spectra.append(ReferenceSpectrum(wavelength[rows], power[rows], method=method))
+        return spectra
+
+    def load_calibration(self):
+        '''
+        Load the homing feed-forward calibration; an empty 'Homing Calibration File' disables it.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        calibration_file = expparams['Homing Calibration File']
+        self.calibration = WavelengthCalibration(calibration_file) if calibration_file else None
 
-        if extra_data == False:
-            np.savez(os.path.join(out_name, str(index)), hist, wls)
-        if extra_data != False:
-            np.savez(os.path.join(out_name, str(index)), hist, wls, extra_data)
+    def make_settle_detector(self):
+        '''
+        Settle detector for homing from the 'Settle Detection' parameters, or None to always wait the full
+        drift time after a motor step.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        if not expparams['Settle Detection']:
+            return None
+        period = 1 / expparams['Wavemeter Rate'].magnitude
+        return SettleDetector(max_slope=expparams['Settle Slope'], max_deviation=expparams['Settle Deviation'],
+                              window=expparams['Settle Window'], interval=period, period=period, clock=time)
 
-        # np.savez(os.path.join(out_name,str(index+40)),hist,wls)
-        print('Data stored under File Name: ' + out_name + '\\' + str(index) + '.npz')
+    def make_router(self):
+        '''
+        Build the beam router used by the single-pass task from the 'Arm Routing' parameter: 'attenuator' blocks
+        the unused arm with the JDS HA9 attenuators at 'Reference Attenuator' and 'Sample Attenuator'.
+        The stand-in LocalRouter does not move any light, so a single-pass scan with it would measure the same arm
+        twice; it is only used by the simulated instruments and is refused here.
+        '''
+        expparams = self.exp_parameters.widget.get()
+        routing = expparams['Arm Routing']
+        if routing == 'attenuator':
+            if not expparams['Reference Attenuator'] or not expparams['Sample Attenuator']:
+                raise ValueError("Set 'Reference Attenuator' and 'Sample Attenuator' for the single-pass scan.")
+            reference_attenuator = JDSHA9(expparams['Reference Attenuator'])
+            sample_attenuator = JDSHA9(expparams['Sample Attenuator'])
+            reference_attenuator.initialize()
+            sample_attenuator.initialize()
+            return AttenuatorRouter(reference_attenuator, sample_attenuator)
+        raise ValueError("Unknown 'Arm Routing' {}, the single-pass scan needs 'attenuator'.".format(routing))
+
+    def start_updatebus(self):
+        '''
+        Route the GUI signals through a rate-limited UpdateBus. The per-sample signal is sent as deltas
+        ('merge'), the per-point spectra only need their newest state ('latest').
+        '''
+        expparams = self.exp_parameters.widget.get()
+        self.updatebus = UpdateBus(frame_rate=expparams['GUI Frame Rate'])
+        self.updatebus.register('update_temp_measurement', self.signalholder.update_temp_measurement, 'merge')
+        self.updatebus.register('update_reference_measurement', self.signalholder.update_reference_measurement, 'latest')
+        self.updatebus.register('update_transmission_measurement', self.signalholder.update_transmission_measurement, 'latest')
+        self.updatebus.register('check_the_scanning', self.signalholder.check_the_scanning, 'latest')
+        self.updatebus.start()
 
-    def lagrange_interpolation(self, x, y, x_val):
-        """
-        Second-order Lagrange interpolation for a given x value.
-        
-        Parameters:
-        - x: List of x values for known data points.
-        - y: List of corresponding y values for known data points.
-        - x_val: The x value at which we want to interpolate the y value.
-        
-        Returns:
-        - Interpolated y value at x_val.
-        """
-        
-        # Calculate and return the interpolated value using the Lagrange interpolation formula
-        return y[0] * (x_val - x[1]) * (x_val - x[2]) / ((x[0] - x[1]) * (x[0] - x[2])) + \
-            y[1] * (x_val - x[0]) * (x_val - x[2]) / ((x[1] - x[0]) * (x[1] - x[2])) + \
-            y[2] * (x_val - x[0]) * (x_val - x[1]) / ((x[2] - x[0]) * (x[2] - x[1]))
+    def lineplot_save(self,x,y,title,xlabel,ylabel,PATH,file_name):
+        '''Queue the figure on the background renderer; the PNG is written off the task thread.'''
+        return self.renderer.lineplot(x, y, title, xlabel, ylabel, PATH, file_name)
 
-    def closest_points(self, x_cor, y_cor, x_val, n=3):
-        """
-        Find the n closest points to x_val from the given x, y pairs.
-        
-        Parameters:
-        - x: List of x values.
-        - y: List of corresponding y values.
-        - x_val: The x value to which we want to find the closest points.
-        - n: Number of closest points we want to find.
-        
-        Returns:
-        - Tuple of two lists: closest x values, and their corresponding y values.
-        """
-       
-        
-        # Compute the absolute distance of each x value from x_val
-        distances = np.abs(np.array(x_cor) - x_val)
-        # Get the indices of the sorted distances
-        indices = np.argsort(distances)[:n]
-        return [x_cor[i] for i in indices], [y_cor[i] for i in indices]
+    def createHistogram(self, stoparray, timebase, bincount, period, index, wls, out_name, extra_data=False):
+        print('creating histogram')
 
-   
-    @Task()
-    def startreferencemeasurement(self, timestep=100e-9):
-        log_to_screen(DEBUG)
+        histogram = StreamingHistogram(timebase, bincount, period)
+        histogram.accumulate(stoparray)
+        histogram.save(out_name, index, wls, extra_data)
 
+    def reference_scan(self):
+        '''
+        Reference power spectrum over the 'Wavelength parameters' grid.
+        '''
+        self.timer = PhaseTimer(SCAN_PHASES, SCAN_COUNTERS, clock=time)
         self.fungen.output[1] = 'OFF'
         self.fungen.output[2] = 'OFF'
         # # some initialization of the function generator
@@ -329,6 +604,8 @@ class Spectrum_Scan(Spyrelet):
         input_freq_stop = wlparams['Laser WL Stop']
         input_freq_points = wlparams['Number of Laser WL Point']
         number_of_repeating = expparams['Number of Repeating']
+        concurrent_sampling = expparams['Concurrent Sampling']
+        stopping = self.make_stopping()
         pulse_channel = expparams['Pulse Channel']
     
         num_AOMs = expparams['# of AOMs']
@@ -360,124 +637,132 @@ class Spectrum_Scan(Spyrelet):
         # PATH = path_name + '_' + curr.strftime("%Y-%m-%d_%H-%M-%S")
         # os.mkdir(PATH)
         PATH = path_name
-        print('pkl file stored under PATH: ' + str(PATH))
+        print('h5 file stored under PATH: ' + str(PATH))
 
         wl_input_Targets = np.linspace(input_freq_start, input_freq_stop, input_freq_points)
         
         
         pulse_widthTargets=[100e-6]
-        laser_power = [100]  # nW; pulse power
-        synthNVP_rf_powers = [14.40]  # dBm, controls pulse power
+        # The Windfreak RF power sets the pulse power (14.40dBm gives about 100nW); with several 'RF Powers'
+        # every wavelength is homed once and all powers are measured there, one data row per power
+        rf_powers = rf_power_list(expparams['RF Powers'])
+        n_powers = len(rf_powers)
         
         len_wlTargets = len(wl_input_Targets)
         
 
-        for l, power in enumerate(laser_power):
-            # with Client(self.laser) as client:
-            #     client.set('laser1:power-stabilization:setpoint', power)
-            #     power_now = client.get('laser1:power-stabilization:setpoint')
-            #     print(l, power_now)
-
-            # use synthNVP to change power of laser while fixing laser output to max
-            synthNVP_rf_power = synthNVP_rf_powers[l]
-            self.windfreak.power = synthNVP_rf_power  # set the windfreak power
-            
-            start_time=datetime.datetime.now()
-            self.true_laser_wavelength=np.zeros(len_wlTargets)
-            self.true_power=np.zeros(len_wlTargets)
-
-            for i, wlinput in enumerate(wl_input_Targets):
-                    
+        self.timer.add('setup', self.timer.elapsed())
+        start_time=datetime.datetime.now()
+        self.reference_rf_powers = rf_powers
+        self.true_laser_wavelength=np.zeros((len_wlTargets, n_powers))
+        self.true_power=np.zeros((len_wlTargets, n_powers))
+
+        experiment_setting={"RF Powers" : expparams['RF Powers'],"Input Resolution" : input_freq_points, "Input Start" : input_freq_start, "Input End" : input_freq_stop, "Number of Repeating Measurement": number_of_repeating,
+                            "Sequential Stopping" : stopping is not None, "Minimum Repeating" : expparams['Minimum Repeating'],
+                            "Wavelength SEM Tolerance" : expparams['Wavelength SEM Tolerance'], "Power SEM Tolerance" : expparams['Power SEM Tolerance']
+                            }
+
+        if not (os.path.exists(PATH)):
+            print('making new directory...')
+            Path(PATH).mkdir(parents=True, exist_ok=True)
+
+        file_name = 'reference_power_measurement_at_' + str(start_time).replace(' ', '_').replace(':', '-')
+        instrument_setting = {"Windfreak frequency": WindfreakFreq, "# of AOMs": num_AOMs, "Pulse Channel": pulse_channel}
+        writer, checkpoint, previous = self.open_scan(PATH, file_name, 'reference', experiment_setting, instrument_setting, rows_per_point=n_powers,
+                                                      summary_keys=("Target wavelength", "RF power", "Laser wavelength", "Power"), raw_keys=("wavelength", "power", "power_offset"), timing_keys=self.timer.keys())
+        full_path = writer.path
+        file_name = os.path.splitext(os.path.basename(full_path))[0]
+
+        for i, wlinput in enumerate(wl_input_Targets):
+            k = checkpoint.row(i)
+            if k is not None:
+                # Measured before the scan was interrupted: restore the point from the data file
+                rows = slice(k * n_powers, (k + 1) * n_powers)
+                self.true_laser_wavelength[i] = previous["Laser wavelength"][rows]
+                self.true_power[i] = previous["Power"][rows]
+                continue
+                
+            with self.timer.phase('homing'):
                 _ = self.homelaser(wlinput, precision=0.0005, drift_time=4 * s)  # home laser to new wl with more precision the first time
-                print('Laser set to:' + str(wlinput))
+            print('Laser set to:' + str(wlinput))
 
-                time.sleep(0.1)    
-                coordinate = np.linspace(1,number_of_repeating,number_of_repeating) 
-                temp_laser_wavelength_data=np.zeros(number_of_repeating)
-                temp_power_data=np.zeros(number_of_repeating)
+            for p, rf_power in enumerate(rf_powers):
+                self.windfreak.power = rf_power  # set the windfreak power
+                with self.timer.phase('wait'):
+                    time.sleep(0.1)    
                 self.fungen.output[pulse_channel] = 'ON' 
-                for j in range(number_of_repeating):
-                        temp_laser_wavelength_data[j]=self.wm.measure_wavelength()
-                        # temp_laser_wavelength_data[j]=wlinput+random.random()
-
-                        temp_power_data[j]=self.pmd.power.magnitude*1000000
-                        values={
-                            'coordinate':coordinate[:j+1],
-                            'laser':temp_laser_wavelength_data[:j+1],
-                            'power':temp_power_data[:j+1]
-                        }
-                        self.signalholder.update_temp_measurement.emit(values)
-                        time.sleep(0.01)
+                with self.timer.phase('acquire'):
+                    temp_data = self.measure_repeats(number_of_repeating, concurrent=concurrent_sampling, stopping=stopping)
+                self.timer.count('samples', len(temp_data['power']))
+                temp_laser_wavelength_data = temp_data['wavelength']
+                temp_power_data = temp_data['power']
 
                 self.fungen.output[pulse_channel] = 'OFF'
-                self.true_laser_wavelength[i]=c/(c/np.mean(temp_laser_wavelength_data)+num_AOMs * WindfreakFreq / 1e3)
-                self.true_power[i]=np.mean(temp_power_data)
-                
+                self.true_laser_wavelength[i, p]=c/(c/np.mean(temp_laser_wavelength_data)+num_AOMs * WindfreakFreq / 1e3)
+                self.true_power[i, p]=np.mean(temp_power_data)
+                with self.timer.phase('save'):
+                    writer.append_point({"Target wavelength": wlinput, "RF power": rf_power, "Laser wavelength": self.true_laser_wavelength[i, p], "Power": self.true_power[i, p]},
+                                        temp_data)
 
-                results={
-                    'wavelength':self.true_laser_wavelength[:i+1],
-                    'true_power':self.true_power[:i+1]
-                }
-                self.signalholder.update_reference_measurement.emit(results)
+            # The live plots follow the first RF power
+            results={
+                'wavelength':self.true_laser_wavelength[:i+1, 0],
+                'true_power':self.true_power[:i+1, 0]
+            }
+            with self.timer.phase('gui'):
+                self.updatebus.publish('update_reference_measurement', results)
 
-                wavelength_check={
-                    'expect' : wl_input_Targets[:i+1],
-                    'real' : self.true_laser_wavelength[:i+1]
-                }
+            wavelength_check={
+                'expect' : wl_input_Targets[:i+1],
+                'real' : self.true_laser_wavelength[:i+1, 0]
+            }
 
-                self.signalholder.check_the_scanning.emit(wavelength_check)
+            with self.timer.phase('gui'):
+                self.updatebus.publish('check_the_scanning', wavelength_check)
 
+            with self.timer.phase('wait'):
                 time.sleep(0.1)
 
-                print('Actual wavelength to the sample is:' + str(self.true_laser_wavelength[i]))
+            print('Actual wavelength to the sample is:' + str(self.true_laser_wavelength[i]))
+            writer.append_timing(self.timer.end_point())
+            checkpoint.mark_done(i, wlinput)
 
-                
-           
-            experiment_setting={"Laser Power" : power,"Input Resolution" : input_freq_points, "Input Start" : input_freq_start, "Input End" : input_freq_stop, "Number of Repeating Measurement": number_of_repeating
-                                }
-                
-            if not (os.path.exists(PATH)):
-                print('making new directory...')
-                Path(PATH).mkdir(parents=True, exist_ok=True)
-
-
-
-            file_name = 'reference_power_measurement_at_' + str(start_time).replace(' ', '_').replace(':', '-')
-            full_path = os.path.join(PATH, file_name + ".pkl")
-
-                
-            with open(full_path, 'wb') as f:
-                pickle.dump({"Laser wavelength":self.true_laser_wavelength,"Power":self.true_power,
-                             "Experiment Setup" : experiment_setting}, f)
-            print("Data is saved at", full_path)
-
-            self.lineplot_save(x=self.true_laser_wavelength,
-                               y=self.true_power,
+            
+       
+        writer.close()
+        checkpoint.finish()
+        print("Data is saved at", full_path)
+        print(self.timer.summary())
+
+        for p, rf_power in enumerate(rf_powers):
+            suffix = rf_power_suffix(rf_power, n_powers)
+            self.lineplot_save(x=self.true_laser_wavelength[:, p],
+                               y=self.true_power[:, p],
                                title='Reference Power',
                                xlabel='Wavelength',
                                ylabel='Power',
                                PATH=PATH,
-                               file_name=file_name)
+                               file_name=file_name + suffix)
             
             self.lineplot_save(x=wl_input_Targets,
-                               y=self.true_laser_wavelength,
+                               y=self.true_laser_wavelength[:, p],
                                title='Scanning wavelength check',
                                xlabel='Expected',
                                ylabel='Actual',
                                PATH=PATH,
-                               file_name='wavelength_check_of_' + file_name)
+                               file_name='wavelength_check_of_' + file_name + suffix)
 
 
-            time.sleep(2) 
-                    
         self.fungen.output[pulse_channel] = 'OFF'
         self.windfreak.output = 0
         #self.SRS.SIM928_on_off[SNSPD_power] = 'OFF'
 
-    @Task()
-    def starttransmissionmeasurement(self, timestep=100e-9):
-        log_to_screen(DEBUG)
-
+    def transmission_scan(self):
+        '''
+        Transmission spectrum over the 'Wavelength parameters' grid, normalized by the reference spectrum
+        (from 'Reference File Name' or the last reference scan).
+        '''
+        self.timer = PhaseTimer(SCAN_PHASES, SCAN_COUNTERS, clock=time)
         self.fungen.output[1] = 'OFF'
         self.fungen.output[2] = 'OFF'
         # # some initialization of the function generator
@@ -498,6 +783,8 @@ class Spectrum_Scan(Spyrelet):
         input_freq_stop = wlparams['Laser WL Stop']
         input_freq_points = wlparams['Number of Laser WL Point']
         number_of_repeating = expparams['Number of Repeating']
+        concurrent_sampling = expparams['Concurrent Sampling']
+        stopping = self.make_stopping()
         pulse_channel = expparams['Pulse Channel']
     
         num_AOMs = expparams['# of AOMs']
@@ -506,6 +793,9 @@ class Spectrum_Scan(Spyrelet):
 
         path_name = expparams['File Name']
         reference_file_name = expparams['Reference File Name']
+        adaptive_sampling = wlparams['Adaptive Sampling']
+        adaptive_budget = wlparams['Adaptive Point Budget']
+        adaptive_tolerance = wlparams['Adaptive Tolerance']
         c = 299792458  # speed of light, unit: m/s
 
         '''
@@ -530,163 +820,402 @@ class Spectrum_Scan(Spyrelet):
         # PATH = path_name + '_' + curr.strftime("%Y-%m-%d_%H-%M-%S")
         # os.mkdir(PATH)
         PATH = path_name
-        print('pkl file stored under PATH: ' + str(PATH))
+        print('h5 file stored under PATH: ' + str(PATH))
 
         wl_input_Targets = np.linspace(input_freq_start, input_freq_stop, input_freq_points)
         
+        # The Windfreak RF power sets the pulse power (14.40dBm gives about 100nW); with several 'RF Powers'
+        # every wavelength is homed once and all powers are measured there, one data row per power
+        rf_powers = rf_power_list(expparams['RF Powers'])
+        n_powers = len(rf_powers)
+
         if os.path.exists(reference_file_name):
             try:
                 print("Loading from reference file")
-                with open(reference_file_name, 'rb') as file:
-                    data = pickle.load(file)
-                    reference_wavelength = data["Laser wavelength"]
-                    reference_power = data["Power"]
-                    if reference_wavelength.shape != reference_power.shape:
-                        print("Dimensions of reference_wavelength and reference_power mismatch.")
-                        raise InvalidDataFormat()
+                data = load_scan(reference_file_name)
+                reference_wavelength = data["Laser wavelength"]
+                reference_power = data["Power"]
+                reference_rf_power = data.get("RF power")
+                if reference_wavelength.shape != reference_power.shape:
+                    print("Dimensions of reference_wavelength and reference_power mismatch.")
+                    raise InvalidDataFormat()
                     
             except:
                 print("Reference file has an incorrect format, please check whether the correct file is loaded!")
                 raise InvalidDataFormat()
-            results={
-                'wavelength' : reference_wavelength,
-                'true_power' : reference_power
-            }
-            self.signalholder.update_reference_measurement.emit(results)          
         else:
             try:
                 print("Loading from reference measurement")
-                reference_wavelength = self.true_laser_wavelength
-                reference_power = self.true_power
+                reference_wavelength = self.true_laser_wavelength.ravel()
+                reference_power = self.true_power.ravel()
+                reference_rf_power = np.tile(self.reference_rf_powers, len(self.true_laser_wavelength))
             except:
                 print("Reference measurement not found, please do reference measurement first!")
                 raise MeasureSequenceError()                
-                
-        
-        laser_power = [100]  # nW; pulse power
-        synthNVP_rf_powers = [14.40]  # dBm, controls pulse power
+
+        reference_spectra = self.reference_spectra(reference_wavelength, reference_power, reference_rf_power, rf_powers, expparams['Normalization Method'])
+        if os.path.exists(reference_file_name):
+            results={
+                'wavelength' : reference_spectra[0].wavelength,
+                'true_power' : reference_spectra[0].power
+            }
+            self.signalholder.update_reference_measurement.emit(results)          
         
         len_wlTargets = len(wl_input_Targets)
         
 
-        for l, power in enumerate(laser_power):
-            # with Client(self.laser) as client:
-            #     client.set('laser1:power-stabilization:setpoint', power)
-            #     power_now = client.get('laser1:power-stabilization:setpoint')
-            #     print(l, power_now)
-
-            # use synthNVP to change power of laser while fixing laser output to max
-            synthNVP_rf_power = synthNVP_rf_powers[l]
-            self.windfreak.power = synthNVP_rf_power  # set the windfreak power
-            
-            start_time = datetime.datetime.now()
-            self.true_laser_wavelength_trans = np.zeros(len_wlTargets)
-            self.true_power_trans = np.zeros(len_wlTargets)
-            self.transmission_rate = np.zeros(len_wlTargets)
+        self.timer.add('setup', self.timer.elapsed())
+        start_time = datetime.datetime.now()
 
-            for i, wlinput in enumerate(wl_input_Targets):
-                    
+        # In adaptive mode 'Number of Laser WL Point' is the coarse grid; further points are inserted
+        # where the transmission changes fastest until the point budget or the tolerance is reached
+        if adaptive_sampling:
+            scan_targets = AdaptiveSampler(input_freq_start, input_freq_stop, input_freq_points, adaptive_budget, adaptive_tolerance)
+            max_points = max(adaptive_budget, len_wlTargets)
+        else:
+            scan_targets = wl_input_Targets
+            max_points = len_wlTargets
+
+        measured_targets = np.zeros(max_points)
+        self.true_laser_wavelength_trans = np.zeros((max_points, n_powers))
+        self.true_power_trans = np.zeros((max_points, n_powers))
+        self.transmission_rate = np.zeros((max_points, n_powers))
+
+        experiment_setting={"RF Powers" : expparams['RF Powers'],"Input Resolution" : input_freq_points, "Input Start" : input_freq_start, "Input End" : input_freq_stop, "Number of Repeating Measurement": number_of_repeating,
+                            "Sequential Stopping" : stopping is not None, "Minimum Repeating" : expparams['Minimum Repeating'],
+                            "Wavelength SEM Tolerance" : expparams['Wavelength SEM Tolerance'], "Power SEM Tolerance" : expparams['Power SEM Tolerance'],
+                            "Adaptive Sampling" : adaptive_sampling, "Adaptive Point Budget" : adaptive_budget, "Adaptive Tolerance" : adaptive_tolerance
+                            }
+
+        if not (os.path.exists(PATH)):
+            print('making new directory...')
+            Path(PATH).mkdir(parents=True, exist_ok=True)
+
+        file_name = 'transmission_power_measurement_at_' + str(start_time).replace(' ', '_').replace(':', '-')
+        file_name_spectrum = 'transmission_spectrum_at_' + str(start_time).replace(' ', '_').replace(':', '-')
+        instrument_setting = {"Windfreak frequency": WindfreakFreq, "# of AOMs": num_AOMs, "Pulse Channel": pulse_channel}
+        writer, checkpoint, previous = self.open_scan(PATH, file_name, 'transmission', experiment_setting, instrument_setting, rows_per_point=n_powers,
+                                                      summary_keys=("Target wavelength", "RF power", "Laser wavelength", "Power", "transmission_rate"), raw_keys=("wavelength", "power", "power_offset"), timing_keys=self.timer.keys())
+        full_path = writer.path
+        file_name = os.path.splitext(os.path.basename(full_path))[0]
+
+        for i, wlinput in enumerate(scan_targets):
+            k = checkpoint.row(i)
+            if k is not None:
+                # Measured before the scan was interrupted: restore the point from the data file. The adaptive
+                # sampler is told the same results in the same order, so it proposes the same next points.
+                rows = slice(k * n_powers, (k + 1) * n_powers)
+                measured_targets[i] = wlinput
+                self.true_laser_wavelength_trans[i] = previous["Laser wavelength"][rows]
+                self.true_power_trans[i] = previous["Power"][rows]
+                self.transmission_rate[i] = previous["transmission_rate"][rows]
+                if adaptive_sampling:
+                    scan_targets.tell(wlinput, self.transmission_rate[i, 0])
+                continue
+                
+            with self.timer.phase('homing'):
                 _ = self.homelaser(wlinput, precision=0.0005, drift_time=4 * s)  # home laser to new wl with more precision the first time
-                print('Laser set to:' + str(wlinput))
+            print('Laser set to:' + str(wlinput))
 
-                time.sleep(0.1)    
-                coordinate = np.linspace(1,number_of_repeating,number_of_repeating) 
-                temp_laser_wavelength_data=np.zeros(number_of_repeating)
-                temp_power_data=np.zeros(number_of_repeating)
+            for p, rf_power in enumerate(rf_powers):
+                self.windfreak.power = rf_power  # set the windfreak power
+                with self.timer.phase('wait'):
+                    time.sleep(0.1)    
                 self.fungen.output[pulse_channel] = 'ON' 
-                for j in range(number_of_repeating):
-                        temp_laser_wavelength_data[j]=self.wm.measure_wavelength()
-                        #temp_laser_wavelength_data[j]=wlinput+random.random()
-
-
-                        temp_power_data[j]=self.pmd.power.magnitude*1000000
-                        trans_values={
-                            'coordinate':coordinate[:j+1],
-                            'laser':temp_laser_wavelength_data[:j+1],
-                            'power':temp_power_data[:j+1]
-                        }
-                        self.signalholder.update_temp_measurement.emit(trans_values)
-                        time.sleep(0.01)
+                with self.timer.phase('acquire'):
+                    temp_data = self.measure_repeats(number_of_repeating, concurrent=concurrent_sampling, stopping=stopping)
+                self.timer.count('samples', len(temp_data['power']))
+                temp_laser_wavelength_data = temp_data['wavelength']
+                temp_power_data = temp_data['power']
 
                 self.fungen.output[pulse_channel] = 'OFF'
-                self.true_laser_wavelength_trans[i]=c/(c/np.mean(temp_laser_wavelength_data)+num_AOMs * WindfreakFreq / 1e3)
-                self.true_power_trans[i]=np.mean(temp_power_data)
-
-                closest_wavelength, closest_power = self.closest_points(reference_wavelength, reference_power, self.true_laser_wavelength_trans[i])
-                estimated_power = self.lagrange_interpolation(closest_wavelength, closest_power, self.true_laser_wavelength_trans[i])
-                self.transmission_rate[i] = self.true_power_trans[i] / estimated_power
-                
-                trans_results={
-                    'wavelength' : self.true_laser_wavelength_trans[:i+1],
-                    'true_power' : self.true_power_trans[:i+1],
-                    'transmission_rate' : self.transmission_rate[:i+1]
-                }
-                self.signalholder.update_transmission_measurement.emit(trans_results)
+                self.true_laser_wavelength_trans[i, p]=c/(c/np.mean(temp_laser_wavelength_data)+num_AOMs * WindfreakFreq / 1e3)
+                self.true_power_trans[i, p]=np.mean(temp_power_data)
+
+                estimated_power = reference_spectra[p](self.true_laser_wavelength_trans[i, p])
+                self.transmission_rate[i, p] = self.true_power_trans[i, p] / estimated_power
+                with self.timer.phase('save'):
+                    writer.append_point({"Target wavelength": wlinput, "RF power": rf_power, "Laser wavelength": self.true_laser_wavelength_trans[i, p], "Power": self.true_power_trans[i, p], "transmission_rate": self.transmission_rate[i, p]},
+                                        temp_data)
+            measured_targets[i] = wlinput
+            # Adaptive refinement and the live plots follow the first RF power
+            if adaptive_sampling:
+                scan_targets.tell(wlinput, self.transmission_rate[i, 0])
+
+            order = np.argsort(self.true_laser_wavelength_trans[:i+1, 0])
+            trans_results={
+                'wavelength' : self.true_laser_wavelength_trans[order, 0],
+                'true_power' : self.true_power_trans[order, 0],
+                'transmission_rate' : self.transmission_rate[order, 0]
+            }
+            with self.timer.phase('gui'):
+                self.updatebus.publish('update_transmission_measurement', trans_results)
 
-                wavelength_check={
-                    'expect' : wl_input_Targets[:i+1],
-                    'real' : self.true_laser_wavelength_trans[:i+1]
-                }
+            wavelength_check={
+                'expect' : measured_targets[:i+1],
+                'real' : self.true_laser_wavelength_trans[:i+1, 0]
+            }
 
-                self.signalholder.check_the_scanning.emit(wavelength_check)
+            with self.timer.phase('gui'):
+                self.updatebus.publish('check_the_scanning', wavelength_check)
 
+            with self.timer.phase('wait'):
                 time.sleep(0.1)
 
-                print('Actual wavelength to the sample is:' + str(self.true_laser_wavelength_trans[i]))
-
-                
-           
-            experiment_setting={"Laser Power" : power,"Input Resolution" : input_freq_points, "Input Start" : input_freq_start, "Input End" : input_freq_stop, "Number of Repeating Measurement": number_of_repeating
-                                }
-                
-            if not (os.path.exists(PATH)):
-                print('making new directory...')
-                Path(PATH).mkdir(parents=True, exist_ok=True)
-
-            file_name = 'transmission_power_measurement_at_' + str(start_time).replace(' ', '_').replace(':', '-')
-            file_name_spectrum = 'transmission_spectrum_at_' + str(start_time).replace(' ', '_').replace(':', '-')
-            full_path = os.path.join(PATH, file_name + '.pkl')
-                
-            with open(full_path, 'wb') as f:
-                pickle.dump({"Laser wavelength":self.true_laser_wavelength_trans,"Power":self.true_power_trans,"transmission_rate" : self.transmission_rate,
-                             "Experiment Setup" : experiment_setting}, f)
-            print("Data is saved at", full_path)
-
-        
+            print('Actual wavelength to the sample is:' + str(self.true_laser_wavelength_trans[i]))
+            writer.append_timing(self.timer.end_point())
+            checkpoint.mark_done(i, wlinput)
 
-            self.lineplot_save(x=self.true_laser_wavelength_trans,
-                               y=self.true_power_trans,
+            
+       
+        n_points = len(checkpoint.completed)
+        writer.close()
+        checkpoint.finish()
+        print("Data is saved at", full_path)
+        print(self.timer.summary())
+
+        measured_targets = measured_targets[:n_points]
+        self.true_laser_wavelength_trans = self.true_laser_wavelength_trans[:n_points]
+        self.true_power_trans = self.true_power_trans[:n_points]
+        self.transmission_rate = self.transmission_rate[:n_points]
+
+        for p, rf_power in enumerate(rf_powers):
+            suffix = rf_power_suffix(rf_power, n_powers)
+            order = np.argsort(self.true_laser_wavelength_trans[:, p])
+            self.lineplot_save(x=self.true_laser_wavelength_trans[order, p],
+                               y=self.true_power_trans[order, p],
                                title='Transmission Power',
                                xlabel='Wavelength',
                                ylabel='Power',
                                PATH=PATH,
-                               file_name=file_name)
+                               file_name=file_name + suffix)
             
-            self.lineplot_save(x=wl_input_Targets,
-                               y=self.true_laser_wavelength_trans,
+            self.lineplot_save(x=measured_targets[order],
+                               y=self.true_laser_wavelength_trans[order, p],
                                title='Scanning wavelength check',
                                xlabel='Expected',
                                ylabel='Actual',
                                PATH=PATH,
-                               file_name='wavelength_check_of_' + file_name)
+                               file_name='wavelength_check_of_' + file_name + suffix)
             
-            self.lineplot_save(x=self.true_laser_wavelength_trans,
-                               y=self.transmission_rate,
+            self.lineplot_save(x=self.true_laser_wavelength_trans[order, p],
+                               y=self.transmission_rate[order, p],
                                title='Transmission Spectrum',
                                xlabel='Wavelength',
                                ylabel='Transmission',
                                PATH=PATH,
-                               file_name=file_name_spectrum)
+                               file_name=file_name_spectrum + suffix)
             
-            time.sleep(2) 
-                    
         self.fungen.output[pulse_channel] = 'OFF'
         self.windfreak.output = 0
         #self.SRS.SIM928_on_off[SNSPD_power] = 'OFF'
 
-   
+    def single_pass_scan(self):
+        '''
+        Home once per wavelength, then measure the reference arm and the sample arm back to back.
+        The transmission rate is the ratio of the two powers at the same point, so no reference interpolation
+        is needed and every wavelength is homed only once.
+        '''
+        self.timer = PhaseTimer(SCAN_PHASES, SCAN_COUNTERS, clock=time)
+        self.fungen.output[1] = 'OFF'
+        self.fungen.output[2] = 'OFF'
+        # # some initialization of the function generator
+        self.fungen.clear_mem(1)
+        self.fungen.clear_mem(2)
+        self.fungen.wait()
 
+        time.sleep(1)  # Wait 1s to turn on SNSPD
 
+        expparams = self.exp_parameters.widget.get()
+        wlparams = self.wl_parameters.widget.get()
+
+        input_freq_start = wlparams['Laser WL Start']
+        input_freq_stop = wlparams['Laser WL Stop']
+        input_freq_points = wlparams['Number of Laser WL Point']
+        number_of_repeating = expparams['Number of Repeating']
+        concurrent_sampling = expparams['Concurrent Sampling']
+        stopping = self.make_stopping()
+        pulse_channel = expparams['Pulse Channel']
+    
+        num_AOMs = expparams['# of AOMs']
+        WindfreakFreq = expparams['Windfreak frequency'].magnitude  # rf freq to AOMs
+
+        path_name = expparams['File Name']
+        c = 299792458  # speed of light, unit: m/s
+
+        self.fungen.offset[pulse_channel] = 1.75 * volt
+        self.fungen.phase[pulse_channel] = 0
+        self.fungen.waveform[pulse_channel] = 'DC'
+        self.windfreak.frequency = WindfreakFreq  # set the windfreak frequency to the windfreak frequency
+        self.windfreak.output = 1  # turn on the windfreak
+        time.sleep(5)  ## wait 5s to turn on the windfreak
+
+        PATH = path_name
+        print('h5 file stored under PATH: ' + str(PATH))
+
+        wl_input_Targets = np.linspace(input_freq_start, input_freq_stop, input_freq_points)
+        
+        # The Windfreak RF power sets the pulse power (14.40dBm gives about 100nW); with several 'RF Powers'
+        # every wavelength is homed once and all powers are measured in each arm, one data row per power
+        rf_powers = rf_power_list(expparams['RF Powers'])
+        n_powers = len(rf_powers)
+        
+        len_wlTargets = len(wl_input_Targets)
+
+        self.timer.add('setup', self.timer.elapsed())
+        start_time = datetime.datetime.now()
+        self.true_laser_wavelength = np.zeros((len_wlTargets, n_powers))
+        self.true_power = np.zeros((len_wlTargets, n_powers))
+        self.true_laser_wavelength_trans = np.zeros((len_wlTargets, n_powers))
+        self.true_power_trans = np.zeros((len_wlTargets, n_powers))
+        self.transmission_rate = np.zeros((len_wlTargets, n_powers))
+
+        experiment_setting={"RF Powers" : expparams['RF Powers'],"Input Resolution" : input_freq_points, "Input Start" : input_freq_start, "Input End" : input_freq_stop, "Number of Repeating Measurement": number_of_repeating,
+                            "Sequential Stopping" : stopping is not None, "Minimum Repeating" : expparams['Minimum Repeating'],
+                            "Wavelength SEM Tolerance" : expparams['Wavelength SEM Tolerance'], "Power SEM Tolerance" : expparams['Power SEM Tolerance'],
+                            "Arm Routing" : expparams['Arm Routing']
+                            }
+
+        if not (os.path.exists(PATH)):
+            print('making new directory...')
+            Path(PATH).mkdir(parents=True, exist_ok=True)
+
+        file_name = 'single_pass_measurement_at_' + str(start_time).replace(' ', '_').replace(':', '-')
+        instrument_setting = {"Windfreak frequency": WindfreakFreq, "# of AOMs": num_AOMs, "Pulse Channel": pulse_channel}
+        # With sequential stopping the arms can take different numbers of samples, so the reference arm has its
+        # own count (/raw/reference_sample_count) next to the sample arm's /raw/sample_count
+        reference_keys = ("reference_wavelength", "reference_power", "reference_power_offset")
+        writer, checkpoint, previous = self.open_scan(PATH, file_name, 'single_pass', experiment_setting, instrument_setting, rows_per_point=n_powers,
+                                                      summary_keys=("Target wavelength", "RF power", "Laser wavelength", "Reference wavelength", "Reference power", "Power", "transmission_rate"),
+                                                      raw_keys=reference_keys + ("wavelength", "power", "power_offset"), timing_keys=self.timer.keys(),
+                                                      raw_counts={key: "reference_sample_count" for key in reference_keys})
+        full_path = writer.path
+        file_name = os.path.splitext(os.path.basename(full_path))[0]
+
+        for i, wlinput in enumerate(wl_input_Targets):
+            k = checkpoint.row(i)
+            if k is not None:
+                # Measured before the scan was interrupted: restore the point from the data file
+                rows = slice(k * n_powers, (k + 1) * n_powers)
+                self.true_laser_wavelength[i] = previous["Reference wavelength"][rows]
+                self.true_power[i] = previous["Reference power"][rows]
+                self.true_laser_wavelength_trans[i] = previous["Laser wavelength"][rows]
+                self.true_power_trans[i] = previous["Power"][rows]
+                self.transmission_rate[i] = previous["transmission_rate"][rows]
+                continue
+                
+            with self.timer.phase('homing'):
+                _ = self.homelaser(wlinput, precision=0.0005, drift_time=4 * s)
+            print('Laser set to:' + str(wlinput))
+
+            # Arms outside, powers inside: the router switches twice per wavelength whatever the number of powers
+            arm_data = {'reference': [], 'sample': []}
+            for arm in ('reference', 'sample'):
+                with self.timer.phase('routing'):
+                    self.router.select(arm)
+                for rf_power in rf_powers:
+                    self.windfreak.power = rf_power  # set the windfreak power
+                    with self.timer.phase('wait'):
+                        time.sleep(0.1)
+                    self.fungen.output[pulse_channel] = 'ON' 
+                    with self.timer.phase('acquire'):
+                        arm_data[arm].append(self.measure_repeats(number_of_repeating, concurrent=concurrent_sampling, stopping=stopping))
+                    self.timer.count('samples', len(arm_data[arm][-1]['power']))
+                    self.fungen.output[pulse_channel] = 'OFF'
+
+            for p, rf_power in enumerate(rf_powers):
+                reference_data = arm_data['reference'][p]
+                sample_data = arm_data['sample'][p]
+                self.true_laser_wavelength[i, p]=c/(c/np.mean(reference_data['wavelength'])+num_AOMs * WindfreakFreq / 1e3)
+                self.true_power[i, p]=np.mean(reference_data['power'])
+                self.true_laser_wavelength_trans[i, p]=c/(c/np.mean(sample_data['wavelength'])+num_AOMs * WindfreakFreq / 1e3)
+                self.true_power_trans[i, p]=np.mean(sample_data['power'])
+                self.transmission_rate[i, p] = self.true_power_trans[i, p] / self.true_power[i, p]
+
+                raw = {'reference_' + key: value for key, value in reference_data.items()}
+                raw.update(sample_data)
+                with self.timer.phase('save'):
+                    writer.append_point({"Target wavelength": wlinput, "RF power": rf_power, "Laser wavelength": self.true_laser_wavelength_trans[i, p], "Reference wavelength": self.true_laser_wavelength[i, p],
+                                         "Reference power": self.true_power[i, p], "Power": self.true_power_trans[i, p], "transmission_rate": self.transmission_rate[i, p]},
+                                        raw)
+
+            # The live plots follow the first RF power
+            results={
+                'wavelength':self.true_laser_wavelength[:i+1, 0],
+                'true_power':self.true_power[:i+1, 0]
+            }
+            with self.timer.phase('gui'):
+                self.updatebus.publish('update_reference_measurement', results)
+
+            trans_results={
+                'wavelength' : self.true_laser_wavelength_trans[:i+1, 0],
+                'true_power' : self.true_power_trans[:i+1, 0],
+                'transmission_rate' : self.transmission_rate[:i+1, 0]
+            }
+            with self.timer.phase('gui'):
+                self.updatebus.publish('update_transmission_measurement', trans_results)
+
+            wavelength_check={
+                'expect' : wl_input_Targets[:i+1],
+                'real' : self.true_laser_wavelength_trans[:i+1, 0]
+            }
+            with self.timer.phase('gui'):
+                    self.updatebus.publish('check_the_scanning', wavelength_check)
+
+            print('Actual wavelength to the sample is:' + str(self.true_laser_wavelength_trans[i]))
+            writer.append_timing(self.timer.end_point())
+            checkpoint.mark_done(i, wlinput)
+
+        writer.close()
+        checkpoint.finish()
+        print("Data is saved at", full_path)
+        print(self.timer.summary())
+
+        for p, rf_power in enumerate(rf_powers):
+            suffix = rf_power_suffix(rf_power, n_powers)
+            self.lineplot_save(x=self.true_laser_wavelength[:, p],
+                               y=self.true_power[:, p],
+                               title='Reference Power',
+                               xlabel='Wavelength',
+                               ylabel='Power',
+                               PATH=PATH,
+                               file_name='reference_of_' + file_name + suffix)
+
+            self.lineplot_save(x=self.true_laser_wavelength_trans[:, p],
+                               y=self.true_power_trans[:, p],
+                               title='Transmission Power',
+                               xlabel='Wavelength',
+                               ylabel='Power',
+                               PATH=PATH,
+                               file_name='transmission_of_' + file_name + suffix)
+
+            self.lineplot_save(x=self.true_laser_wavelength_trans[:, p],
+                               y=self.transmission_rate[:, p],
+                               title='Transmission Spectrum',
+                               xlabel='Wavelength',
+                               ylabel='Transmission',
+                               PATH=PATH,
+                               file_name='spectrum_of_' + file_name + suffix)
+            
+        self.fungen.output[pulse_channel] = 'OFF'
+        self.windfreak.output = 0
+
+    # The scan bodies above are plain methods so they can also be driven outside spyre
+    # (see other_control/ScanBenchmark.py); the tasks only wrap them.
+    @Task()
+    def startreferencemeasurement(self, timestep=100e-9):
+        log_to_screen(DEBUG)
+        self.reference_scan()
+
+    @Task()
+    def starttransmissionmeasurement(self, timestep=100e-9):
+        log_to_screen(DEBUG)
+        self.transmission_scan()
+
+    @Task()
+    def startsinglepassmeasurement(self, timestep=100e-9):
+        log_to_screen(DEBUG)
+        self.single_pass_scan()
 
     @Element(name='Wavelength parameters')
     def wl_parameters(self):
@@ -695,6 +1224,9 @@ class Spectrum_Scan(Spyrelet):
             ('Laser WL Start', {'type': float, 'default': 1500}),
             ('Laser WL Stop',{'type': float, 'default': 1550}),
             ('Number of Laser WL Point', {'type': int, 'default': 3}),
+            ('Adaptive Sampling', {'type': bool, 'default': False}),
+            ('Adaptive Point Budget', {'type': int, 'default': 100}),
+            ('Adaptive Tolerance', {'type': float, 'default': 0.01}),
             
         ]
         w = ParamWidget(params)
@@ -706,9 +1238,31 @@ class Spectrum_Scan(Spyrelet):
             ('Windfreak frequency', {'type': float, 'default': 200, 'units': 'MHz'}),
             ('# of AOMs', {'type': int, 'default': 3}),
             ('Number of Repeating', {'type': int, 'default': 1000}),
+            ('RF Powers', {'type': str, 'default': '14.40'}),
+            ('Resume Scan', {'type': bool, 'default': False}),
+            ('Sequential Stopping', {'type': bool, 'default': False}),
+            ('Minimum Repeating', {'type': int, 'default': 50}),
+            ('Wavelength SEM Tolerance', {'type': float, 'default': 1e-6}),
+            ('Power SEM Tolerance', {'type': float, 'default': 1e-3}),
+            ('Settle Detection', {'type': bool, 'default': False}),
+            ('Settle Slope', {'type': float, 'default': 5e-5}),
+            ('Settle Deviation', {'type': float, 'default': 5e-5}),
+            ('Settle Window', {'type': int, 'default': 8}),
+            ('Concurrent Sampling', {'type': bool, 'default': False}),
+            ('Buffered Wavemeter', {'type': bool, 'default': False}),
+            ('Wavemeter Rate', {'type': float, 'default': 5, 'units': 'Hz'}),
+            ('Power Block Readout', {'type': bool, 'default': False}),
+            ('Power Meter Averaging', {'type': int, 'default': 1}),
+            ('Power Block Size', {'type': int, 'default': 50}),
             ('Pulse Channel', {'type': int, 'default': 1}),
             ('File Name', {'type': str, 'default': "E:\\PL on resonant\\transmission test\\test"}),
-            ('Reference File Name', {'type': str, 'default': ''})
+            ('Reference File Name', {'type': str, 'default': ''}),
+            ('Normalization Method', {'type': str, 'default': 'lagrange'}),
+            ('GUI Frame Rate', {'type': float, 'default': 10}),
+            ('Arm Routing', {'type': str, 'default': 'attenuator'}),
+            ('Reference Attenuator', {'type': str, 'default': ''}),
+            ('Sample Attenuator', {'type': str, 'default': ''}),
+            ('Homing Calibration File', {'type': str, 'default': os.path.join(os.path.expanduser('~'), 'toptica_homing_calibration.npz')})
         ]
         w = ParamWidget(params)
         return w
@@ -716,7 +1270,12 @@ class Spectrum_Scan(Spyrelet):
 
     @startreferencemeasurement.initializer
     def initialize(self):
-        self.wm.start_data()
+        self.start_wavemeter()
+        self.start_power_meter()
+        self.start_updatebus()
+        self.load_calibration()
+        self.settle = self.make_settle_detector()
+        self.renderer = PlotRenderer()
         return
 
     @startreferencemeasurement.finalizer
@@ -724,13 +1283,21 @@ class Spectrum_Scan(Spyrelet):
         self.fungen.output[1] = 'OFF'  ##turn off the AWG for both channels
         self.fungen.output[2] = 'OFF'
         self.windfreak.output = 0
-        self.wm.stop_data()
+        self.stop_wavemeter()
+        self.stop_power_meter()
+        self.updatebus.stop()
+        self.renderer.shutdown()
         print('Lifetime measurements complete.')
         return
 
     @starttransmissionmeasurement.initializer
     def initialize(self):
-        self.wm.start_data()
+        self.start_wavemeter()
+        self.start_power_meter()
+        self.start_updatebus()
+        self.load_calibration()
+        self.settle = self.make_settle_detector()
+        self.renderer = PlotRenderer()
         return
 
     @starttransmissionmeasurement.finalizer
@@ -738,10 +1305,38 @@ class Spectrum_Scan(Spyrelet):
         self.fungen.output[1] = 'OFF'  ##turn off the AWG for both channels
         self.fungen.output[2] = 'OFF'
         self.windfreak.output = 0
-        self.wm.stop_data()
+        self.stop_wavemeter()
+        self.stop_power_meter()
+        self.updatebus.stop()
+        self.renderer.shutdown()
         print('Lifetime measurements complete.')
         return
 
+    @startsinglepassmeasurement.initializer
+    def initialize(self):
+        # Fails before any instrument is started when no real router is configured
+        self.router = self.make_router()
+        self.start_wavemeter()
+        self.start_power_meter()
+        self.start_updatebus()
+        self.load_calibration()
+        self.settle = self.make_settle_detector()
+        self.renderer = PlotRenderer()
+        return
+
+    @startsinglepassmeasurement.finalizer
+    def finalize(self):
+        self.fungen.output[1] = 'OFF'  ##turn off the AWG for both channels
+        self.fungen.output[2] = 'OFF'
+        self.windfreak.output = 0
+        self.stop_wavemeter()
+        self.stop_power_meter()
+        self.updatebus.stop()
+        self.renderer.shutdown()
+        self.router.close()
+        print('Single-pass measurement complete.')
+        return
+
     
 class Graph(Spyrelet):
     requires_spyrelet = {
@@ -750,6 +1345,10 @@ class Graph(Spyrelet):
     # Format is spyrelet_name : class_name
      # the 1D plot widget for both the wavelength and power measurement ongoing
 
+    # update_temp_measurement only carries the samples added since the last emission
+    wavelength_buffer = DeltaBuffer()
+    power_buffer = DeltaBuffer()
+
     @Element(name="ongoing wavelength measurement")
     def wavelength_measurement(self):
         p = LinePlotWidget()
@@ -758,13 +1357,13 @@ class Graph(Spyrelet):
         return p
 
     # update the previous plot
-    @wavelength_measurement.on(Spectrum_Scan.signalholder.update_temp_reference_measurement)
+    @wavelength_measurement.on(Spectrum_Scan.signalholder.update_temp_measurement)
     def _wavelength_measurement_update(self, ev):
         w = ev.widget
         # cut off pulse in display
         # xs = np.array(self.bins)[self.cutoff:]
         # ys = np.array(self.hist)[self.cutoff:]
-        values = ev.event_args[0]
+        values = self.wavelength_buffer.update(ev.event_args[0])
         coordinate = values['coordinate']
         laser = values['laser']
         
@@ -780,13 +1379,13 @@ class Graph(Spyrelet):
         return p
 
     # update the previous plot
-    @power_measurement.on(Spectrum_Scan.signalholder.update_temp_reference_measurement)
+    @power_measurement.on(Spectrum_Scan.signalholder.update_temp_measurement)
     def _power_measurement_update(self, ev):
         w = ev.widget
         # cut off pulse in display
         # xs = np.array(self.bins)[self.cutoff:]
         # ys = np.array(self.hist)[self.cutoff:]
-        values = ev.event_args[0]
+        values = self.power_buffer.update(ev.event_args[0])
         coordinate = values['coordinate']
         
         power = values['power']
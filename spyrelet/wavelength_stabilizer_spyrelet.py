@@ -13,6 +13,12 @@ from PyQt5.QtWidgets import QPushButton, QTextEdit, QVBoxLayout
 from PyQt5.QtCore import pyqtSignal, Qt, pyqtSlot
 
 from LaserControl import adjust_piezo, get_avg_wavelength
+from LaserSession import laser_session
+from WavemeterBuffer import shared_wavemeter_buffer, release_wavemeter_buffer
+from LiveTrace import LiveTrace
+from WavelengthEstimator import WavelengthEstimator
+from PiezoLock import PiezoLock
+from PiezoSlope import piezo_slope_estimator
 
 from spyre import Spyrelet, Task, Element
 from spyre.widgets.task import TaskWidget
@@ -45,7 +51,7 @@ class WavelengthStabilizer(Spyrelet):
         'wm': Bristol_771
     }
 
-    laser = NetworkConnection('169.254.21.75')
+    laser = laser_session('169.254.21.75')
 
     status = True
 
@@ -71,37 +77,103 @@ class WavelengthStabilizer(Spyrelet):
 
         trigger = stabilizerparams['Critical Accuracy']
         precision = stabilizerparams['Precision']
-
-        while True:
-            if self.status:
-                time.sleep(1)
-            else:
-                self.signalholder.signal.emit(True)
+        # Buffered wavemeter readout shared with the live plot and the scans, each draining it through its own
+        # reader; the last task to finish stops the acquisition
+        wmbuffer = shared_wavemeter_buffer(self.wm)
+        wm = wmbuffer.reader()
+
+        # The drift check reads the continuously updated estimate (EWMA) instead of averaging fresh readings,
+        # so it costs no acquisition time and sees drift within about one sample period
+        estimator = WavelengthEstimator(wmbuffer.reader(), window=stabilizerparams['Estimator Window'],
+                                        span=stabilizerparams['EWMA Span'], interval=wmbuffer.period)
+        estimator.start()
+        try:
+            while True:
+                if self.status:
+                    time.sleep(1)
+                    continue
                 if self.target is None:
-                    self.target = get_avg_wavelength(self.wm, 30)
-                current = get_avg_wavelength(self.wm, measure_time=15)
+                    self.target = get_avg_wavelength(wm, 30)
+                if estimator.errors:
+                    raise estimator.errors[0]
+                if not estimator.wait_ready(timeout=10):
+                    continue
+                current = estimator.snapshot()['ewma']
                 if abs(current - self.target) > trigger :
-                    adjust_piezo(self.laser, self.wm, self.target, precision, measure_time=15, drift_time=4, max_iterations=20)
-                self.signalholder.signal.emit(False)
+                    self.signalholder.signal.emit(True)
+                    adjust_piezo(self.laser, wm, self.target, precision, measure_time=15, drift_time=4, max_iterations=20)
+                    estimator.reset()  # readings from before the correction
+                    self.signalholder.signal.emit(False)
+                time.sleep(wmbuffer.period)
+        finally:
+            estimator.stop()
+            release_wavemeter_buffer(wmbuffer)
+
+    @Task()
+    def lock_wavelength(self):
+        # High-rate alternative to enable_stabilize: corrects the piezo after every wavemeter reading from a
+        # control thread instead of averaging and adjusting once the drift exceeds the critical accuracy
+        stabilizerparams = self.stabilizer_params.widget.get()
+        wmbuffer = shared_wavemeter_buffer(self.wm)
+        wm = wmbuffer.reader()
+        lock = None
+        last_report = time.time()
+        try:
+            while True:
+                if self.status:
+                    if lock is not None:
+                        lock.hold()
+                    time.sleep(1)
+                    continue
+                if self.target is None:
+                    self.target = get_avg_wavelength(wm, 30)
+                if lock is None:
+                    # Same tuning slope estimate as the homing of this laser, instead of the fixed 70V value
+                    lock = PiezoLock(self.laser, wm, self.target, rate=stabilizerparams['Lock Rate'],
+                                     P=stabilizerparams['Lock P'], I=stabilizerparams['Lock I'],
+                                     D=stabilizerparams['Lock D'], slope=piezo_slope_estimator(self.laser))
+                    lock.start()
+                lock.release(self.target)
+                if lock.errors:
+                    raise lock.errors[0]
+                if time.time() - last_report > 60:
+                    print(f'Piezo lock timing: {lock.jitter()}')
+                    last_report = time.time()
+                time.sleep(1)
+        finally:
+            if lock is not None:
+                lock.stop()
+            release_wavemeter_buffer(wmbuffer)
 
     @Task()
     def plot_wavelength(self):
-        count = []
-        wavelength = []
-        t = 0
-        while True:
-            count.append(t)
-            wavelength.append(self.wm.measure_wavelength())
-            values={
-            'time': np.array(count),
-            'wavelength' : np.array(wavelength)
-
-            }
-
-            self.plot_wavelength.acquire(values)
-            t+=1
-            
-            time.sleep(0.2)
+        # Every wavelength the wavemeter captured, drained in blocks, against its instrument time in seconds.
+        # The trace is bounded: the most recent samples at full rate, older ones as a downsampled history.
+        stabilizerparams = self.stabilizer_params.widget.get()
+        trace = LiveTrace(capacity=stabilizerparams['Trace Length'], history=stabilizerparams['History Length'],
+                          decimation=stabilizerparams['History Decimation'])
+        wmbuffer = shared_wavemeter_buffer(self.wm)
+        reader = wmbuffer.reader()
+        start = None
+        try:
+            while True:
+                times, wls = reader.drain()
+                if len(wls):
+                    if start is None:
+                        start = times[0]
+                    trace.extend(times - start, wls)
+                    count, wavelength = trace.view()
+                    values={
+                    'time': count,
+                    'wavelength' : wavelength
+
+                    }
+
+                    self.plot_wavelength.acquire(values)
+
+                time.sleep(0.2)
+        finally:
+            release_wavemeter_buffer(wmbuffer)
 
     @Element(name="ongoing wavelength check")
     def wavelength_check(self):
@@ -130,7 +202,16 @@ class WavelengthStabilizer(Spyrelet):
     def stabilizer_params(self):
         params = [
             ('Critical Accuracy', {'type': float, 'default': 0.0001}),
-            ('Precision',{'type': float, 'default': 0.00002})
+            ('Precision',{'type': float, 'default': 0.00002}),
+            ('Estimator Window', {'type': int, 'default': 15}),
+            ('EWMA Span', {'type': float, 'default': 5}),
+            ('Trace Length', {'type': int, 'default': 3000}),
+            ('History Length', {'type': int, 'default': 3000}),
+            ('History Decimation', {'type': int, 'default': 50}),
+            ('Lock Rate', {'type': float, 'default': 5}),
+            ('Lock P', {'type': float, 'default': 0.9}),
+            ('Lock I', {'type': float, 'default': 0.4}),
+            ('Lock D', {'type': float, 'default': 0.0})
         ]
 
         w = ParamWidget(params)
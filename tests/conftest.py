@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules import each other by file name, as in the spyrelets and the scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('spyrelet', 'other_control'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from AdaptiveSampling import AdaptiveSampler
+
+
+def run(sampler, spectrum):
+    for wl in sampler:
+        sampler.tell(wl, spectrum(wl))
+    return np.sort(sampler.x)
+
+
+def dip(wl):
+    return 1 - 0.8 / (1 + ((wl - 1503.0) / 0.05) ** 2)
+
+
+def test_points_gather_at_a_narrow_dip_and_stop_at_the_tolerance():
+    x = run(AdaptiveSampler(1500.0, 1510.0, coarse_points=21, max_points=200, tolerance=0.002), dip)
+    assert 21 < len(x) < 200
+    near = np.count_nonzero(np.abs(x - 1503.0) < 0.5)
+    # A uniform grid would put 10% of the points within 0.5nm of the dip
+    assert near > 0.5 * len(x)
+    # The dip is resolved: the lowest measured point is close to its minimum
+    assert min(dip(wl) for wl in x) < 0.25
+
+
+def test_flat_spectrum_is_not_refined():
+    x = run(AdaptiveSampler(1500.0, 1510.0, coarse_points=11, max_points=100, tolerance=1e-6), lambda wl: 1.0)
+    assert len(x) == 11
+
+
+def test_steep_straight_flank_is_refined_by_its_slope():
+    # Flat, a straight flank over 1504-1505nm, flat again; the curvature only sees the two corners
+    def edge(wl):
+        return float(np.clip(wl - 1504.0, 0.0, 1.0))
+
+    x = run(AdaptiveSampler(1500.0, 1510.0, coarse_points=11, max_points=100, tolerance=0.002), edge)
+    inside = x[(x > 1504.0) & (x < 1505.0)]
+    outside = x[(x < 1503.0) | (x > 1506.0)]
+    assert len(inside) >= 3
+    assert len(outside) == 7  # the coarse points of the flat stretches only
+
+
+def test_failed_measurements_are_skipped():
+    def spectrum(wl):
+        return np.nan if abs(wl - 1505.0) < 1e-9 else dip(wl)
+
+    sampler = AdaptiveSampler(1500.0, 1510.0, coarse_points=11, max_points=60, tolerance=0.002)
+    x = run(sampler, spectrum)
+    _, loss = sampler.losses()
+    assert np.isnan(loss).sum() == 2
+    # The NaN point is never refined around, and never measured twice
+    assert not np.any((x > 1504.0) & (x < 1506.0) & (x != 1505.0))
+    assert np.count_nonzero(x == 1505.0) == 1
+    assert np.count_nonzero(np.abs(x - 1503.0) < 0.5) > 5
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+
+from ControlSteps import Call, Sleep, run_steps, run_steps_async
+
+
+class CountingClock:
+    def __init__(self):
+        self.slept = []
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+
+def loop(clock, fail=False):
+    readings = []
+    for value in (1.0, 2.0):
+        readings.append((yield Call(lambda v: v * 10, value)))
+        yield Sleep(0.5, clock)
+    try:
+        yield Call(int, 'not a number' if fail else '3')
+    except ValueError:
+        return readings, 'recovered'
+    return readings, 'done'
+
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_blocking_and_asyncio_drivers_run_the_same_loop(fail):
+    blocking_clock, async_clock = CountingClock(), CountingClock()
+    blocking = run_steps(loop(blocking_clock, fail))
+    concurrent = asyncio.run(run_steps_async(loop(async_clock, fail)))
+    assert blocking == concurrent == ([10.0, 20.0], 'recovered' if fail else 'done')
+    assert blocking_clock.slept == async_clock.slept == [0.5, 0.5]
+
+
+def test_errors_not_handled_by_the_loop_propagate():
+    def failing():
+        yield Call(int, 'x')
+    with pytest.raises(ValueError):
+        run_steps(failing())
+    with pytest.raises(ValueError):
+        asyncio.run(run_steps_async(failing()))
+
+
+def test_run_homing_homes_two_simulated_lasers():
+    # The homing routines share their loops with LaserControl, which needs the lab environment
+    for module in ('lantz', 'toptica', 'PyQt5'):
+        pytest.importorskip(module)
+    from AsyncLaserControl import run_homing
+    from SimulatedInstruments import simulated_instruments
+
+    setups = [simulated_instruments(seed=0, wavelength=1500.0), simulated_instruments(seed=10, wavelength=1530.0)]
+    targets = [1500.3, 1529.8]
+    jobs = [dict(laser=setup['laser'], wm=setup['wm'], target=target, measure_time=10, precision=1e-4,
+                 clock=setup['clock'].time_module) for setup, target in zip(setups, targets)]
+    results = run_homing(jobs)
+    assert len(results) == 2
+    for setup, target, (motor_iterations, piezo_iterations) in zip(setups, targets, results):
+        assert motor_iterations >= 1
+        assert piezo_iterations >= 2
+        assert setup['laser'].wavelength() == pytest.approx(target, abs=3e-4)
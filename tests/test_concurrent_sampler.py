@@ -0,0 +1,103 @@
+import threading
+import time
+import numpy as np
+import pytest
+
+from ConcurrentSampler import ConcurrentSampler, pair_by_time
+
+
+def test_pair_by_time_picks_the_nearest_reading():
+    t_ref = np.array([0.0, 1.0, 2.4, 2.6, 10.0])
+    t_other = np.array([0.1, 0.9, 2.0, 3.0])
+    index, offset = pair_by_time(t_ref, t_other)
+    assert index.tolist() == [0, 1, 2, 3, 3]
+    np.testing.assert_allclose(offset, [0.1, -0.1, -0.4, 0.4, -7.0])
+
+
+def test_pair_by_time_tie_goes_to_the_earlier_reading():
+    index, offset = pair_by_time([1.5], [1.0, 2.0])
+    assert index.tolist() == [0]
+    assert offset.tolist() == [-0.5]
+
+
+def test_pair_by_time_outside_the_other_stream():
+    index, offset = pair_by_time([-5.0, 50.0], [0.0, 1.0, 2.0])
+    assert index.tolist() == [0, 2]
+    assert offset.tolist() == [5.0, -48.0]
+
+
+def test_pair_by_time_single_reading():
+    index, offset = pair_by_time([0.0, 1.0, 2.0], [1.2])
+    assert index.tolist() == [0, 0, 0]
+    np.testing.assert_allclose(offset, [1.2, 0.2, -0.8])
+
+
+def counter():
+    count = [0]
+
+    def read():
+        count[0] += 1
+        return float(count[0])
+    return read
+
+
+def test_acquire_paired_aligns_streams_to_the_reference():
+    sampler = ConcurrentSampler({'wavelength': counter(), 'power': counter()})
+    data = sampler.acquire_paired(5, 'wavelength', interval=0.001)
+    assert data['wavelength'].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert len(data['power']) == len(data['time']) == len(data['power_offset']) == 5
+    assert data['power'].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert np.all(np.diff(data['time']) > 0)
+    assert np.all(np.abs(data['power_offset']) < 0.05)
+
+
+def test_mismatched_latencies_keep_every_reading():
+    def slow_counter(latency):
+        read = counter()
+
+        def slow():
+            time.sleep(latency)
+            return read()
+        return slow
+
+    sampler = ConcurrentSampler({'wavelength': slow_counter(0.05), 'power': slow_counter(0.002)})
+    data = sampler.acquire_paired(10, 'wavelength')
+    # The fast stream waits for the slow one, so every power reading is kept and none is repeated
+    assert data['power'].tolist() == [float(k) for k in range(1, 11)]
+    assert data['wavelength'].tolist() == [float(k) for k in range(1, 11)]
+    # Both readings of a round start together; only the latency difference separates their midpoints
+    assert np.all(np.abs(data['power_offset']) < 0.04)
+
+
+def test_workers_persist_between_batches():
+    sampler = ConcurrentSampler({'wavelength': counter(), 'power': counter()})
+    before = threading.active_count()
+    with sampler:
+        assert threading.active_count() == before + 2
+        for k in range(10):
+            results = sampler.acquire(3)
+            assert results['wavelength'][0].tolist() == [3.0 * k + 1, 3.0 * k + 2, 3.0 * k + 3]
+        assert threading.active_count() == before + 2
+    assert threading.active_count() == before
+
+
+def test_acquire_without_start_stops_its_workers():
+    sampler = ConcurrentSampler({'a': counter(), 'b': counter()})
+    before = threading.active_count()
+    assert sampler.acquire(2)['b'][0].tolist() == [1.0, 2.0]
+    assert threading.active_count() == before
+
+
+def test_reader_errors_are_raised_and_workers_survive():
+    calls = [0]
+
+    def flaky():
+        calls[0] += 1
+        if calls[0] == 2:
+            raise IOError('power meter timeout')
+        return 1.0
+
+    with ConcurrentSampler({'wavelength': counter(), 'power': flaky}) as sampler:
+        with pytest.raises(IOError):
+            sampler.acquire(3)
+        assert len(sampler.acquire(3)['power'][0]) == 3
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from HistogramEngine import StreamingHistogram
+
+TIMEBASE = 1e-12
+BINCOUNT = 1000
+PERIOD = 1e-6
+
+
+def old_histogram(stoparray, timebase, bincount, period):
+    """The per-event loop of createHistogram that StreamingHistogram replaces."""
+    hist = [0] * bincount
+    for k in range(len(stoparray)):
+        tdiff = stoparray[k]
+        binNumber = int(tdiff * timebase * bincount / (period))
+        if binNumber >= bincount:
+            continue
+        else:
+            hist[binNumber] += 1
+    return np.array(hist)
+
+
+def test_matches_the_old_loop():
+    rng = np.random.default_rng(0)
+    window = PERIOD / TIMEBASE
+    stops = np.concatenate([
+        rng.uniform(0, window, 5000),
+        rng.uniform(-window, 0, 500),  # negative tags count from the end of the histogram
+        rng.uniform(window, 10 * window, 500),  # beyond the window: dropped
+        np.arange(0, window, window / BINCOUNT),  # exactly on the bin edges
+        [window, -window, 1e30, 1e300, 2.0 ** 63],  # would overflow int64 when cast unclipped
+    ])
+    rng.shuffle(stops)
+    histogram = StreamingHistogram(TIMEBASE, BINCOUNT, PERIOD, chunk_size=1000)
+    binned = histogram.accumulate(stops)
+    expected = old_histogram(stops.tolist(), TIMEBASE, BINCOUNT, PERIOD)
+    assert np.array_equal(histogram.hist[0], expected)
+    assert binned == expected.sum()
+    assert histogram.n_events == len(stops)
+
+
+def test_integer_tags_match_the_old_loop():
+    stops = np.random.default_rng(1).integers(-10 ** 6, 3 * 10 ** 6, 10000)
+    histogram = StreamingHistogram(TIMEBASE, BINCOUNT, PERIOD)
+    histogram.accumulate(stops)
+    assert np.array_equal(histogram.hist[0], old_histogram(stops.tolist(), TIMEBASE, BINCOUNT, PERIOD))
+
+
+@pytest.mark.parametrize('stop', [-1.5e6, -1e30, -1e300])
+def test_tags_more_than_a_window_before_zero_fail_like_the_old_loop(stop):
+    with pytest.raises(IndexError):
+        old_histogram([stop], TIMEBASE, BINCOUNT, PERIOD)
+    with pytest.raises(IndexError):
+        StreamingHistogram(TIMEBASE, BINCOUNT, PERIOD).accumulate([stop])
+
+
+def test_folding_and_channels():
+    histogram = StreamingHistogram(TIMEBASE, BINCOUNT, PERIOD, channels=2, fold=True)
+    stops = np.array([0.5e3, 1e6 + 0.5e3, 2e6 + 1.5e3, 10.5e3])
+    assert histogram.accumulate(stops, channel=np.array([0, 0, 1, 5])) == 3
+    assert histogram.hist[0, 0] == 2
+    assert histogram.hist[1, 1] == 1
+    assert histogram.hist.sum() == 3
+
+
+def test_accumulate_file_matches_accumulate(tmp_path):
+    stops = np.random.default_rng(2).uniform(0, 2e6, 20000)
+    path = str(tmp_path / 'stops.npy')
+    np.save(path, stops)
+    from_file = StreamingHistogram(TIMEBASE, BINCOUNT, PERIOD, chunk_size=4096)
+    from_file.accumulate_file(path)
+    in_memory = StreamingHistogram(TIMEBASE, BINCOUNT, PERIOD)
+    in_memory.accumulate(stops)
+    assert np.array_equal(from_file.hist, in_memory.hist)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from HomingCalibration import WavelengthCalibration
+
+
+def curved_offset(setpoint):
+    """Offset measured - setpoint of a laser over 1500-1501nm, curved enough to make a quadratic fit."""
+    return 0.02 + 0.01 * (setpoint - 1500.5) ** 2
+
+
+def calibrate(calibration, setpoints, offset):
+    for setpoint in setpoints:
+        calibration.add(setpoint, setpoint + offset(setpoint))
+
+
+def test_setpoint_inside_the_calibrated_range():
+    calibration = WavelengthCalibration()
+    calibrate(calibration, np.linspace(1500.0, 1501.0, 21), curved_offset)
+    setpoint = calibration.setpoint_for(1500.3)
+    assert setpoint + curved_offset(setpoint) == pytest.approx(1500.3, abs=1e-6)
+
+
+def test_no_extrapolation_beyond_the_calibrated_range():
+    calibration = WavelengthCalibration()
+    calibrate(calibration, np.linspace(1500.0, 1501.0, 21), curved_offset)
+    # The fitted quadratic would predict an offset of almost 9nm at 1530nm
+    assert calibration.offset(1530.0) == pytest.approx(curved_offset(1501.0), abs=1e-6)
+    assert calibration.offset(1470.0) == pytest.approx(curved_offset(1500.0), abs=1e-6)
+    assert calibration.setpoint_for(1530.0) == pytest.approx(1530.0 - curved_offset(1501.0), abs=1e-6)
+
+
+def test_learns_a_new_range():
+    calibration = WavelengthCalibration()
+    calibrate(calibration, np.linspace(1500.0, 1501.0, 21), curved_offset)
+    # Far away the offset differs by more than max_residual; scanning downwards, the later points of the new
+    # range lie inside the span of the samples but away from the old ones
+    new_offset = lambda setpoint: 0.2
+    new_range = np.linspace(1521.0, 1520.0, 21)
+    calibrate(calibration, new_range, new_offset)
+    assert len(calibration.setpoints) == 42
+    setpoint = calibration.setpoint_for(1520.5)
+    assert setpoint + new_offset(setpoint) == pytest.approx(1520.5, abs=0.01)
+
+
+def test_mode_hops_inside_the_range_are_ignored():
+    calibration = WavelengthCalibration()
+    calibrate(calibration, np.linspace(1500.0, 1501.0, 21), curved_offset)
+    calibration.add(1500.4, 1500.4 + curved_offset(1500.4) + 0.3)
+    assert len(calibration.setpoints) == 21
+    assert calibration.offset(1500.4) == pytest.approx(curved_offset(1500.4), abs=1e-6)
+
+
+def test_samples_are_saved_and_loaded(tmp_path):
+    path = str(tmp_path / 'calibration.npz')
+    calibration = WavelengthCalibration(path)
+    calibrate(calibration, np.linspace(1500.0, 1501.0, 5), curved_offset)
+    calibration.save()
+    loaded = WavelengthCalibration(path)
+    assert np.array_equal(loaded.setpoints, calibration.setpoints)
+    assert loaded.setpoint_for(1500.5) == pytest.approx(calibration.setpoint_for(1500.5))
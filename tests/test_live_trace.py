@@ -0,0 +1,50 @@
+import numpy as np
+
+from LiveTrace import LiveTrace, RingBuffer
+
+
+def test_ring_buffer_keeps_the_newest_samples_in_order():
+    ring = RingBuffer(5)
+    ring.extend([0, 1, 2], [10, 11, 12])
+    ring.extend([3, 4, 5, 6], [13, 14, 15, 16])
+    times, values = ring.view()
+    assert times.tolist() == [2, 3, 4, 5, 6] and values.tolist() == [12, 13, 14, 15, 16]
+    # A block longer than the capacity keeps only its tail
+    ring.extend(np.arange(7, 20), np.arange(17, 30))
+    assert ring.view()[0].tolist() == [15, 16, 17, 18, 19]
+
+
+def test_ring_buffer_matches_unbounded_lists():
+    rng = np.random.default_rng(0)
+    ring, times, values = RingBuffer(100), [], []
+    for _ in range(200):
+        n = int(rng.integers(0, 30))
+        block = np.arange(len(times), len(times) + n, dtype=float)
+        times.extend(block)
+        values.extend(block * 2)
+        ring.extend(block, block * 2)
+        ring_times, ring_values = ring.view()
+        assert ring_times.tolist() == times[-100:] and ring_values.tolist() == values[-100:]
+
+
+def test_view_is_bounded_and_covers_the_whole_session():
+    trace = LiveTrace(capacity=100, history=50, decimation=10)
+    for start in range(0, 2000, 7):
+        t = np.arange(start, min(start + 7, 2000), dtype=float)
+        trace.extend(t, np.sin(t))
+    times, values = trace.view()
+    assert len(times) == 140  # 40 history points older than the 100 recent samples
+    assert np.all(np.diff(times) > 0)
+    assert times[-100:].tolist() == list(range(1900, 2000))
+    # The history before the recent samples holds block averages of `decimation` samples
+    assert times[0] == np.arange(1500, 1510).mean()
+    assert values[0] == np.sin(np.arange(1500, 1510)).mean()
+
+
+def test_clear_empties_the_trace():
+    trace = LiveTrace(capacity=10, history=10, decimation=3)
+    trace.extend(np.arange(20.0), np.arange(20.0))
+    trace.clear()
+    assert len(trace.view()[0]) == 0
+    trace.extend([1.0, 2.0], [3.0, 4.0])
+    assert trace.view()[1].tolist() == [3.0, 4.0]
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from PIDTuner import VectorPID
+
+# AdaptivePID lives in LaserControl, which needs the lab environment
+pytest.importorskip('toptica')
+pytest.importorskip('lantz')
+pytest.importorskip('PyQt5')
+
+from LaserControl import AdaptivePID
+from PiezoLock import LockPID
+
+
+def error_sequences():
+    rng = np.random.default_rng(0)
+    n = 200
+    yield 'noise', 1e-4 * rng.standard_normal(n)
+    yield 'offset', 2e-4 + 2e-5 * rng.standard_normal(n)
+    yield 'oscillation', 3e-4 * (-1.0) ** np.arange(n) + 1e-5 * rng.standard_normal(n)
+    yield 'decay', 1e-3 * np.exp(-np.arange(n) / 20) * np.cos(np.arange(n) / 3)
+    yield 'steps', np.repeat(rng.uniform(-5e-4, 5e-4, n // 10), 10)
+
+
+@pytest.mark.parametrize('gains', [(0.9, 0.4, 0.0, 0.0005, 4), (1.13, 0.5, 0.1, 0.5, 6)])
+@pytest.mark.parametrize('name, errors', list(error_sequences()))
+def test_same_gains_on_same_errors(gains, name, errors):
+    P, I, D, integral_limit, n_errors = gains
+    target = 1530.0
+    options = dict(n_errors_for_adaptation=n_errors, integral_limit=integral_limit)
+    reference = AdaptivePID(P, I, D, target, **options)
+    vector = VectorPID(P, I, D, target, **options)
+    lock = LockPID(P, I, D, target, **options)
+
+    for error in errors:
+        wavelength = target - error
+        expected = reference.compute(wavelength)
+        np.testing.assert_allclose(vector.compute(wavelength), expected, rtol=1e-9, atol=1e-15)
+        np.testing.assert_allclose(lock.compute(wavelength), expected, rtol=1e-9, atol=1e-15)
+        for gain in ('Kp', 'Ki', 'Kd'):
+            assert float(getattr(vector, gain)) == getattr(reference, gain), gain
+            assert getattr(lock, gain) == getattr(reference, gain), gain
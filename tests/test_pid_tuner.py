@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from PIDTuner import DEFAULTS, HomingPlant, evaluate, learned_slope, tune
+
+
+def test_learned_slope_matches_the_plant():
+    plant = HomingPlant((1, 1))
+    slope = learned_slope(plant)
+    for voltage in (50.0, 70.0, 90.0):
+        step = 0.01
+        expected = (plant.piezo_shift(voltage + step) - plant.piezo_shift(voltage - step)) / (2 * step)
+        assert slope.slope(voltage) == pytest.approx(expected, rel=0.05)
+
+
+@pytest.mark.parametrize('stage', ['motor', 'piezo'])
+def test_tuned_gains_improve_on_the_defaults(stage):
+    result = tune(stage, trials=10)
+    best, default = result['best'], result['default']
+    assert best['failure rate'] <= default['failure rate']
+    assert best['mean iterations'] < default['mean iterations']
+
+    # The tuned gains also beat the defaults on starting points, drift and noise they were not tuned on
+    configs = {key: np.array([best[key], default[key]]) for key in DEFAULTS[stage]}
+    configs['n_errors_for_adaptation'] = configs['n_errors_for_adaptation'].astype(int)
+    iterations, converged = evaluate(stage, configs, trials=20, seed=1)
+    assert converged[0].mean() >= converged[1].mean()
+    assert iterations[0].mean() < iterations[1].mean()
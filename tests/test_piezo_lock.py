@@ -0,0 +1,35 @@
+import pytest
+
+# PiezoLock drives a laser session and uses the PID of LaserControl, which need the lab environment
+for module in ('toptica', 'lantz', 'PyQt5'):
+    pytest.importorskip(module)
+
+from PiezoLock import LockPID, PiezoLock
+from PiezoSlope import PiezoSlopeEstimator
+from SimulatedInstruments import simulated_instruments
+
+TARGET = 1530.0
+
+
+class FixedWavemeter:
+    def __init__(self, wavelength):
+        self.wavelength = wavelength
+
+    def measure_wavelength(self):
+        return self.wavelength
+
+
+def first_step(slope):
+    laser = simulated_instruments()['laser']
+    lock = PiezoLock(laser, FixedWavemeter(TARGET + 2e-4), TARGET, slope=slope, log=lambda message: None)
+    lock.tick(0.0)
+    return laser.piezo - 70.0
+
+
+def test_tick_converts_with_the_slope_estimate():
+    # A slope estimate far from the fixed -0.001338nm/V, so the two conversions differ clearly
+    slope = PiezoSlopeEstimator(slope=-0.002, curvature=-2e-5)
+    adjustment = LockPID(0.9, 0.4, 0, TARGET, integral_limit=0.0005).compute(TARGET + 2e-4)
+    assert first_step(slope) == pytest.approx(round(slope.volts_for(adjustment, 70.0), 3))
+    assert first_step(None) == pytest.approx(round(-adjustment / 0.001338, 3))
+    assert first_step(slope) != pytest.approx(first_step(None))
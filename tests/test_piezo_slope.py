@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from PiezoSlope import PiezoSlopeEstimator
+
+TRUE_SLOPE = -0.0012
+TRUE_CURVATURE = 2e-5
+
+
+def wavelength_change(v_from, v_to):
+    """Integral of the slope a + b (V - 70) from v_from to v_to."""
+    return TRUE_SLOPE * (v_to - v_from) + TRUE_CURVATURE * ((v_to - 70) ** 2 - (v_from - 70) ** 2) / 2
+
+
+def random_steps(estimator, n, rng, noise=2e-5):
+    voltage = 70.0
+    for _ in range(n):
+        target = np.clip(voltage + rng.uniform(-8, 8), 30, 110)
+        estimator.add(voltage, target, wavelength_change(voltage, target) + noise * rng.standard_normal())
+        voltage = target
+
+
+def test_learns_slope_and_curvature():
+    estimator = PiezoSlopeEstimator()
+    random_steps(estimator, 200, np.random.default_rng(0))
+    for voltage in (40.0, 70.0, 100.0):
+        assert estimator.slope(voltage) == pytest.approx(TRUE_SLOPE + TRUE_CURVATURE * (voltage - 70), rel=0.02)
+    # Steps clipped at the ends of the piezo range are too short to count
+    assert 150 < estimator.updates <= 200
+
+
+def test_volts_for_inverts_the_model():
+    estimator = PiezoSlopeEstimator()
+    random_steps(estimator, 200, np.random.default_rng(1), noise=0.0)
+    for voltage, change in ((50.0, 0.005), (90.0, -0.003)):
+        step = estimator.volts_for(change, voltage)
+        assert wavelength_change(voltage, voltage + step) == pytest.approx(change, rel=0.01)
+
+
+def test_small_steps_and_mode_hops_are_ignored():
+    estimator = PiezoSlopeEstimator()
+    theta = estimator.theta.copy()
+    estimator.add(70.0, 70.01, 1.0)
+    # A mode hop during the step moves the wavelength by far more than the piezo can
+    estimator.add(70.0, 75.0, 0.05)
+    assert estimator.updates == 0
+    assert np.array_equal(estimator.theta, theta)
+
+
+def test_uncertainty_never_exceeds_the_prior():
+    estimator = PiezoSlopeEstimator(forgetting=0.5)
+    for _ in range(50):
+        estimator.add(70.0, 70.1, wavelength_change(70.0, 70.1))
+    assert np.trace(estimator.P) <= np.trace(estimator.prior)
+
+
+def test_estimate_is_saved_and_loaded(tmp_path):
+    path = str(tmp_path / 'slope.npz')
+    estimator = PiezoSlopeEstimator(path)
+    random_steps(estimator, 50, np.random.default_rng(2))
+    estimator.save()
+    loaded = PiezoSlopeEstimator(path)
+    assert np.array_equal(loaded.theta, estimator.theta)
+    assert np.array_equal(loaded.P, estimator.P)
+    assert loaded.updates == 50
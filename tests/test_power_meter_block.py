@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from PowerMeterBlock import PowerBlockReader
+
+
+class FakeResource:
+    """VISA resource of a PM100D that answers READ? with consecutive powers in W."""
+
+    def __init__(self, averaging=7):
+        self.averaging = averaging
+        self.next_power = 1e-6
+        self.writes = []
+
+    def write(self, command):
+        self.writes.append(command)
+        name, value = command.split()
+        assert name == 'SENS:AVER:COUN'
+        self.averaging = int(value)
+
+    def query(self, command):
+        if command == 'SENS:AVER:COUN?':
+            return f'{self.averaging}\n'
+        replies = []
+        for request in command.split(';'):
+            assert request == 'READ?'
+            replies.append(f'{self.next_power:.6E}')
+            self.next_power += 1e-6
+        return ';'.join(replies)
+
+
+class FakePowerMeter:
+    def __init__(self, averaging=7):
+        self.resource = FakeResource(averaging)
+
+
+def test_configure_and_restore_the_averaging_count():
+    pmd = FakePowerMeter(averaging=7)
+    reader = PowerBlockReader(pmd, averaging=100)
+    reader.configure()
+    assert pmd.resource.averaging == 100
+    # Configuring again must not take the scan's own count as the one to restore
+    reader.configure()
+    reader.restore()
+    assert pmd.resource.averaging == 7
+    assert pmd.resource.writes == ['SENS:AVER:COUN 100', 'SENS:AVER:COUN 100', 'SENS:AVER:COUN 7']
+    reader.restore()
+    assert len(pmd.resource.writes) == 3
+
+
+def test_read_block_in_requests_of_block_size():
+    pmd = FakePowerMeter()
+    reader = PowerBlockReader(pmd, block=4)
+    powers, stamps = reader.read_block(10)
+    np.testing.assert_allclose(powers, np.arange(1, 11))
+    assert np.all(np.diff(stamps) >= 0)
+
+
+def test_simulated_meter_gets_its_count_back():
+    pytest.importorskip('toptica')  # SimulatedInstruments builds a laser session
+    from SimulatedInstruments import simulated_instruments
+    pmd = simulated_instruments()['pmd']
+    reader = PowerBlockReader(pmd, averaging=20)
+    reader.configure()
+    assert pmd.averaging == 20
+    reader.restore()
+    assert pmd.averaging == 1
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+from ReferenceInterpolator import ReferenceSpectrum
+
+
+def closest_points_lagrange(x_cor, y_cor, x_val):
+    """The per-point helpers the transmission spyrelet used before ReferenceSpectrum."""
+    indices = np.argsort(np.abs(np.array(x_cor) - x_val))[:3]
+    x, y = [x_cor[i] for i in indices], [y_cor[i] for i in indices]
+    return y[0] * (x_val - x[1]) * (x_val - x[2]) / ((x[0] - x[1]) * (x[0] - x[2])) + \
+        y[1] * (x_val - x[0]) * (x_val - x[2]) / ((x[1] - x[0]) * (x[1] - x[2])) + \
+        y[2] * (x_val - x[0]) * (x_val - x[1]) / ((x[2] - x[0]) * (x[2] - x[1]))
+
+
+def test_lagrange_matches_the_per_point_helpers_on_an_unsorted_reference():
+    rng = np.random.default_rng(0)
+    wavelength = rng.permutation(np.sort(rng.uniform(1500, 1510, 200)))
+    power = 1 + 0.1 * np.sin(wavelength) + 0.01 * rng.standard_normal(200)
+    x = rng.uniform(1499.5, 1510.5, 500)
+
+    expected = [closest_points_lagrange(list(wavelength), list(power), value) for value in x]
+    np.testing.assert_allclose(ReferenceSpectrum(wavelength, power)(x), expected, rtol=1e-9)
+
+
+def test_duplicate_wavelengths_are_averaged():
+    spectrum = ReferenceSpectrum([1501.0, 1500.0, 1501.0, 1502.0, 1503.0], [2.0, 1.0, 4.0, 5.0, 7.0])
+    assert spectrum(1501.0) == pytest.approx(3.0)
+    assert spectrum(np.array([1500.0, 1503.0])).tolist() == pytest.approx([1.0, 7.0])
+
+
+def test_normalize_divides_by_the_interpolated_reference():
+    wavelength = np.linspace(1500, 1510, 50)
+    spectrum = ReferenceSpectrum(wavelength, 2 + 0.01 * (wavelength - 1500) ** 2, method='spline')
+    x = np.array([1502.25, 1507.8])
+    np.testing.assert_allclose(spectrum.normalize(x, 2 + 0.01 * (x - 1500) ** 2), 1.0, rtol=1e-9)
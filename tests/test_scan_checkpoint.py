@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pytest
+
+from ScanCheckpoint import ScanCheckpoint, checkpoint_path, find_unfinished
+from ScanStorage import ScanWriter, load_scan
+
+SETTING = {"Input Start": 1500.0, "Input End": 1501.0, "Number of Repeating Measurement": np.int64(3)}
+INSTRUMENTS = {"Power Meter Averaging": 1}
+KEYS = ("Target wavelength", "RF power", "Laser wavelength", "Power")
+RF_POWERS = (10.0, 14.4)
+
+
+def write_point(writer, checkpoint, index, mark=True):
+    """One wavelength point with a row per RF power, as the scans write it."""
+    target = 1500.0 + 0.1 * index
+    for rf in RF_POWERS:
+        writer.append_point({"Target wavelength": target, "RF power": rf, "Laser wavelength": target + 1e-5, "Power": rf * index},
+                            {"wavelength": np.full(3, target), "power": np.arange(3) + index})
+    writer.append_timing({"homing": 0.5 * index})
+    if mark:
+        checkpoint.mark_done(index, target)
+
+
+def start_scan(directory):
+    data_file = os.path.join(str(directory), 'scan.h5')
+    writer = ScanWriter(data_file, SETTING, summary_keys=KEYS, timing_keys=("homing",))
+    checkpoint = ScanCheckpoint(data_file, 'reference', SETTING, INSTRUMENTS)
+    checkpoint.save()
+    return data_file, writer, checkpoint
+
+
+def test_checkpoint_round_trip(tmp_path):
+    data_file, writer, checkpoint = start_scan(tmp_path)
+    for index in range(3):
+        write_point(writer, checkpoint, index)
+    writer.close()
+    loaded = ScanCheckpoint.load(checkpoint_path(data_file))
+    assert loaded.completed == [[0, 1500.0], [1, 1500.1], [2, 1500.2]]
+    assert loaded.row(1) == 1 and loaded.row(5) is None
+    assert not loaded.finished
+    assert loaded.matches('reference', SETTING, INSTRUMENTS)
+    # numpy and Python scalars of the same value are the same setting
+    assert loaded.matches('reference', dict(SETTING, **{"Number of Repeating Measurement": 3}), INSTRUMENTS)
+    assert not os.path.exists(checkpoint.path + '.tmp')
+
+
+def test_find_unfinished_only_matches_the_same_scan(tmp_path):
+    data_file, writer, checkpoint = start_scan(tmp_path)
+    write_point(writer, checkpoint, 0)
+    writer.close()
+    assert find_unfinished(str(tmp_path), 'reference', SETTING, INSTRUMENTS).data_file == data_file
+    assert find_unfinished(str(tmp_path), 'transmission', SETTING, INSTRUMENTS) is None
+    assert find_unfinished(str(tmp_path), 'reference', dict(SETTING, **{"Input End": 1502.0}), INSTRUMENTS) is None
+    assert find_unfinished(str(tmp_path), 'reference', SETTING, {"Power Meter Averaging": 10}) is None
+    checkpoint.finish()
+    assert find_unfinished(str(tmp_path), 'reference', SETTING, INSTRUMENTS) is None
+
+
+def test_find_unfinished_skips_broken_and_orphaned_checkpoints(tmp_path):
+    data_file, writer, checkpoint = start_scan(tmp_path)
+    writer.close()
+    with open(os.path.join(str(tmp_path), 'broken.checkpoint.json'), 'w') as f:
+        f.write('{"data_file": ')
+    orphan = ScanCheckpoint(os.path.join(str(tmp_path), 'deleted.h5'), 'reference', SETTING, INSTRUMENTS)
+    time.sleep(0.01)
+    orphan.save()
+    assert find_unfinished(str(tmp_path), 'reference', SETTING, INSTRUMENTS).data_file == data_file
+
+
+def test_resume_drops_the_unmarked_point_and_appends(tmp_path):
+    data_file, writer, checkpoint = start_scan(tmp_path)
+    for index in range(3):
+        write_point(writer, checkpoint, index)
+    # The scan stops after writing point 3 but before its checkpoint entry
+    write_point(writer, checkpoint, 3, mark=False)
+    writer.file.flush()
+    writer.file.close()
+
+    checkpoint = find_unfinished(str(tmp_path), 'reference', SETTING, INSTRUMENTS)
+    n_done = len(checkpoint.completed)
+    writer = ScanWriter.resume(checkpoint.data_file, n_done * len(RF_POWERS), n_timing=n_done)
+    assert writer.n_points == 6 and writer.n_timing == 3 and writer.n_samples == 18
+    for index in range(n_done, 5):
+        write_point(writer, checkpoint, index)
+    writer.close()
+    checkpoint.finish()
+
+    data = load_scan(data_file, raw=True)
+    assert data["Target wavelength"] == pytest.approx(np.repeat(1500.0 + 0.1 * np.arange(5), len(RF_POWERS)))
+    assert data["RF power"].tolist() == list(RF_POWERS) * 5
+    assert data["Power"].tolist() == [rf * index for index in range(5) for rf in RF_POWERS]
+    assert data["Raw"]["sample_count"].tolist() == [3] * 10
+    assert data["Raw"]["power"].tolist() == [value for index in range(5) for rf in RF_POWERS for value in np.arange(3) + index]
+    assert data["Timing"]["homing"].tolist() == [0.5 * index for index in range(5)]
+    assert data["Experiment Setup"]["Input End"] == 1501.0
+    assert find_unfinished(str(tmp_path), 'reference', SETTING, INSTRUMENTS) is None
+    assert not os.path.exists(data_file + '.tmp')
+
+
+def test_resume_past_the_end_fails(tmp_path):
+    data_file, writer, checkpoint = start_scan(tmp_path)
+    write_point(writer, checkpoint, 0)
+    writer.close()
+    with pytest.raises(ValueError):
+        ScanWriter.resume(data_file, 4)
+
+
+def test_resume_after_a_crash(tmp_path):
+    # The writer process dies without closing the file, as after a lost connection or a reboot
+    other_control = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'other_control')
+    script = ("import os, sys; sys.path.insert(0, {!r}); sys.path.insert(0, {!r})\n"
+              "from test_scan_checkpoint import start_scan, write_point\n"
+              "data_file, writer, checkpoint = start_scan({!r})\n"
+              "for index in range(3):\n"
+              "    write_point(writer, checkpoint, index)\n"
+              "os._exit(1)\n").format(other_control, os.path.dirname(os.path.abspath(__file__)), str(tmp_path))
+    assert subprocess.run([sys.executable, '-c', script]).returncode == 1
+
+    checkpoint = find_unfinished(str(tmp_path), 'reference', SETTING, INSTRUMENTS)
+    writer = ScanWriter.resume(checkpoint.data_file, 2 * len(RF_POWERS), n_timing=2)
+    checkpoint.completed = checkpoint.completed[:2]
+    write_point(writer, checkpoint, 2)
+    writer.close()
+    data = load_scan(checkpoint.data_file)
+    assert data["Power"].tolist() == [rf * index for index in range(3) for rf in RF_POWERS]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from ScanStorage import ScanWriter, load_scan
+
+SETTING = {"Input Start": 1500.0, "Input End": 1501.0}
+REFERENCE_KEYS = ("reference_wavelength", "reference_power")
+
+
+def single_pass_writer(path):
+    return ScanWriter(path, SETTING, summary_keys=("Laser wavelength", "Power"),
+                      raw_keys=REFERENCE_KEYS + ("wavelength", "power"),
+                      raw_counts={key: "reference_sample_count" for key in REFERENCE_KEYS})
+
+
+def single_pass_point(writer, index, n_reference, n_sample):
+    writer.append_point({"Laser wavelength": 1500.0 + index, "Power": float(index)},
+                        {"reference_wavelength": np.full(n_reference, 1500.0 + index),
+                         "reference_power": np.arange(n_reference, dtype=float),
+                         "wavelength": np.full(n_sample, 1500.0 + index),
+                         "power": np.arange(n_sample, dtype=float) + 100})
+
+
+def test_streams_with_their_own_count_are_not_padded(tmp_path):
+    path = str(tmp_path / 'scan.h5')
+    writer = single_pass_writer(path)
+    for index, (n_reference, n_sample) in enumerate([(3, 5), (6, 2), (4, 4)]):
+        single_pass_point(writer, index, n_reference, n_sample)
+    writer.close()
+
+    raw = load_scan(path, raw=True)["Raw"]
+    assert raw["sample_count"].tolist() == [5, 2, 4]
+    assert raw["reference_sample_count"].tolist() == [3, 6, 4]
+    assert len(raw["power"]) == 11 and len(raw["reference_power"]) == 13
+    assert not np.isnan(raw["reference_power"]).any()
+    assert raw["reference_power"][3:9].tolist() == list(range(6))
+    assert raw["power"][5:7].tolist() == [100.0, 101.0]
+
+
+def test_streams_of_one_count_must_have_the_same_length(tmp_path):
+    writer = single_pass_writer(str(tmp_path / 'scan.h5'))
+    with pytest.raises(ValueError):
+        writer.append_point({}, {"reference_wavelength": np.zeros(3), "reference_power": np.zeros(2),
+                                 "wavelength": np.zeros(1), "power": np.zeros(1)})
+    writer.close()
+
+
+def test_resume_keeps_the_separate_counts(tmp_path):
+    path = str(tmp_path / 'scan.h5')
+    writer = single_pass_writer(path)
+    for index, (n_reference, n_sample) in enumerate([(3, 5), (6, 2), (4, 4)]):
+        single_pass_point(writer, index, n_reference, n_sample)
+    writer.close()
+
+    writer = ScanWriter.resume(path, 2)
+    assert writer.n_samples == 7 and writer.offsets["reference_sample_count"] == 9
+    single_pass_point(writer, 2, 1, 2)
+    writer.close()
+
+    data = load_scan(path, raw=True)
+    assert data["Power"].tolist() == [0.0, 1.0, 2.0]
+    assert data["Raw"]["sample_count"].tolist() == [5, 2, 2]
+    assert data["Raw"]["reference_sample_count"].tolist() == [3, 6, 1]
+    assert len(data["Raw"]["power"]) == 9 and len(data["Raw"]["reference_power"]) == 10
+
+
+def test_points_are_readable_while_the_scan_runs(tmp_path):
+    path = str(tmp_path / 'scan.h5')
+    writer = ScanWriter(path, SETTING)
+    for index in range(3):
+        writer.append_point({"Laser wavelength": 1500.0 + index, "Power": float(index)},
+                            {"wavelength": np.full(2, 1500.0 + index), "power": np.array([index, index + 0.5])})
+        data = load_scan(path, raw=True)
+        assert data["Laser wavelength"].tolist() == [1500.0 + i for i in range(index + 1)]
+        assert data["Raw"]["power"][-2:].tolist() == [index, index + 0.5]
+    assert data["Experiment Setup"] == SETTING
+    writer.close()
@@ -0,0 +1,98 @@
+import math
+import numpy as np
+import pytest
+
+from SequentialAveraging import RunningStats, SequentialStopping, RobustAverage, WavelengthAverage
+
+
+def test_running_stats_matches_numpy():
+    values = np.random.default_rng(0).normal(1530.0, 1e-4, 500)
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.mean == pytest.approx(values.mean(), abs=1e-10)
+    assert stats.variance == pytest.approx(values.var(ddof=1), rel=1e-6)
+    assert stats.sem == pytest.approx(values.std(ddof=1) / math.sqrt(len(values)), rel=1e-6)
+
+
+def test_sequential_stopping_waits_for_minimum_then_stops_when_converged():
+    stopping = SequentialStopping({'power': 0.01}, min_samples=10, max_samples=100)
+    for k in range(9):
+        stopping.add(power=1.0 + 1e-4 * (-1) ** k)
+        assert not stopping.done()
+        assert stopping.remaining() == 9 - k
+    stopping.add(power=1.0)
+    assert stopping.done()
+    assert stopping.remaining() == 0
+
+
+def test_sequential_stopping_stops_at_max_samples_without_convergence():
+    stopping = SequentialStopping({'power': 1e-9, 'wavelength': 1e-9}, min_samples=5, max_samples=20)
+    rng = np.random.default_rng(1)
+    while not stopping.done():
+        assert stopping.remaining() >= 1
+        stopping.add(power=rng.normal(), wavelength=rng.normal())
+    assert stopping.n == 20
+    assert not stopping.converged()
+
+
+def test_sequential_stopping_extend_does_not_count_samples():
+    stopping = SequentialStopping({'wavelength': 1.0, 'power': 1.0}, min_samples=3, max_samples=10)
+    stopping.extend('wavelength', [1.0, 1.1, 0.9, 1.0])
+    assert stopping.n == 0
+    assert stopping.stats['wavelength'].n == 4
+    stopping.reset()
+    assert stopping.stats['wavelength'].n == 0
+
+
+def test_sequential_stopping_needs_two_samples():
+    with pytest.raises(ValueError):
+        SequentialStopping({'power': 1.0}, min_samples=1)
+
+
+def test_robust_average_rejects_outliers():
+    rng = np.random.default_rng(2)
+    values = list(1530.0 + 2e-5 * rng.standard_normal(50))
+    values[10] = 1531.0  # mode hop
+    values[30] = 0.0  # glitch
+    averager = RobustAverage(max_samples=50)
+    averager.extend(values)
+    result = averager.result()
+    assert isinstance(result, WavelengthAverage)
+    assert result.count == 50
+    assert result.kept == 48
+    assert result == pytest.approx(1530.0, abs=2e-5)
+    assert result.spread < 1e-4
+
+
+def test_robust_average_stops_early_once_precise():
+    averager = RobustAverage(max_samples=100, precision=1e-4, min_samples=5)
+    rng = np.random.default_rng(3)
+    while not averager.done():
+        averager.add(1530.0 + 1e-5 * rng.standard_normal())
+    assert len(averager.values) == 5
+    assert averager.result().sem * averager.confidence <= 1e-4
+
+
+def test_robust_average_without_precision_takes_max_samples():
+    averager = RobustAverage(max_samples=7)
+    for k in range(6):
+        averager.add(1530.0)
+        assert not averager.done()
+    averager.add(1530.0)
+    assert averager.done()
+    assert averager.remaining() == 0
+    # Identical readings have no spread; the resolution keeps them all
+    assert averager.result().kept == 7
+
+
+def test_robust_average_ignores_readings_beyond_max_samples():
+    averager = RobustAverage(max_samples=3)
+    averager.extend([1.0, 1.0, 1.0, 5.0, 5.0])
+    assert averager.result() == 1.0
+    assert averager.result().count == 3
+
+
+def test_robust_average_without_readings():
+    with pytest.raises(ValueError):
+        RobustAverage(max_samples=3).result()
@@ -0,0 +1,63 @@
+import glob
+import os
+import numpy as np
+import pytest
+
+# The scans run inside the spyrelet, which needs the lab environment
+for module in ('spyre', 'lantz', 'toptica', 'PyQt5', 'pyqtgraph'):
+    pytest.importorskip(module)
+
+from ScanBenchmark import benchmark_scans
+from ScanStorage import load_scan
+from SimulatedInstruments import simulated_instruments
+
+SCANS = ('reference_scan', 'transmission_scan', 'single_pass_scan')
+C = 299792458
+AOM_SHIFT = 3 * 200 / 1e3  # GHz, '# of AOMs' times 'Windfreak frequency' of the benchmark parameters
+
+
+def laser_wavelength(stored):
+    """Undo the AOM shift the scans add to the measured wavelength."""
+    return C / (C / stored - AOM_SHIFT)
+
+
+def scan_file(directory, prefix):
+    files = glob.glob(os.path.join(str(directory), prefix + '_at_*.h5'))
+    assert len(files) == 1, files
+    return files[0]
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'Concurrent Sampling': True, 'Sequential Stopping': True, 'Minimum Repeating': 3},
+    {'Buffered Wavemeter': True, 'Power Block Readout': True, 'Settle Detection': True},
+], ids=['plain', 'concurrent-sequential', 'buffered-blocks'])
+def test_scans_measure_the_simulated_spectrum(tmp_path, options):
+    points = 6
+    results = benchmark_scans(points=points, repeats=5, out_dir=str(tmp_path), trace_memory=False,
+                              exp_overrides=options, scans=SCANS)
+    assert [result['scan'] for result in results] == list(SCANS)
+    for result in results:
+        assert result['points'] == points
+        assert result['virtual time'] > 0
+
+    # Same seed, so the same synthetic spectrum as the power meter of the run
+    spectrum = simulated_instruments()['pmd'].spectrum
+
+    reference = load_scan(scan_file(tmp_path, 'reference_power_measurement'))
+    np.testing.assert_allclose(reference["Target wavelength"], np.linspace(1500.0, 1501.0, points))
+    np.testing.assert_allclose(laser_wavelength(reference["Laser wavelength"]), reference["Target wavelength"], atol=1e-3)
+    assert np.all(reference["Power"] > 0)
+
+    for prefix in ('transmission_power_measurement', 'single_pass_measurement'):
+        data = load_scan(scan_file(tmp_path, prefix), raw=True)
+        wavelength = laser_wavelength(data["Laser wavelength"])
+        np.testing.assert_allclose(wavelength, data["Target wavelength"], atol=1e-3)
+        np.testing.assert_allclose(data["transmission_rate"], spectrum(wavelength), rtol=0.05, atol=0.02)
+        assert data["Raw"]["sample_count"].sum() == len(data["Raw"]["power"])
+        assert not np.isnan(data["Raw"]["power"]).any()
+        if prefix == 'single_pass_measurement':
+            assert data["Raw"]["reference_sample_count"].sum() == len(data["Raw"]["reference_power"])
+            assert not np.isnan(data["Raw"]["reference_power"]).any()
+        assert "Timing" in data
+    assert not glob.glob(os.path.join(str(tmp_path), '*.tmp'))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from UpdateBus import DeltaBuffer, UpdateBus
+
+
+class RecordingSignal:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, values):
+        self.emitted.append(values)
+
+
+def test_merged_deltas_rebuild_the_full_arrays():
+    bus, signal, receiver = UpdateBus(), RecordingSignal(), DeltaBuffer()
+    bus.register('temp', signal, policy='merge')
+    for sample in range(5):
+        bus.publish('temp', {'power': np.array([float(sample)])}, reset=sample == 0)
+    bus.flush()
+    bus.publish('temp', {'power': np.array([5.0, 6.0])})
+    bus.flush()
+    assert len(signal.emitted) == 2
+    for values in signal.emitted:
+        data = receiver.update(values)
+    assert data['power'].tolist() == [0, 1, 2, 3, 4, 5, 6]
+
+    # A reset drops the unsent deltas of the previous point as well
+    bus.publish('temp', {'power': np.array([7.0])})
+    bus.publish('temp', {'power': np.array([8.0])}, reset=True)
+    bus.flush()
+    assert receiver.update(signal.emitted[-1])['power'].tolist() == [8.0]
+
+
+def test_latest_keeps_only_the_newest_payload():
+    bus, signal = UpdateBus(), RecordingSignal()
+    bus.register('spectrum', signal)
+    for point in range(10):
+        bus.publish('spectrum', {'points': point})
+    bus.flush()
+    bus.flush()
+    assert signal.emitted == [{'points': 9}]
+
+
+def test_emissions_are_rate_limited():
+    bus, signal = UpdateBus(frame_rate=10), RecordingSignal()
+    bus.register('temp', signal, policy='merge')
+    bus.start()
+    for sample in range(1000):
+        bus.publish('temp', {'power': np.array([float(sample)])})
+    bus.stop()
+    assert len(signal.emitted) <= 3
+    assert sum(len(values['power']) for values in signal.emitted) == 1000
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        UpdateBus().register('temp', RecordingSignal(), policy='every')
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from WavemeterBuffer import RECORD, WavemeterBuffer, shared_wavemeter_buffer, release_wavemeter_buffer
+
+
+class FakeClock:
+    def __init__(self):
+        self.t = 100.0
+
+    def perf_counter(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+
+class FakeWavemeter:
+    """Bristol buffer that captures a sample every `period` seconds of the fake clock from `start` on."""
+
+    def __init__(self, clock, period=0.2, start=100.0, invalid=()):
+        self.clock = clock
+        self.period = period
+        self.start = start
+        self.invalid = set(invalid)
+        self.next_index = 0
+        self.running = False
+        self.starts = 0
+        self.stops = 0
+
+    def sample_time(self, index):
+        return self.start + index * self.period
+
+    def start_data(self):
+        self.running = True
+        self.starts += 1
+
+    def stop_data(self):
+        self.running = False
+        self.stops += 1
+
+    def fetch_buffer(self):
+        last = int((self.clock.t - self.start) // self.period)
+        indices = np.arange(self.next_index, last + 1)
+        self.next_index = last + 1
+        records = np.zeros(len(indices), dtype=RECORD)
+        records['index'] = indices
+        records['wavelength'] = 1530.0 + 1e-6 * indices
+        for k, index in enumerate(indices):
+            if index in self.invalid:
+                records['status'][k] = 1
+        return records
+
+
+@pytest.mark.parametrize('rate_error', [0.0, 0.01, -0.01])
+def test_timestamps_follow_the_instrument_clock(rate_error):
+    clock = FakeClock()
+    wm = FakeWavemeter(clock, period=0.2 * (1 + rate_error))
+    buffer = WavemeterBuffer(wm, period=0.2, clock=clock)
+    buffer.start()
+    reader = buffer.reader()
+    rng = np.random.default_rng(0)
+    errors = []
+    for _ in range(1500):
+        clock.sleep(rng.uniform(0.05, 0.6))
+        times, wavelengths = reader.drain()
+        index = np.round((wavelengths - 1530.0) / 1e-6)
+        errors.extend(times - wm.sample_time(index))
+    errors = np.abs(errors[len(errors) // 2:])
+    # A nominal-rate mapping would be off by seconds here after ~500s with a 1% rate error
+    assert errors.max() < 0.01
+    assert buffer.measured_period == pytest.approx(wm.period, rel=1e-3)
+
+
+def test_readers_see_every_valid_sample():
+    clock = FakeClock()
+    wm = FakeWavemeter(clock, invalid={3, 4})
+    buffer = WavemeterBuffer(wm, period=0.2, clock=clock)
+    buffer.start()
+    first, second = buffer.reader(), buffer.reader()
+    clock.sleep(1.0)
+    a = first.drain()[1]
+    clock.sleep(1.0)
+    a = np.append(a, first.drain()[1])
+    b = second.drain()[1]
+    assert np.array_equal(a, b)
+    # Samples captured before start() are dropped with the invalid ones
+    expected = [index for index in range(1, wm.next_index) if index not in (3, 4)]
+    assert np.array_equal(np.round((a - 1530.0) / 1e-6), expected)
+    assert len(first.drain()[1]) == 0
+
+
+def test_collect_waits_for_fresh_samples():
+    clock = FakeClock()
+    wm = FakeWavemeter(clock)
+    buffer = WavemeterBuffer(wm, period=0.2, clock=clock)
+    buffer.start()
+    clock.sleep(5.0)
+    times, wavelengths = buffer.collect(4)
+    assert len(wavelengths) == 4
+    # Samples captured before the call are skipped
+    assert times[0] >= 105.0 - 0.2
+
+
+def test_history_is_bounded():
+    clock = FakeClock()
+    wm = FakeWavemeter(clock)
+    buffer = WavemeterBuffer(wm, period=0.2, history=50, clock=clock)
+    buffer.start()
+    reader = buffer.reader()
+    for _ in range(40):
+        clock.sleep(1.0)
+        buffer.fetch()
+    assert buffer.stored < 50 + 6
+    assert len(reader.drain()[1]) == buffer.stored
+
+
+def test_shared_buffer_is_started_once_and_stopped_by_the_last_user():
+    clock = FakeClock()
+    wm = FakeWavemeter(clock)
+    first = shared_wavemeter_buffer(wm, period=0.2, clock=clock)
+    second = shared_wavemeter_buffer(wm, period=0.2, clock=clock)
+    assert first is second
+    assert wm.starts == 1
+    release_wavemeter_buffer(first)
+    assert wm.running
+    release_wavemeter_buffer(second)
+    assert not wm.running
+    assert wm.stops == 1
+    # A release after the last one is ignored
+    release_wavemeter_buffer(second)
+    assert wm.stops == 1
+    third = shared_wavemeter_buffer(wm, period=0.2, clock=clock)
+    assert third is not first
+    assert wm.starts == 2
+    release_wavemeter_buffer(third)